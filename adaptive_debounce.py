@@ -0,0 +1,127 @@
+"""
+Janela de debounce adaptativa por contato
+
+Em vez de esperar sempre DEBOUNCE_TIME, cada contato tem a janela calculada
+a partir do seu histórico de intervalos entre mensagens (Message.created_at):
+
+- Respostas interativas (botão/lista) e perguntas ("?") saem quase na hora
+- Quem costuma mandar mensagens em rajada ganha uma janela maior
+- Quem costuma mandar uma mensagem só ganha uma janela curta
+- Contatos sem histórico usam a janela padrão
+"""
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEBOUNCE_MIN_SECONDS = float(os.getenv("DEBOUNCE_MIN_SECONDS", "2"))
+DEBOUNCE_MAX_SECONDS = float(os.getenv("DEBOUNCE_MAX_SECONDS", "12"))
+INTERACTIVE_DEBOUNCE_SECONDS = 0.5
+QUESTION_DEBOUNCE_SECONDS = 1.5
+
+# Intervalos maiores que isso são turnos separados, não rajada
+BURST_GAP_SECONDS = 30.0
+# Mínimo de intervalos observados para confiar no perfil
+MIN_SAMPLES = 3
+# Quantas mensagens do histórico carregar do banco
+HISTORY_SIZE = 50
+
+
+@dataclass
+class ContactTypingProfile:
+    """Intervalos recentes entre mensagens de um contato"""
+    gaps: Deque[float] = field(default_factory=lambda: deque(maxlen=HISTORY_SIZE))
+    last_at: Optional[float] = None
+
+    def burst_gaps(self) -> List[float]:
+        return sorted(g for g in self.gaps if g <= BURST_GAP_SECONDS)
+
+
+class AdaptiveDebounce:
+    """Calcula a janela de debounce de cada contato"""
+
+    def __init__(self, default: float, max_contacts: int = 10000):
+        self.default = default
+        self._profiles: "OrderedDict[str, ContactTypingProfile]" = OrderedDict()
+        self._max_contacts = max_contacts
+        self._reasons: Dict[str, int] = {}
+        self._window_total = 0.0
+        self._window_count = 0
+
+    def needs_history(self, phone: str) -> bool:
+        """True se o perfil do contato ainda não foi carregado do banco"""
+        return phone not in self._profiles
+
+    def load_history(self, phone: str, timestamps: List[datetime]) -> None:
+        """
+        Inicializa o perfil a partir dos created_at das mensagens recebidas
+        (a mensagem atual já deve estar incluída).
+        """
+        profile = ContactTypingProfile()
+        ordered = sorted(t for t in timestamps if t is not None)
+        for previous, current in zip(ordered, ordered[1:]):
+            profile.gaps.append((current - previous).total_seconds())
+        profile.last_at = time.time()
+        self._store(phone, profile)
+
+    def observe(self, phone: str, at: float = None) -> None:
+        """Registra a chegada de uma mensagem (atualiza o perfil em memória)"""
+        at = time.time() if at is None else at
+        profile = self._profiles.get(phone)
+        if profile is None:
+            profile = ContactTypingProfile()
+        elif profile.last_at is not None:
+            profile.gaps.append(at - profile.last_at)
+        profile.last_at = at
+        self._store(phone, profile)
+
+    def _store(self, phone: str, profile: ContactTypingProfile) -> None:
+        self._profiles[phone] = profile
+        self._profiles.move_to_end(phone)
+        while len(self._profiles) > self._max_contacts:
+            self._profiles.popitem(last=False)
+
+    def window(self, phone: str, text: str, is_interactive: bool = False) -> float:
+        """Janela de debounce (segundos) para a mensagem que acabou de chegar"""
+        if is_interactive:
+            return self._record("interactive", INTERACTIVE_DEBOUNCE_SECONDS)
+
+        if text and text.rstrip().endswith("?"):
+            return self._record("question", QUESTION_DEBOUNCE_SECONDS)
+
+        profile = self._profiles.get(phone)
+        if profile is None or len(profile.gaps) < MIN_SAMPLES:
+            return self._record("default", self.default)
+
+        bursts = profile.burst_gaps()
+        burst_ratio = len(bursts) / len(profile.gaps)
+
+        # Contato costuma mandar uma mensagem por vez
+        if len(bursts) < MIN_SAMPLES or burst_ratio < 0.3:
+            return self._record("single", DEBOUNCE_MIN_SECONDS)
+
+        # Contato digita em rajadas: espera o intervalo típico (p75) com folga
+        p75 = bursts[int(0.75 * (len(bursts) - 1))]
+        window = min(max(p75 * 1.25 + 0.5, DEBOUNCE_MIN_SECONDS), DEBOUNCE_MAX_SECONDS)
+        return self._record("burst", window)
+
+    def _record(self, reason: str, window: float) -> float:
+        self._reasons[reason] = self._reasons.get(reason, 0) + 1
+        self._window_total += window
+        self._window_count += 1
+        return window
+
+    def stats(self) -> Dict[str, object]:
+        """Métricas: contatos com perfil, janela média e motivos das escolhas"""
+        avg = self._window_total / self._window_count if self._window_count else 0.0
+        return {
+            "profiles": len(self._profiles),
+            "avg_window_seconds": round(avg, 2),
+            "reasons": dict(self._reasons),
+        }
@@ -1,19 +1,32 @@
 """
 Agente de Campanhas usando LangGraph
 """
-from typing import TypedDict, Annotated, Sequence
+from typing import TypedDict, Annotated, Sequence, Optional, Dict, Any
+from dataclasses import dataclass
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 import os
-import traceback
+import re
+import time
 from dotenv import load_dotenv
 
 from tools import AGENT_TOOLS
+from tools.interaction_context import interaction_scope, get_interaction_context
+from whatsapp_formatter import format_for_whatsapp as format_whatsapp_text
+from metrics import LLM_CALL_SECONDS, TOOL_CALL_SECONDS
+from structured_logging import get_logger
+from tracing import traced_node
+from token_usage import RunUsage, usage_from_messages
 
 load_dotenv()
 
+logger = get_logger("agent")
+
+# Botões sugeridos no fim do texto: [texto do botão]
+BUTTON_PATTERN = re.compile(r'\[([^\]]{1,50})\]')
+
 
 class AgentState(TypedDict):
     """Estado do agente"""
@@ -22,9 +35,19 @@ class AgentState(TypedDict):
     contact_name: str
 
 
+@dataclass
+class AgentReply:
+    """Resposta de uma execução do agente: texto + payloads interativos"""
+    text: str
+    buttons: Optional[Dict[str, Any]] = None
+    list_data: Optional[Dict[str, Any]] = None
+    usage: Optional[RunUsage] = None  # tokens de cada chamada ao LLM (usage_metadata)
+
+
 # Inicializar o modelo
+LLM_MODEL = "gpt-4.1-mini"
 llm = ChatOpenAI(
-    model="gpt-4.1-mini",
+    model=LLM_MODEL,
     temperature=0.7,
     api_key=os.getenv("OPENAI_API_KEY")
 )
@@ -50,9 +73,6 @@ def call_model(state: AgentState):
     messages = state["messages"]
     contact_name = state.get("contact_name")
     
-    print(f"🔵 call_model: {len(messages)} mensagens no estado")
-    print(f"🔵 Última mensagem: {messages[-1].content[:100] if messages else 'VAZIO'}...")
-    
     # Adicionar system prompt se não houver SystemMessage ainda
     from langchain_core.messages import SystemMessage
     from datetime import datetime
@@ -288,34 +308,27 @@ O campo "saldo" (balance) retornado pela API do Facebook é o SALDO DEVEDOR.
 Seja prestativo e sempre confirme as ações realizadas.{name_context}""")
         messages = [system_msg] + messages
     
-    print(f"🔵 Invocando LLM com {len(messages)} mensagens...")
+    llm_start = time.perf_counter()
     try:
         response = llm_with_tools.invoke(messages)
-        print(f"🔵 LLM respondeu: {type(response)}")
+        elapsed = time.perf_counter() - llm_start
+        LLM_CALL_SECONDS.observe(elapsed, LLM_MODEL, "ok")
         
-        # Debug detalhado do response
-        if hasattr(response, 'content'):
-            content_str = str(response.content) if response.content else "VAZIO"
-            print(f"🔵 Conteúdo (len={len(content_str)}): {content_str[:100]}...")
-        else:
-            print(f"🔵 Response não tem 'content'")
-            
-        if hasattr(response, 'tool_calls'):
-            print(f"🔵 Tem tool_calls: {len(response.tool_calls) > 0}")
-            if response.tool_calls:
-                print(f"🔵 Tool calls: {[tc['name'] for tc in response.tool_calls]}")
+        tool_names = [tc["name"] for tc in (getattr(response, "tool_calls", None) or [])]
+        logger.info(
+            "llm_response", "🔵 LLM respondeu em %.0f ms (%d mensagens no contexto)", elapsed * 1000, len(messages),
+            conversation_id=state.get("conversation_id"), tool_calls=tool_names,
+            content_chars=len(str(response.content or ""))
+        )
+        logger.debug("llm_response_content", "🔵 Conteúdo: %s", response.content)
         
-        # Se response vazio, logar tudo
-        if not response.content and (not hasattr(response, 'tool_calls') or not response.tool_calls):
-            print(f"❌ RESPONSE COMPLETAMENTE VAZIO!")
-            print(f"❌ Response completo: {response}")
-            print(f"❌ Response dict: {response.dict() if hasattr(response, 'dict') else 'N/A'}")
+        # Resposta vazia: registrar tudo para investigar
+        if not response.content and not tool_names:
+            logger.error("llm_empty_response", "❌ LLM retornou resposta vazia: %r", response)
             
     except Exception as e:
-        print(f"❌ Erro ao invocar LLM: {e}")
-        print(f"❌ Tipo do erro: {type(e)}")
-        import traceback
-        traceback.print_exc()
+        LLM_CALL_SECONDS.observe(time.perf_counter() - llm_start, LLM_MODEL, "error")
+        logger.exception("llm_error", "❌ Erro ao invocar LLM (%s): %s", type(e).__name__, e)
         raise
     
     return {"messages": [response]}
@@ -326,46 +339,17 @@ def format_for_whatsapp(state: AgentState):
     messages = state["messages"]
     last_message = messages[-1]
     
-    if isinstance(last_message, AIMessage) and not hasattr(last_message, "tool_calls"):
-        content = last_message.content
-        
-        # Converter Markdown para WhatsApp
-        import re
-        
-        # REMOVER CHAMADAS DE FUNÇÃO QUE APARECEM NO TEXTO
-        # O GPT-4 às vezes retorna a sintaxe da tool call no conteúdo da mensagem
-        
-        # 1. Remove tudo desde "send_whatsapp_" até o fim da linha ou até encontrar 2 quebras de linha
-        content = re.sub(r'send_whatsapp_(?:buttons|list)\s*\(.*?\)\s*(?:\n|$)', '', content, flags=re.DOTALL)
-        
-        # 2. Remove blocos que parecem código/JSON isolados
-        # Procura por linhas com {, }, [, ], id:, title:, body_text:, buttons:
-        lines_to_keep = []
-        for line in content.split('\n'):
-            # Se a linha tem sintaxe de código, pular
-            if re.search(r'(?:body_text|buttons|title|id)\s*:', line):
-                continue
-            # Se a linha é só {, }, [, ], pular
-            if re.match(r'^\s*[\{\}\[\]]\s*$', line):
-                continue
-            lines_to_keep.append(line)
-        
-        content = '\n'.join(lines_to_keep)
-        
-        # Limpar linhas vazias extras que podem ter ficado após remoção
-        content = re.sub(r'\n\s*\n\s*\n+', '\n\n', content)
+    # tool_calls sempre existe no AIMessage (lista vazia quando não há chamadas)
+    if isinstance(last_message, AIMessage) and not last_message.tool_calls:
+        # Markdown -> WhatsApp e remoção de tool calls escritas no texto (uma passada)
+        content = format_whatsapp_text(last_message.content)
         
         # DETECTAR E CONVERTER BOTÕES ESCRITOS COMO TEXTO EM BOTÕES REAIS
         # Padrões aceitos:
         # - [texto do botão]
         # - [emoji texto]
         # - Geralmente aparecem no final da mensagem, em sequência
-        
-        # Procurar por 1-3 botões seguidos no final ou na última linha
-        button_pattern = r'\[([^\]]{1,50})\]'
-        
-        # Encontrar todas as ocorrências de botões
-        buttons_found = re.findall(button_pattern, content)
+        buttons_found = BUTTON_PATTERN.findall(content)
         
         # Filtrar apenas os últimos botões (provavelmente são sugestões)
         # Pegar os últimos 2-3 colchetes encontrados
@@ -376,7 +360,7 @@ def format_for_whatsapp(state: AgentState):
             
             # Se não há texto significativo após os colchetes, são botões
             if len(text_after_bracket) < 10:  # Pouco ou nenhum texto depois
-                print(f"🔧 Detectados {len(buttons_found)} botões no final: {buttons_found}")
+                logger.debug("buttons_detected", "🔧 Detectados %d botões no final: %s", len(buttons_found), buttons_found)
                 
                 # Encontrar onde começam os botões no texto
                 first_bracket_pos = content.find('[' + buttons_found[0] + ']')
@@ -385,8 +369,6 @@ def format_for_whatsapp(state: AgentState):
                 main_text = content[:first_bracket_pos].strip()
                 
                 # Criar botões reais
-                import tools.whatsapp_buttons
-                
                 buttons = []
                 for i, btn_text in enumerate(buttons_found[:3], 1):  # Máximo 3
                     clean_btn = btn_text.strip()
@@ -398,8 +380,8 @@ def format_for_whatsapp(state: AgentState):
                         "title": clean_btn
                     })
                 
-                # Definir botões pendentes
-                tools.whatsapp_buttons.pending_buttons = {
+                # Definir botões pendentes (contexto da execução atual)
+                get_interaction_context().buttons = {
                     "type": "button",
                     "body": {"text": main_text},
                     "action": {
@@ -416,7 +398,6 @@ def format_for_whatsapp(state: AgentState):
                     }
                 }
                 
-                print(f"✅ Criados {len(buttons)} botões: {[b['title'] for b in buttons]}")
                 
                 # Atualizar conteúdo sem os colchetes
                 last_message.content = main_text
@@ -424,31 +405,7 @@ def format_for_whatsapp(state: AgentState):
         
         # Se não encontrou padrão de botões, manter colchetes
         # (podem ser parte legítima do texto, ex: [Vorp Scale])
-        # Apenas remover se houver múltiplos colchetes vazios/suspeitos consecutivos
-        # Por ora, não remover nada - deixar como está
-        
-        # Headers ## -> negrito
-        content = re.sub(r'###?\s+(.*?)(?:\n|$)', r'*\1*\n', content)
-        
-        # Markdown bold ** -> WhatsApp bold *
-        content = re.sub(r'\*\*(.*?)\*\*', r'*\1*', content)
-        
-        # Markdown code ` -> remover
-        content = re.sub(r'`(.*?)`', r'\1', content)
-        
-        # Remover links markdown [texto](url) -> texto (url)
-        # Cuidado para não remover se já removemos botões
-        if '(' in content and ')' in content:
-            content = re.sub(r'\[(.*?)\]\((.*?)\)', r'\1 (\2)', content)
-        
-        # Limpar quebras de linha excessivas (mais de 2 seguidas)
-        content = re.sub(r'\n{3,}', r'\n\n', content)
-        
-        # Limpar espaços no final de linhas
-        content = '\n'.join(line.rstrip() for line in content.split('\n'))
-        
-        # Atualizar a mensagem
-        last_message.content = content.strip()
+        last_message.content = content
     
     return {"messages": messages}
 
@@ -471,15 +428,17 @@ async def call_tools(state: AgentState):
         # Find and execute the tool
         tool = next((t for t in AGENT_TOOLS if t.name == tool_name), None)
         if tool:
+            tool_start = time.perf_counter()
             try:
                 # Use ainvoke for async invocation (required in newer LangChain versions)
                 result = await tool.ainvoke(tool_args)
+                TOOL_CALL_SECONDS.observe(time.perf_counter() - tool_start, tool_name, "ok")
                 tool_messages.append(
                     ToolMessage(content=str(result), tool_call_id=tool_id)
                 )
             except Exception as e:
-                print(f"❌ Erro ao executar tool {tool_name}: {e}")
-                traceback.print_exc()
+                TOOL_CALL_SECONDS.observe(time.perf_counter() - tool_start, tool_name, "error")
+                logger.exception("tool_error", "❌ Erro ao executar tool %s: %s", tool_name, e, tool=tool_name)
                 tool_messages.append(
                     ToolMessage(content=f"Error: {str(e)}", tool_call_id=tool_id)
                 )
@@ -490,10 +449,10 @@ async def call_tools(state: AgentState):
 # Criar o grafo
 workflow = StateGraph(AgentState)
 
-# Adicionar nós
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", call_tools)
-workflow.add_node("format_whatsapp", format_for_whatsapp)
+# Adicionar nós (cada execução de nó vira um span no trace do turno)
+workflow.add_node("agent", traced_node("agent", call_model))
+workflow.add_node("tools", traced_node("tools", call_tools))
+workflow.add_node("format_whatsapp", traced_node("format_whatsapp", format_for_whatsapp))
 
 # Definir o ponto de entrada
 workflow.set_entry_point("agent")
@@ -518,18 +477,27 @@ workflow.add_edge("format_whatsapp", END)
 agent_graph = workflow.compile()
 
 
-async def run_agent(message: str, conversation_id: int = None, previous_messages: list = None, contact_name: str = None) -> str:
+async def run_agent(
+    message: str,
+    conversation_id: int = None,
+    previous_messages: list = None,
+    contact_name: str = None,
+    callbacks: list = None
+) -> AgentReply:
     """
     Executa o agente com uma mensagem
     
     Args:
         message: Mensagem atual do usuário
         conversation_id: ID da conversação
-        previous_messages: Lista de mensagens anteriores do banco de dados (últimas 5)
+        previous_messages: Mensagens anteriores (últimas 5): linhas do banco ou
+            mensagens do LangChain já convertidas (histórico em memória)
         contact_name: Nome do contato para personalização
+        callbacks: Callbacks do LangChain para a execução (ex: log das ferramentas)
     
     Returns:
-        Resposta do agente
+        AgentReply com o texto e os botões/lista preparados nesta execução
+        (cada execução tem seu próprio contexto, então conversas podem rodar em paralelo)
     """
     # Construir histórico de mensagens
     messages = []
@@ -537,7 +505,9 @@ async def run_agent(message: str, conversation_id: int = None, previous_messages
     # Adicionar mensagens anteriores ao contexto
     if previous_messages:
         for msg in previous_messages:
-            if msg.direction == "incoming":
+            if isinstance(msg, BaseMessage):
+                messages.append(msg)
+            elif msg.direction == "incoming":
                 messages.append(HumanMessage(content=msg.text))
             elif msg.direction == "outgoing":
                 messages.append(AIMessage(content=msg.text))
@@ -551,7 +521,11 @@ async def run_agent(message: str, conversation_id: int = None, previous_messages
         "contact_name": contact_name
     }
     
-    result = await agent_graph.ainvoke(initial_state)
+    with interaction_scope() as interaction:
+        result = await agent_graph.ainvoke(initial_state, config={"callbacks": callbacks} if callbacks else None)
+    
+    # Tokens reais das chamadas ao LLM desta execução (o histórico vem antes no estado)
+    usage = usage_from_messages(result["messages"][len(messages):], LLM_MODEL)
     
     # Retornar a última mensagem do agente
     last_message = result["messages"][-1]
@@ -559,10 +533,15 @@ async def run_agent(message: str, conversation_id: int = None, previous_messages
     
     # Validar resposta não vazia
     if not response or not response.strip():
-        print("⚠️ Agente retornou resposta vazia, usando fallback")
-        return "Desculpe, não consegui processar sua solicitação. Pode reformular a pergunta?"
+        logger.warning("agent_empty_reply", "⚠️ Agente retornou resposta vazia, usando fallback", conversation_id=conversation_id)
+        response = "Desculpe, não consegui processar sua solicitação. Pode reformular a pergunta?"
     
-    return response
+    return AgentReply(
+        text=response,
+        buttons=interaction.buttons,
+        list_data=interaction.list_data,
+        usage=usage
+    )
 
 
 # NOTA: O system prompt real está implementado dentro da função call_model() (linhas ~64-261)
@@ -0,0 +1,245 @@
+"""
+Gravação em lote dos AgentLog (auditoria e tempos por etapa)
+
+Em vez de um commit por evento no caminho da requisição, os registros ficam
+num buffer em memória e uma task em background grava tudo de uma vez a cada
+AGENT_LOG_BATCH_SIZE registros ou AGENT_LOG_FLUSH_MS milissegundos.
+
+Ações registradas (AgentLog.action):
+- receive_message: webhook recebeu e salvou a mensagem
+- agent_run: execução completa do agente para a pilha
+- tool_call: cada ferramenta chamada pelo agente
+- send_message: envio da resposta (tempo desde enfileirar até salvar)
+- error: falha no processamento
+
+`execution_time` é preenchido em milissegundos.
+"""
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+from uuid import UUID
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("agent_log_writer")
+
+AGENT_LOG_BATCH_SIZE = int(os.getenv("AGENT_LOG_BATCH_SIZE", "100"))
+AGENT_LOG_FLUSH_MS = int(os.getenv("AGENT_LOG_FLUSH_MS", "500"))
+AGENT_LOG_MAX_BUFFER = 10000  # com o banco fora do ar, descarta os mais antigos
+AGENT_LOG_MAX_ATTEMPTS = int(os.getenv("AGENT_LOG_MAX_ATTEMPTS", "3"))  # por registro rejeitado
+
+
+def elapsed_ms(start: float) -> int:
+    return int((time.perf_counter() - start) * 1000)
+
+
+class AgentLogWriter:
+    """Buffer de AgentLog gravado em lote por uma task em background"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        batch_size: int = AGENT_LOG_BATCH_SIZE,
+        flush_ms: int = AGENT_LOG_FLUSH_MS,
+        max_buffer: int = AGENT_LOG_MAX_BUFFER,
+        max_attempts: int = AGENT_LOG_MAX_ATTEMPTS
+    ):
+        if session_factory is None:
+            from database import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_attempts = max(1, max_attempts)
+        # (tentativas que falharam, registro)
+        self._buffer: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=max_buffer)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._written = 0
+        self._dropped = 0
+        self._discarded = 0
+        self._flushes = 0
+        self._failures = 0
+        self._last_flush_ms = 0.0
+
+    def record(
+        self,
+        action: str,
+        conversation_id: Optional[int] = None,
+        input_data: Optional[Dict[str, Any]] = None,
+        output_data: Optional[Dict[str, Any]] = None,
+        status: str = "success",
+        error_message: Optional[str] = None,
+        execution_time: Optional[int] = None
+    ) -> None:
+        """Enfileira um registro (não bloqueia, não acessa o banco)"""
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+        self._buffer.append((0, {
+            "conversation_id": conversation_id,
+            "action": action,
+            "input_data": input_data,
+            "output_data": output_data,
+            "status": status,
+            "error_message": error_message,
+            "execution_time": execution_time,
+        }))
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    @contextmanager
+    def timed(self, action: str, conversation_id: Optional[int] = None, input_data: Optional[Dict[str, Any]] = None):
+        """
+        Mede o bloco e registra com execution_time; exceções viram status 'error'.
+        O dicionário retornado pode ser preenchido com o output_data.
+        """
+        output: Dict[str, Any] = {}
+        start = time.perf_counter()
+        try:
+            yield output
+        except Exception as e:
+            self.record(action, conversation_id, input_data, output or None, "error", str(e), elapsed_ms(start))
+            raise
+        self.record(action, conversation_id, input_data, output or None, "success", None, elapsed_ms(start))
+
+    async def _insert(self, rows) -> None:
+        from sqlalchemy import insert
+        from models import AgentLog
+
+        async with self._session_factory() as db:
+            await db.execute(insert(AgentLog), [row for _, row in rows])
+            await db.commit()
+
+    async def _insert_bisect(self, rows) -> list:
+        """
+        Grava `rows` dividindo o lote ao meio a cada falha, para que um registro
+        inválido não segure os outros. Devolve os registros que falharam sozinhos.
+        """
+        try:
+            await self._insert(rows)
+            return []
+        except Exception as e:
+            if len(rows) == 1:
+                logger.warning("agent_log_row_failed", "⚠️ AgentLog %s rejeitado: %s", rows[0][1]["action"], e)
+                return list(rows)
+        middle = len(rows) // 2
+        return await self._insert_bisect(rows[:middle]) + await self._insert_bisect(rows[middle:])
+
+    async def flush(self) -> int:
+        """
+        Grava tudo o que está no buffer em uma única transação. Se o lote falhar
+        por causa dos dados, grava por metades; registros que continuam falhando
+        voltam ao buffer e são descartados após AGENT_LOG_MAX_ATTEMPTS tentativas.
+        Banco indisponível (OperationalError) devolve o lote inteiro sem contar tentativa.
+        """
+        if not self._buffer:
+            return 0
+
+        from sqlalchemy.exc import OperationalError
+
+        rows = list(self._buffer)
+        self._buffer.clear()
+        start = time.perf_counter()
+        try:
+            await self._insert(rows)
+            failed = []
+        except OperationalError as e:
+            self._failures += 1
+            # Devolve ao buffer para a próxima tentativa (limitado por max_buffer)
+            self._buffer.extendleft(reversed(rows))
+            logger.error("agent_log_flush_failed", "❌ Erro ao gravar %d AgentLog(s): %s", len(rows), e)
+            return 0
+        except Exception as e:
+            self._failures += 1
+            logger.error("agent_log_flush_failed", "❌ Lote de %d AgentLog(s) rejeitado, gravando por partes: %s", len(rows), e)
+            failed = await self._insert_bisect(rows)
+
+        retry = [(attempts + 1, row) for attempts, row in failed if attempts + 1 < self.max_attempts]
+        self._discarded += len(failed) - len(retry)
+        if len(failed) > len(retry):
+            logger.error("agent_log_discarded", "❌ %d AgentLog(s) descartado(s) após %d tentativas", len(failed) - len(retry), self.max_attempts)
+        self._buffer.extendleft(reversed(retry))
+
+        written = len(rows) - len(failed)
+        self._written += written
+        self._flushes += 1
+        self._last_flush_ms = (time.perf_counter() - start) * 1000
+        return written
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Inicia a task de gravação no event loop atual"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Para a task e grava o que sobrou (shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": len(self._buffer),
+            "written_total": self._written,
+            "flushes": self._flushes,
+            "failures": self._failures,
+            "dropped": self._dropped,
+            "discarded": self._discarded,
+            "last_flush_ms": round(self._last_flush_ms, 1),
+        }
+
+
+class ToolCallLogger(BaseCallbackHandler):
+    """Callback do LangChain que registra cada chamada de ferramenta do agente"""
+
+    def __init__(self, writer: AgentLogWriter, conversation_id: Optional[int]):
+        self.writer = writer
+        self.conversation_id = conversation_id
+        self._started: Dict[UUID, tuple] = {}
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._started[run_id] = (name, input_str, time.perf_counter())
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        name, input_str, start = self._started.pop(run_id, ("tool", None, time.perf_counter()))
+        self.writer.record(
+            "tool_call",
+            self.conversation_id,
+            input_data={"tool": name, "input": str(input_str)[:1000]},
+            output_data={"output_chars": len(str(getattr(output, "content", output)))},
+            execution_time=elapsed_ms(start)
+        )
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        name, input_str, start = self._started.pop(run_id, ("tool", None, time.perf_counter()))
+        self.writer.record(
+            "tool_call",
+            self.conversation_id,
+            input_data={"tool": name, "input": str(input_str)[:1000]},
+            status="error",
+            error_message=str(error),
+            execution_time=elapsed_ms(start)
+        )
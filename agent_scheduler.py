@@ -0,0 +1,127 @@
+"""
+Agendador de execuções do agente
+
+- No máximo uma execução em andamento por conversa (chave = telefone)
+- Mensagens que chegam durante a execução marcam a conversa para uma nova
+  rodada, que junta tudo o que chegou no meio tempo
+- Pool global de workers limita quantas execuções rodam ao mesmo tempo
+- Fila justa: cada conversa ocupa no máximo uma posição na fila e volta
+  para o fim dela ao ser reexecutada, então a rajada de um contato não
+  atrasa os outros
+"""
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("agent_scheduler")
+
+AGENT_MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", "4"))
+
+
+class ConversationScheduler:
+    """Executa `handler(chave)` com serialização por chave e pool limitado"""
+
+    def __init__(self, handler: Callable[[str], Awaitable[None]], max_workers: int = AGENT_MAX_WORKERS):
+        self._handler = handler
+        self.max_workers = max_workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Dict[str, float] = {}  # chave -> momento em que entrou na fila
+        self._in_flight: Set[str] = set()
+        self._rerun: Set[str] = set()
+        self._workers: List[asyncio.Task] = []
+        self._completed = 0
+        self._last_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, key: str) -> None:
+        """Pede uma execução para a chave (idempotente enquanto pendente)"""
+        if key in self._in_flight:
+            # Junta na próxima rodada, depois que a atual terminar
+            self._rerun.add(key)
+            return
+        if key in self._queued:
+            return
+
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queued[key] = time.monotonic()
+        self._queue.put_nowait(key)
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._queue.get()
+            queued_at = self._queued.pop(key, time.monotonic())
+            self._record_wait(time.monotonic() - queued_at)
+
+            self._in_flight.add(key)
+            try:
+                await self._handler(key)
+            except Exception as e:
+                logger.exception("agent_run_failed", "❌ Erro na execução do agente para %s: %s", key, e)
+            finally:
+                self._in_flight.discard(key)
+                self._completed += 1
+                if key in self._rerun:
+                    self._rerun.discard(key)
+                    self.submit(key)  # Volta para o fim da fila
+                # Depois da reexecução entrar na fila, para drain() não terminar antes dela
+                self._queue.task_done()
+
+    def _record_wait(self, wait: float) -> None:
+        self._last_wait = wait
+        self._max_wait = max(self._max_wait, wait)
+
+    def is_running(self, key: str) -> bool:
+        return key in self._in_flight
+
+    def start(self) -> None:
+        """Inicia os workers no event loop atual"""
+        if self._workers:
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.max_workers)
+        ]
+
+    async def drain(self, timeout: float = 5.0) -> bool:
+        """
+        Aguarda a fila e as execuções em andamento terminarem e para os workers
+        (shutdown). Retorna False se o tempo acabou: o restante é cancelado e as
+        mensagens são retomadas no próximo startup (recover_pending_stacks).
+        """
+        drained = True
+        if self._queue is not None and self._workers:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                drained = False
+                logger.warning(
+                    "agent_drain_timeout", "⚠️ %d execução(ões) do agente interrompida(s) no shutdown",
+                    len(self._in_flight) + len(self._queued)
+                )
+        self.stop()
+        return drained
+
+    def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+
+    def stats(self) -> Dict[str, float]:
+        """Métricas: fila, execuções em andamento e espera na fila"""
+        return {
+            "workers": self.max_workers,
+            "queued": len(self._queued),
+            "in_flight": len(self._in_flight),
+            "rerun_pending": len(self._rerun),
+            "completed_total": self._completed,
+            "last_wait_ms": round(self._last_wait * 1000, 1),
+            "max_wait_ms": round(self._max_wait * 1000, 1),
+        }
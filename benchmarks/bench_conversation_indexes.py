@@ -0,0 +1,162 @@
+"""
+Benchmark dos índices compostos das consultas quentes de conversa (migração 0002)
+
+Cria um SQLite temporário com N mensagens, roda as consultas do caminho
+quente sem e com os índices e mostra o plano (EXPLAIN QUERY PLAN) e o tempo.
+
+Uso:
+    python benchmarks/bench_conversation_indexes.py [mensagens] [conversas]
+
+Padrão: 1.000.000 mensagens em 20.000 conversas.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOTAL_MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+TOTAL_CONVERSATIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+LOOKUPS = 200
+CHUNK = 50_000
+
+# Banco temporário (definido antes de importar database)
+db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+from sqlalchemy import select, text  # noqa: E402
+from database import Base, engine, SessionLocal  # noqa: E402
+from models import Message, Conversation  # noqa: E402
+
+HOT_INDEXES = {
+    "ix_messages_conversation_created",
+    "ix_messages_conversation_direction_created",
+    "ix_messages_contact_direction_created",
+    "ix_conversations_contact_status",
+}
+
+QUERIES = {
+    "últimas 5 mensagens da conversa": lambda cid: (
+        select(Message).where(Message.conversation_id == cid)
+        .order_by(Message.created_at.desc()).limit(5)
+    ),
+    "última resposta do bot": lambda cid: (
+        select(Message).where(Message.conversation_id == cid, Message.direction == "outgoing")
+        .order_by(Message.created_at.desc()).limit(1)
+    ),
+    "conversa ativa do contato": lambda cid: (
+        select(Conversation).where(Conversation.contact_id == cid, Conversation.status == "active").limit(1)
+    ),
+}
+
+
+def populate():
+    """Cria as tabelas sem os índices novos e insere os dados em lote"""
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for name in HOT_INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.executemany(
+            "INSERT INTO contacts (id, phone, name) VALUES (?, ?, ?)",
+            [(i, f"55{i:011d}@s.whatsapp.net", f"Contato {i}") for i in range(1, TOTAL_CONVERSATIONS + 1)]
+        )
+        cursor.executemany(
+            "INSERT INTO conversations (id, contact_id, status) VALUES (?, ?, ?)",
+            [(i, i, "active" if i % 4 else "closed") for i in range(1, TOTAL_CONVERSATIONS + 1)]
+        )
+
+        start = datetime(2025, 1, 1)
+        rng = random.Random(42)
+        for offset in range(0, TOTAL_MESSAGES, CHUNK):
+            rows = []
+            for i in range(offset, min(offset + CHUNK, TOTAL_MESSAGES)):
+                conversation_id = rng.randint(1, TOTAL_CONVERSATIONS)
+                direction = "incoming" if i % 2 else "outgoing"
+                rows.append((
+                    conversation_id,
+                    conversation_id,
+                    direction,
+                    f"mensagem {i} da conversa {conversation_id}",
+                    (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+                ))
+            cursor.executemany(
+                "INSERT INTO messages (conversation_id, contact_id, direction, text, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def query_plan(statement) -> str:
+    compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    return " | ".join(row[-1] for row in rows)
+
+
+def measure(label: str) -> dict:
+    rng = random.Random(7)
+    ids = [rng.randint(1, TOTAL_CONVERSATIONS) for _ in range(LOOKUPS)]
+    results = {}
+
+    print(f"\n=== {label} ===")
+    db = SessionLocal()
+    try:
+        for name, build in QUERIES.items():
+            print(f"- {name}")
+            print(f"  plano: {query_plan(build(1))}")
+
+            start = time.perf_counter()
+            for cid in ids:
+                db.execute(build(cid)).all()
+            elapsed = time.perf_counter() - start
+
+            per_query_ms = elapsed / LOOKUPS * 1000
+            results[name] = per_query_ms
+            print(f"  {per_query_ms:.3f} ms/consulta ({LOOKUPS} consultas)")
+    finally:
+        db.close()
+    return results
+
+
+def main():
+    print(f"📦 Populando {TOTAL_MESSAGES:,} mensagens em {TOTAL_CONVERSATIONS:,} conversas ({db_path})")
+    start = time.perf_counter()
+    populate()
+    print(f"   pronto em {time.perf_counter() - start:.1f}s")
+
+    before = measure("sem índices compostos")
+
+    start = time.perf_counter()
+    for table in (Message.__table__, Conversation.__table__):
+        for index in table.indexes:
+            if index.name in HOT_INDEXES:
+                index.create(engine)
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+    print(f"\n🔧 Índices criados em {time.perf_counter() - start:.1f}s")
+
+    after = measure("com índices compostos (migração 0002)")
+
+    print("\n=== resumo ===")
+    for name in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:<35} {before[name]:>9.3f} ms -> {after[name]:>7.3f} ms  ({speedup:,.0f}x)")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        engine.dispose()
+        shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
@@ -0,0 +1,292 @@
+"""
+Teste de carga ponta a ponta: webhooks assinados -> agente -> envio no WhatsApp
+
+Sobe o benchmarks/meta_simulator.py numa thread (Graph API, Cloud API e LLM
+compatível com a OpenAI), aponta a aplicação para ele e dispara webhooks
+assinados (X-Hub-Signature-256) contra `main.app` em chegadas de Poisson, a
+taxas crescentes. Cada mensagem vem de um contato novo, então a latência de
+uma resposta é do POST do webhook até a primeira mensagem entregue àquele
+número no simulador.
+
+Para cada taxa mostra p50/p95/p99 da latência ponta a ponta, a mesma latência
+sem a janela de debounce (só o pipeline), o tempo de resposta do webhook e a
+taxa atingida. A taxa máxima sustentável é a maior em que todas as respostas
+chegaram, o p95 ficou dentro do SLO e a taxa atingida foi >= 95% da pedida.
+
+Uso:
+    python benchmarks/bench_load.py [--rates 2,5,10,20] [--duration 20]
+        [--debounce 1.0] [--slo-p95 10] [--workers 4] [--llm-ms 700]
+        [--graph-ms 150] [--whatsapp-ms 80] [--error-rate 0.0]
+
+Latências, erros, paginação e roteiro de ferramentas do simulador também
+aceitam as variáveis SIM_* (ver SimulatorConfig).
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from meta_simulator import API_VERSION, MetaSimulator, SimulatorConfig, SimulatorServer  # noqa: E402
+
+APP_SECRET = "bench-secret"
+PHONE_NUMBER_ID = "100000000000000"
+ACHIEVED_RATE_FLOOR = 0.95
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Teste de carga do pipeline de mensagens")
+    parser.add_argument("--rates", default="2,5,10,20", help="mensagens/s por etapa, separadas por vírgula")
+    parser.add_argument("--duration", type=float, default=20.0, help="segundos de chegadas por etapa")
+    parser.add_argument("--drain", type=float, default=30.0, help="segundos extras esperando respostas")
+    parser.add_argument("--debounce", type=float, default=1.0, help="janela de empilhamento (s)")
+    parser.add_argument("--slo-p95", type=float, default=10.0, help="p95 ponta a ponta aceitável (s)")
+    parser.add_argument("--workers", type=int, default=4, help="AGENT_MAX_WORKERS")
+    parser.add_argument("--llm-ms", type=float, help="latência do LLM simulado")
+    parser.add_argument("--graph-ms", type=float, help="latência da Graph API simulada")
+    parser.add_argument("--whatsapp-ms", type=float, help="latência da Cloud API simulada")
+    parser.add_argument("--error-rate", type=float, help="fração de 5xx na Graph e na Cloud API")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+def build_config(args) -> SimulatorConfig:
+    config = SimulatorConfig.from_env()
+    if args.llm_ms is not None:
+        config.llm_latency_ms = args.llm_ms
+    if args.graph_ms is not None:
+        config.graph_latency_ms = args.graph_ms
+    if args.whatsapp_ms is not None:
+        config.whatsapp_latency_ms = args.whatsapp_ms
+    if args.error_rate is not None:
+        config.graph_error_rate = config.whatsapp_error_rate = args.error_rate
+    return config
+
+
+def configure_app_env(simulator_url: str, workers: int) -> None:
+    """Variáveis lidas no import de main (definidas antes de importá-lo)"""
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_load.db")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "FACEBOOK_GRAPH_URL": f"{simulator_url}/{API_VERSION}",
+        "FACEBOOK_ACCESS_TOKEN": "bench-token",
+        "WHATSAPP_API_URL": f"{simulator_url}/{API_VERSION}",
+        "WHATSAPP_ACCESS_TOKEN": "bench-token",
+        "WHATSAPP_PHONE_NUMBER_ID": PHONE_NUMBER_ID,
+        "WHATSAPP_APP_SECRET": APP_SECRET,
+        "WHATSAPP_DISABLE_SIGNATURE_VALIDATION": "false",
+        "OPENAI_BASE_URL": f"{simulator_url}/v1",
+        "OPENAI_API_BASE": f"{simulator_url}/v1",
+        "OPENAI_API_KEY": "sk-bench",
+        "AGENT_MAX_WORKERS": str(workers),
+        "RETENTION_ENABLED": "false",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+
+
+def webhook_payload(phone: str, text: str) -> bytes:
+    return json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "bench",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"phone_number_id": PHONE_NUMBER_ID},
+                    "contacts": [{"wa_id": phone, "profile": {"name": f"Carga {phone[-4:]}"}}],
+                    "messages": [{
+                        "from": phone,
+                        "id": f"wamid.BENCH{uuid.uuid4().hex}",
+                        "timestamp": str(int(time.time())),
+                        "type": "text",
+                        "text": {"body": text},
+                    }],
+                },
+            }],
+        }],
+    }).encode()
+
+
+def sign(body: bytes) -> str:
+    return "sha256=" + hmac.new(APP_SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(label: str, values) -> str:
+    if not values:
+        return f"{label:<24} (sem amostras)"
+    return (
+        f"{label:<24} p50 {percentile(values, 50):7.3f}s  p95 {percentile(values, 95):7.3f}s  "
+        f"p99 {percentile(values, 99):7.3f}s  máx {max(values):7.3f}s"
+    )
+
+
+async def run_step(client, simulator: MetaSimulator, rate: float, args, rng: random.Random, step: int) -> dict:
+    """Chegadas de Poisson a `rate` msgs/s por `duration` segundos (laço aberto)"""
+    sent = {}  # telefone -> (instante do POST, janela de debounce aplicada)
+    acks = []
+    failures = 0
+
+    async def post(phone: str):
+        nonlocal failures
+        body = webhook_payload(phone, rng.choice([
+            "Como estão as campanhas esta semana?",
+            "Compara com a semana passada",
+            "Teve alguma alteração nas contas?",
+            "Quanto gastamos hoje?",
+        ]))
+        start = time.perf_counter()
+        response = await client.post(
+            "/webhook/whatsapp", content=body,
+            headers={"Content-Type": "application/json", "X-Hub-Signature-256": sign(body)}
+        )
+        acks.append(time.perf_counter() - start)
+        data = response.json()
+        if response.status_code != 200 or data.get("status") != "queued":
+            failures += 1
+            sent.pop(phone, None)
+            return
+        sent[phone] = (start, float(data.get("timer_seconds") or 0))
+
+    tasks = []
+    step_start = time.perf_counter()
+    next_at = step_start
+    index = 0
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at - step_start > args.duration:
+            break
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        phone = f"55{step:02d}{index:09d}"
+        index += 1
+        sent[phone] = (time.perf_counter(), 0.0)
+        tasks.append(asyncio.create_task(post(phone)))
+    await asyncio.gather(*tasks)
+    arrival_seconds = time.perf_counter() - step_start
+
+    # Esperar a primeira resposta de cada contato
+    deadline = time.perf_counter() + args.drain
+    while time.perf_counter() < deadline and any(phone not in simulator.deliveries for phone in sent):
+        await asyncio.sleep(0.1)
+
+    end_to_end, pipeline = [], []
+    for phone, (start, window) in sent.items():
+        delivered = simulator.deliveries.get(phone)
+        if delivered:
+            end_to_end.append(delivered[0] - start)
+            pipeline.append(delivered[0] - start - window)
+
+    return {
+        "rate": rate,
+        "sent": index,
+        "achieved": index / arrival_seconds if arrival_seconds else 0.0,
+        "replied": len(end_to_end),
+        "missing": len(sent) - len(end_to_end),
+        "failures": failures,
+        "acks": acks,
+        "end_to_end": end_to_end,
+        "pipeline": pipeline,
+    }
+
+
+def sustainable(result: dict, slo_p95: float) -> bool:
+    return (
+        result["missing"] == 0
+        and result["failures"] == 0
+        and result["end_to_end"]
+        and percentile(result["end_to_end"], 95) <= slo_p95
+        and result["achieved"] >= ACHIEVED_RATE_FLOOR * result["rate"]
+    )
+
+
+async def main_async(args, simulator: MetaSimulator) -> None:
+    import httpx
+    import main
+    from database import async_engine
+
+    main.DEBOUNCE_TIME = args.debounce
+    main.adaptive_debounce.default = args.debounce
+
+    rng = random.Random(args.seed)
+    rates = [float(rate) for rate in args.rates.split(",") if rate.strip()]
+    results = []
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+            for step, rate in enumerate(rates, start=1):
+                print(f"\n▶️ Etapa {step}: {rate:g} msgs/s por {args.duration:g}s")
+                result = await run_step(client, simulator, rate, args, rng, step)
+                results.append(result)
+                print(
+                    f"   enviadas {result['sent']} (taxa atingida {result['achieved']:.2f}/s) | "
+                    f"respondidas {result['replied']} | sem resposta {result['missing']} | "
+                    f"webhooks com falha {result['failures']}"
+                )
+                print("   " + summarize("ponta a ponta", result["end_to_end"]))
+                print("   " + summarize("pipeline (sem debounce)", result["pipeline"]))
+                print("   " + summarize("resposta do webhook", result["acks"]))
+                if not sustainable(result, args.slo_p95):
+                    print("   ⚠️ Etapa fora do SLO: interrompendo a rampa")
+                    break
+    await async_engine.dispose()
+
+    print("\n" + "=" * 78)
+    print("RESUMO")
+    print("=" * 78)
+    print(f"{'msgs/s':>8} {'atingida':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'sem resp.':>10}")
+    for result in results:
+        values = result["end_to_end"]
+        print(
+            f"{result['rate']:>8g} {result['achieved']:>9.2f} {percentile(values, 50):>7.2f}s "
+            f"{percentile(values, 95):>7.2f}s {percentile(values, 99):>7.2f}s {result['missing']:>10}"
+        )
+    passing = [result["rate"] for result in results if sustainable(result, args.slo_p95)]
+    if passing:
+        print(f"\n✅ Taxa máxima sustentável: {max(passing):g} msgs/s (p95 <= {args.slo_p95:g}s)")
+    else:
+        print(f"\n❌ Nenhuma etapa dentro do SLO (p95 <= {args.slo_p95:g}s)")
+
+    stats = simulator.stats.to_dict()
+    print("\nSimulador:")
+    for endpoint, count in sorted(stats["requests"].items()):
+        print(f"   {endpoint:<22} {count:>6} requisições")
+    if stats["throttled"]:
+        print(f"   limitadas: {stats['throttled']}")
+    if stats["errors"]:
+        print(f"   erros injetados: {stats['errors']}")
+    print(f"   ferramentas roteirizadas: {stats['llm_tool_calls']}")
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    simulator = MetaSimulator(build_config(args))
+    server = SimulatorServer(simulator).start()
+    print(f"🧪 Simulador em {server.url} ({simulator.config})")
+    configure_app_env(server.url, args.workers)
+    try:
+        asyncio.run(main_async(args, simulator))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
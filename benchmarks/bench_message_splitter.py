@@ -0,0 +1,97 @@
+"""
+Benchmark do divisor de mensagens com saídas de tool muito grandes
+
+Compara o split antigo (seções `\\n\\n` juntadas por concatenação) com o
+message_splitter em textos de até alguns MB: tempo, número de partes e o
+tamanho da maior parte (o antigo deixa passar seções acima do limite).
+
+Uso:
+    python benchmarks/bench_message_splitter.py [tamanho em KB]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_splitter import split_message  # noqa: E402
+
+SIZE_KB = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+MAX_CHARS = 800
+
+
+def legacy_split(content: str, max_chars: int = 800) -> list:
+    """split_long_message antigo (main.py)"""
+    if len(content) <= max_chars:
+        return [content.strip()]
+    parts = []
+    current_part = ""
+    for section in content.split('\n\n'):
+        section = section.strip()
+        if not section:
+            continue
+        if len(current_part) + len(section) + 2 > max_chars and current_part:
+            parts.append(current_part.strip())
+            current_part = section + '\n\n'
+        else:
+            current_part += section + '\n\n'
+    if current_part.strip():
+        parts.append(current_part.strip())
+    return parts
+
+
+def report_text(size: int) -> str:
+    """Relatório em Markdown/WhatsApp com parágrafos, listas e negrito"""
+    rng = random.Random(1)
+    blocks = []
+    total = 0
+    while total < size:
+        lines = [f"*Campanha {rng.randint(1, 9999)}*"]
+        for _ in range(rng.randint(2, 8)):
+            lines.append(f"- Impressões: {rng.randint(1000, 99999)} | CTR {rng.random() * 3:.2f}% | *CPC R$ {rng.random() * 9:.2f}*")
+        block = "\n".join(lines)
+        blocks.append(block)
+        total += len(block) + 2
+    return "\n\n".join(blocks)
+
+
+def json_dump(size: int) -> str:
+    """Saída de tool em JSON indentado numa seção só (sem \\n\\n)"""
+    rng = random.Random(2)
+    rows = []
+    total = 0
+    while total < size:
+        row = {"campaign_id": rng.randint(1, 10**9), "name": f"Campanha {rng.randint(1, 9999)}",
+               "ctr": round(rng.random() * 3, 2), "spend": round(rng.random() * 1000, 2)}
+        rows.append(row)
+        total += 100
+    return json.dumps(rows, indent=2, ensure_ascii=False)
+
+
+def minified(size: int) -> str:
+    """Uma linha gigante (JSON minificado): só corte por palavra ou seco"""
+    return json_dump(size).replace("\n", "").replace("  ", "")
+
+
+def measure(name: str, text: str) -> None:
+    print(f"\n=== {name}: {len(text) / 1024:,.0f} KB ===")
+    for label, func in (("antigo", legacy_split), ("novo", split_message)):
+        start = time.perf_counter()
+        parts = func(text, MAX_CHARS)
+        elapsed = (time.perf_counter() - start) * 1000
+        biggest = max(map(len, parts))
+        flag = "" if biggest <= MAX_CHARS else "  ⚠️ acima do limite"
+        print(f"{label:<7} {elapsed:>9.1f} ms  {len(parts):>6} partes  maior parte {biggest:>9,}{flag}")
+
+
+def main():
+    size = SIZE_KB * 1024
+    measure("relatório com parágrafos", report_text(size))
+    measure("JSON indentado (uma seção)", json_dump(size))
+    measure("JSON minificado (uma linha)", minified(size))
+
+
+if __name__ == "__main__":
+    main()
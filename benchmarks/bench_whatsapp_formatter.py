@@ -0,0 +1,97 @@
+"""
+Micro-benchmark do formatador de WhatsApp
+
+Compara o caminho antigo (formatação no grafo do agente + de novo no envio,
+cada uma com vários re.sub e padrões recompilados) com o whatsapp_formatter
+(uma passada; a segunda chamada só confirma que o texto já está formatado).
+
+Uso:
+    python benchmarks/bench_whatsapp_formatter.py [repetições]
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whatsapp_formatter import format_for_whatsapp  # noqa: E402
+
+REPEAT = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+SAMPLE = """## Desempenho da conta Vorp Scale
+
+O **CTR** da conta está em 1,54% e o **CPC médio** é R$ 5,38 nos últimos 7 dias.
+
+### Campanhas
+- **Campanha Black Friday**: 12.340 impressões, CTR 2,1%
+- **Remarketing**: 4.120 impressões, CTR 0,9%
+- **Topo de funil**: 30.210 impressões, CTR 1,2%
+
+
+Análise: o CTR abaixo de 2% indica que vale revisar os criativos. Use `compare_periods`
+para comparar com o mês anterior ou veja o [painel](https://business.facebook.com).
+
+
+
+Quer ver o histórico de otimizações?
+"""
+
+
+def legacy_agent_format(content: str) -> str:
+    """Formatação que ficava em agent.format_for_whatsapp (sem a parte de botões)"""
+    content = re.sub(r'send_whatsapp_(?:buttons|list)\s*\(.*?\)\s*(?:\n|$)', '', content, flags=re.DOTALL)
+    lines_to_keep = []
+    for line in content.split('\n'):
+        if re.search(r'(?:body_text|buttons|title|id)\s*:', line):
+            continue
+        if re.match(r'^\s*[\{\}\[\]]\s*$', line):
+            continue
+        lines_to_keep.append(line)
+    content = '\n'.join(lines_to_keep)
+    content = re.sub(r'\n\s*\n\s*\n+', '\n\n', content)
+    re.findall(r'\[([^\]]{1,50})\]', content)
+    content = re.sub(r'###?\s+(.*?)(?:\n|$)', r'*\1*\n', content)
+    content = re.sub(r'\*\*(.*?)\*\*', r'*\1*', content)
+    content = re.sub(r'`(.*?)`', r'\1', content)
+    if '(' in content and ')' in content:
+        content = re.sub(r'\[(.*?)\]\((.*?)\)', r'\1 (\2)', content)
+    content = re.sub(r'\n{3,}', r'\n\n', content)
+    content = '\n'.join(line.rstrip() for line in content.split('\n'))
+    return content.strip()
+
+
+def legacy_main_format(content: str) -> str:
+    """Formatação que ficava em main.format_message_for_whatsapp"""
+    content = re.sub(r'###?\s+(.*?)(?:\n|$)', r'*\1*\n', content)
+    content = re.sub(r'\*\*(.*?)\*\*', r'*\1*', content)
+    content = re.sub(r'`(.*?)`', r'\1', content)
+    content = re.sub(r'\[(.*?)\]\((.*?)\)', r'\1 (\2)', content)
+    content = re.sub(r'\n{3,}', r'\n\n', content)
+    return content.strip()
+
+
+def measure(name: str, func) -> float:
+    per_call = min(timeit.repeat(func, number=REPEAT, repeat=3)) / REPEAT * 1_000_000
+    print(f"{name:<45} {per_call:>8.1f} µs")
+    return per_call
+
+
+def main():
+    print(f"Texto de exemplo: {len(SAMPLE)} caracteres, {REPEAT} repetições\n")
+
+    formatted = format_for_whatsapp(SAMPLE)
+    assert format_for_whatsapp(formatted) == formatted
+
+    legacy = measure("antigo: grafo + envio (2 formatações)", lambda: legacy_main_format(legacy_agent_format(SAMPLE)))
+    first = measure("novo: primeira formatação", lambda: format_for_whatsapp(SAMPLE))
+    second = measure("novo: segunda chamada (já formatado)", lambda: format_for_whatsapp(formatted))
+    total = first + second
+    print(f"\n{'novo: grafo + envio':<45} {total:>8.1f} µs  ({legacy / total:.1f}x mais rápido)")
+
+    print("\n--- saída ---")
+    print(formatted)
+
+
+if __name__ == "__main__":
+    main()
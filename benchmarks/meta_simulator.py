@@ -0,0 +1,449 @@
+"""
+Simulador local da Graph API, da WhatsApp Cloud API e do LLM (para testes de carga)
+
+Um app FastAPI que responde no lugar dos endpoints da Meta e da OpenAI, para
+medir o pipeline sem tocar nos serviços reais:
+
+- Graph API: campos da conta/business (`GET /v21.0/{id}`), `/insights`,
+  `/activities` e `/campaigns`, com paginação por cursor (`paging.next`)
+- Cabeçalhos de uso (`X-App-Usage`, `X-Business-Use-Case-Usage`) calculados
+  pela taxa de requisições; acima do limite por minuto responde o erro de
+  throttling da Graph (código 80004)
+- WhatsApp: `POST /v21.0/{phone_number_id}/messages` com wamid, marcação de
+  lida e 429 + Retry-After acima do limite de mensagens por segundo
+- LLM: `POST /v1/chat/completions` compatível com a OpenAI, com latência
+  configurável, chamadas de ferramenta roteirizadas (SIM_TOOL_SCRIPT) e `usage`
+  com tokens em cache
+- Latência com jitter e taxa de erros (5xx) configuráveis por serviço
+
+Aponte a aplicação para ele com FACEBOOK_GRAPH_URL, WHATSAPP_API_URL e
+OPENAI_BASE_URL (o benchmarks/bench_load.py faz isso e sobe o simulador numa
+thread). Também roda sozinho:
+
+    python benchmarks/meta_simulator.py [porta]
+
+Configuração por variáveis SIM_* (ver SimulatorConfig.from_env).
+"""
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+API_VERSION = "v21.0"
+LLM_MODEL = "gpt-4.1-mini-2025-04-14"
+DEFAULT_PORT = 8089
+CACHE_BLOCK_TOKENS = 1024  # o cache de prompt da OpenAI reaproveita blocos de 1024 tokens
+
+# Argumentos das ferramentas roteirizadas (contas de default_accounts.py)
+TOOL_ARGS = {
+    "get_campaign_insights": {"ad_account_id": "act_611132268404060"},
+    "compare_campaign_periods": {"ad_account_id": "act_611132268404060", "period_type": "week_vs_previous"},
+    "get_activity_history": {"ad_account_id": "act_611132268404060", "level": "account", "days": 7},
+    "get_facebook_ad_accounts": {},
+    "get_all_accounts_insights": {},
+}
+
+
+@dataclass
+class SimulatorConfig:
+    graph_latency_ms: float = 150.0
+    whatsapp_latency_ms: float = 80.0
+    llm_latency_ms: float = 700.0
+    jitter: float = 0.3  # fração da latência, para mais ou para menos
+    graph_error_rate: float = 0.0  # 500 da Graph (OAuthException transitória)
+    whatsapp_error_rate: float = 0.0  # 503 da Cloud API
+    graph_calls_per_minute: int = 6000  # acima disso: erro 80004 e uso em 100%
+    whatsapp_messages_per_second: int = 80  # acima disso: 429 + Retry-After
+    page_size: int = 25  # máximo por página (o `limit` pedido é respeitado se menor)
+    rows: int = 40  # linhas disponíveis em /insights, /activities e /campaigns
+    # Ferramenta chamada em cada turno, em rodízio ("none" = responde direto)
+    tool_script: Tuple[str, ...] = ("none", "get_campaign_insights", "compare_campaign_periods", "get_activity_history")
+    reply_chars: int = 500  # tamanho da resposta final do LLM
+
+    @classmethod
+    def from_env(cls) -> "SimulatorConfig":
+        config = cls()
+        for name, value in vars(cls()).items():
+            raw = os.getenv(f"SIM_{name.upper()}")
+            if raw is None:
+                continue
+            if isinstance(value, tuple):
+                setattr(config, name, tuple(item.strip() for item in raw.split(",") if item.strip()))
+            else:
+                setattr(config, name, type(value)(raw))
+        return config
+
+
+@dataclass
+class SimulatorStats:
+    requests: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    statuses: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    throttled: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    errors: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    llm_tool_calls: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: dict(value) for name, value in vars(self).items()}
+
+
+class RateWindow:
+    """Requisições dentro de uma janela deslizante (para limites e cabeçalhos de uso)"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._times: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def hit(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            self._times.append(now)
+            while self._times and now - self._times[0] > self.seconds:
+                self._times.popleft()
+            return len(self._times)
+
+
+class MetaSimulator:
+    """Estado do simulador: configuração, contadores e mensagens entregues"""
+
+    def __init__(self, config: Optional[SimulatorConfig] = None):
+        self.config = config or SimulatorConfig.from_env()
+        self.stats = SimulatorStats()
+        self._graph_window = RateWindow(60.0)
+        self._whatsapp_window = RateWindow(1.0)
+        self._turns = itertools.count()
+        self._lock = threading.Lock()
+        # Destinatário -> instantes (perf_counter) das mensagens aceitas
+        self.deliveries: Dict[str, List[float]] = defaultdict(list)
+        self.on_delivery: Optional[Callable[[str, Dict[str, Any]], None]] = None
+        self.app = self._build_app()
+
+    # Utilitários ----------------------------------------------------------
+
+    async def _sleep(self, latency_ms: float) -> None:
+        jitter = self.config.jitter
+        await asyncio.sleep(max(0.0, latency_ms * random.uniform(1 - jitter, 1 + jitter)) / 1000)
+
+    def _count(self, endpoint: str, status: int) -> None:
+        with self._lock:
+            self.stats.requests[endpoint] += 1
+            self.stats.statuses[f"{endpoint}:{status}"] += 1
+
+    def _graph_usage_headers(self, node_id: str, calls: int) -> Dict[str, str]:
+        usage = min(100, int(calls * 100 / max(1, self.config.graph_calls_per_minute)))
+        regain = 0 if usage < 100 else 60
+        return {
+            "X-App-Usage": json.dumps({"call_count": usage, "total_cputime": usage // 2, "total_time": usage // 2}),
+            "X-Business-Use-Case-Usage": json.dumps({node_id: [{
+                "type": "ads_insights", "call_count": usage, "total_cputime": usage // 2,
+                "total_time": usage // 2, "estimated_time_to_regain_access": regain,
+            }]}),
+        }
+
+    def _page(self, request: Request, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Fatia `rows` pelo cursor `after` e `limit`, no formato de paginação da Graph"""
+        limit = min(int(request.query_params.get("limit", self.config.page_size)), self.config.page_size)
+        after = request.query_params.get("after")
+        start = int(base64.b64decode(after).decode()) if after else 0
+        end = min(len(rows), start + limit)
+        body: Dict[str, Any] = {"data": rows[start:end]}
+        if rows:
+            body["paging"] = {"cursors": {
+                "before": base64.b64encode(str(start).encode()).decode(),
+                "after": base64.b64encode(str(end).encode()).decode(),
+            }}
+            if end < len(rows):
+                query = dict(request.query_params, after=body["paging"]["cursors"]["after"])
+                body["paging"]["next"] = str(request.url.replace_query_params(**query))
+        return body
+
+    # Dados da Graph -------------------------------------------------------
+
+    def _insight_rows(self, node_id: str, level: str, fields: str) -> List[Dict[str, Any]]:
+        rng = random.Random(node_id)
+        rows = []
+        for i in range(self.config.rows if level != "account" else 1):
+            spend = rng.uniform(50, 5000)
+            impressions = rng.randint(5_000, 500_000)
+            clicks = int(impressions * rng.uniform(0.005, 0.03))
+            row = {
+                "account_id": node_id.replace("act_", ""),
+                "campaign_id": str(120200000000 + i),
+                "campaign_name": f"Campanha {i + 1} - {rng.choice(['Leads', 'Vendas', 'Tráfego'])}",
+                "adset_name": f"Conjunto {i + 1}",
+                "ad_name": f"Anúncio {i + 1}",
+                "spend": f"{spend:.2f}",
+                "impressions": str(impressions),
+                "reach": str(int(impressions * 0.7)),
+                "clicks": str(clicks),
+                "ctr": f"{clicks * 100 / impressions:.4f}",
+                "cpc": f"{spend / max(1, clicks):.4f}",
+                "cpm": f"{spend * 1000 / impressions:.4f}",
+                "frequency": f"{rng.uniform(1, 3):.4f}",
+                "actions": [
+                    {"action_type": "lead", "value": str(rng.randint(0, 200))},
+                    {"action_type": "link_click", "value": str(clicks)},
+                ],
+                "date_start": "2025-12-08",
+                "date_stop": "2025-12-14",
+            }
+            requested = {name.strip() for name in fields.split(",") if name.strip()}
+            if requested:
+                keep = requested | {"campaign_name", "adset_name", "ad_name", "date_start", "date_stop", "account_id"}
+                row = {key: value for key, value in row.items() if key in keep}
+            rows.append(row)
+        return rows
+
+    def _activity_rows(self, node_id: str) -> List[Dict[str, Any]]:
+        rng = random.Random(f"activities:{node_id}")
+        events = [
+            ("update_campaign_budget", "Orçamento da campanha atualizado"),
+            ("update_ad_set_target_spec", "Público do conjunto atualizado"),
+            ("update_ad_run_status", "Status do anúncio atualizado"),
+            ("ad_account_billing_charge", "Cobrança da conta"),
+        ]
+        now = int(time.time())
+        rows = []
+        for i in range(self.config.rows):
+            event_type, translated = rng.choice(events)
+            rows.append({
+                "event_type": event_type,
+                "translated_event_type": translated,
+                "event_time": time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime(now - i * 3600)),
+                "actor_id": "100000000000001",
+                "actor_name": rng.choice(["Lucas Dantas Sa", "Meta"]),
+                "object_id": str(120200000000 + i),
+                "object_name": f"Campanha {i + 1}",
+                "object_type": "CAMPAIGN",
+                "extra_data": json.dumps({"old_value": 10000, "new_value": 12000}),
+            })
+        return rows
+
+    def _node_fields(self, node_id: str) -> Dict[str, Any]:
+        if node_id.startswith("act_"):
+            rng = random.Random(node_id)
+            return {
+                "id": node_id,
+                "name": f"Conta {node_id[-4:]}",
+                "account_status": 1,
+                "currency": "BRL",
+                "balance": str(rng.choice([0, 0, 15000, 50000])),
+                "amount_spent": str(rng.randint(100_000, 9_000_000)),
+                "spend_cap": "0",
+            }
+        return {"id": node_id, "name": "Grupo Vorp", "verification_status": "verified"}
+
+    # App ------------------------------------------------------------------
+
+    async def _graph(self, request: Request, node_id: str, edge: Optional[str]) -> JSONResponse:
+        endpoint = edge or "node"
+        calls = self._graph_window.hit()
+        headers = self._graph_usage_headers(node_id, calls)
+        await self._sleep(self.config.graph_latency_ms)
+
+        if calls > self.config.graph_calls_per_minute:
+            self.stats.throttled[endpoint] += 1
+            self._count(endpoint, 400)
+            return JSONResponse(status_code=400, headers=headers, content={"error": {
+                "message": "(#80004) There have been too many calls to this ad-account.",
+                "type": "OAuthException", "code": 80004, "error_subcode": 2446079,
+            }})
+        if random.random() < self.config.graph_error_rate:
+            self.stats.errors[endpoint] += 1
+            self._count(endpoint, 500)
+            return JSONResponse(status_code=500, headers=headers, content={"error": {
+                "message": "An unexpected error has occurred. Please retry your request later.",
+                "type": "OAuthException", "code": 2, "is_transient": True,
+            }})
+
+        params = request.query_params
+        if edge == "insights":
+            body = self._page(request, self._insight_rows(node_id, params.get("level", "campaign"), params.get("fields", "")))
+        elif edge == "activities":
+            body = self._page(request, self._activity_rows(node_id))
+        elif edge == "campaigns":
+            rows = [{"id": str(120200000000 + i), "name": f"Campanha {i + 1}", "status": "ACTIVE"}
+                    for i in range(self.config.rows)]
+            body = self._page(request, rows)
+        elif edge is None:
+            body = self._node_fields(node_id)
+        else:
+            self._count(endpoint, 400)
+            return JSONResponse(status_code=400, headers=headers, content={"error": {
+                "message": f"(#100) Tried accessing nonexisting field ({edge})", "type": "OAuthException", "code": 100,
+            }})
+
+        self._count(endpoint, 200)
+        return JSONResponse(content=body, headers=headers)
+
+    async def _whatsapp(self, request: Request, phone_number_id: str) -> JSONResponse:
+        payload = await request.json()
+        kind = payload.get("type") or ("read" if payload.get("status") == "read" else "unknown")
+        endpoint = f"messages.{kind}"
+        sent_in_last_second = self._whatsapp_window.hit()
+        await self._sleep(self.config.whatsapp_latency_ms)
+
+        if sent_in_last_second > self.config.whatsapp_messages_per_second:
+            self.stats.throttled[endpoint] += 1
+            self._count(endpoint, 429)
+            return JSONResponse(status_code=429, headers={"Retry-After": "1"}, content={"error": {
+                "message": "(#130429) Rate limit hit", "type": "OAuthException", "code": 130429,
+            }})
+        if random.random() < self.config.whatsapp_error_rate:
+            self.stats.errors[endpoint] += 1
+            self._count(endpoint, 503)
+            return JSONResponse(status_code=503, content={"error": {
+                "message": "Service temporarily unavailable", "type": "OAuthException", "code": 131016,
+            }})
+
+        self._count(endpoint, 200)
+        if kind == "read":
+            return JSONResponse(content={"success": True})
+
+        to = payload.get("to", "")
+        with self._lock:
+            self.deliveries[to].append(time.perf_counter())
+        if self.on_delivery is not None:
+            self.on_delivery(to, payload)
+        return JSONResponse(content={
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": to, "wa_id": to}],
+            "messages": [{"id": f"wamid.SIM{uuid.uuid4().hex}"}],
+        })
+
+    def _completion_text(self, tool_result: Optional[str]) -> str:
+        base = "*Resumo da semana*\n\nInvestimento e resultados dentro do esperado. "
+        if tool_result:
+            base += f"Dados consultados ({len(tool_result)} caracteres). "
+        filler = "O CTR está estável e o custo por lead caiu em relação à semana anterior. "
+        text = base
+        while len(text) < self.config.reply_chars:
+            text += filler
+        return text[:self.config.reply_chars].rstrip() + "\n\nQuer ver o detalhe por campanha?"
+
+    async def _chat_completions(self, request: Request) -> JSONResponse:
+        body = await request.json()
+        messages = body.get("messages", [])
+        offered = {tool["function"]["name"] for tool in body.get("tools", []) if tool.get("type") == "function"}
+        await self._sleep(self.config.llm_latency_ms)
+
+        last = messages[-1] if messages else {}
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        if last.get("role") == "user":
+            script = self.config.tool_script or ("none",)
+            tool = script[next(self._turns) % len(script)]
+            if tool != "none" and tool in offered:
+                self.stats.llm_tool_calls[tool] += 1
+                message["tool_calls"] = [{
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": tool, "arguments": json.dumps(TOOL_ARGS.get(tool, {}))},
+                }]
+                finish_reason = "tool_calls"
+        if finish_reason == "stop":
+            tool_result = last.get("content") if last.get("role") == "tool" else None
+            message["content"] = self._completion_text(tool_result)
+
+        # Tokens aproximados (4 caracteres por token); o system prompt fixo vira cache
+        prompt_chars = sum(len(json.dumps(m, ensure_ascii=False)) for m in messages) + len(json.dumps(body.get("tools", [])))
+        prompt_tokens = prompt_chars // 4
+        cached_tokens = (prompt_tokens // CACHE_BLOCK_TOKENS) * CACHE_BLOCK_TOKENS if prompt_tokens >= 2 * CACHE_BLOCK_TOKENS else 0
+        completion_tokens = len(json.dumps(message, ensure_ascii=False)) // 4
+        self._count("chat.completions", 200)
+        return JSONResponse(content={
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": LLM_MODEL,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens, "audio_tokens": 0},
+                "completion_tokens_details": {"reasoning_tokens": 0, "audio_tokens": 0},
+            },
+        })
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Simulador Meta/OpenAI")
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            return await self._chat_completions(request)
+
+        @app.post(f"/{API_VERSION}/{{phone_number_id}}/messages")
+        async def whatsapp_messages(request: Request, phone_number_id: str):
+            return await self._whatsapp(request, phone_number_id)
+
+        @app.get(f"/{API_VERSION}/{{node_id}}")
+        async def graph_node(request: Request, node_id: str):
+            return await self._graph(request, node_id, None)
+
+        @app.get(f"/{API_VERSION}/{{node_id}}/{{edge}}")
+        async def graph_edge(request: Request, node_id: str, edge: str):
+            return await self._graph(request, node_id, edge)
+
+        @app.get("/stats")
+        async def stats():
+            return self.stats.to_dict()
+
+        return app
+
+
+class SimulatorServer:
+    """Sobe o simulador com uvicorn numa thread (event loop próprio)"""
+
+    def __init__(self, simulator: MetaSimulator, host: str = "127.0.0.1", port: int = 0):
+        import socket
+        import uvicorn
+
+        if port == 0:
+            with socket.socket() as sock:
+                sock.bind((host, 0))
+                port = sock.getsockname()[1]
+        self.simulator = simulator
+        self.url = f"http://{host}:{port}"
+        self._server = uvicorn.Server(uvicorn.Config(
+            simulator.app, host=host, port=port, log_level="warning", lifespan="off",
+            backlog=4096, limit_concurrency=None
+        ))
+        self._thread = threading.Thread(target=self._server.run, name="meta-simulator", daemon=True)
+
+    def start(self, timeout: float = 10.0) -> "SimulatorServer":
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Simulador não subiu")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5.0)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    simulator = MetaSimulator()
+    print(f"🧪 Simulador em http://127.0.0.1:{port} ({simulator.config})")
+    print(f"   FACEBOOK_GRAPH_URL=http://127.0.0.1:{port}/{API_VERSION}")
+    print(f"   WHATSAPP_API_URL=http://127.0.0.1:{port}/{API_VERSION}")
+    print(f"   OPENAI_BASE_URL=http://127.0.0.1:{port}/v1")
+    uvicorn.run(simulator.app, host="127.0.0.1", port=port, log_level="warning")
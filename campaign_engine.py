@@ -0,0 +1,593 @@
+"""
+Motor de envio de campanhas (broadcast)
+
+Executa uma `Campaign`:
+
+1. Resolve o público a partir das tags dos contatos (`Campaign.target_audience`)
+2. Materializa uma linha em `campaign_deliveries` por contato (checkpoint)
+3. Renderiza o template por contato e envia por um pool de workers com
+   limite de taxa próprio
+4. Grava o resultado dos envios em lote; ao reiniciar, só as entregas
+   ainda pendentes são enviadas. Pausar ou parar espera os envios em
+   andamento terminarem antes da última gravação; envio sem resposta no
+   prazo fica 'unknown' e não é repetido
+
+O limite da campanha é uma fração do limite global do número business e
+cada envio também consome do limitador global do `OutboundDispatcher`,
+então o tráfego interativo do agente sempre tem folga.
+
+Formato de `target_audience`:
+
+    {"tags": ["cliente", "vip"], "match": "any", "exclude_tags": ["optout"]}
+
+Sem `tags` (ou `target_audience` vazio), todos os contatos entram.
+
+Na Cloud API, texto livre só chega a quem falou com o número nas últimas 24h;
+fora dessa janela a Meta recusa. Por isso, com um adaptador que tem
+`requires_template`, a campanha precisa de `whatsapp_template` (template
+aprovado no WhatsApp Manager) e o `message_template` em texto livre não é
+enviado:
+
+    {"name": "promo_natal", "language": "pt_BR",
+     "components": [{"type": "body", "parameters": [{"type": "text", "text": "{first_name}"}]}]}
+
+Os campos "text" dos componentes aceitam as mesmas variáveis do message_template.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+import os
+import string
+import time
+
+from dotenv import load_dotenv
+
+from outbound import RateLimiter, provider_message_id
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("campaigns")
+
+CAMPAIGN_MESSAGES_PER_SECOND = float(os.getenv("CAMPAIGN_MESSAGES_PER_SECOND", "20"))
+CAMPAIGN_WORKERS = int(os.getenv("CAMPAIGN_WORKERS", "4"))
+CAMPAIGN_BATCH_SIZE = 200  # entregas lidas do banco por vez
+CHECKPOINT_EVERY = 50  # resultados acumulados antes de gravar
+CHECKPOINT_INTERVAL = 2.0  # segundos máximos entre gravações
+SEND_DRAIN_TIMEOUT = 35.0  # espera pelos envios em andamento ao pausar/parar (timeout do adaptador: 30s)
+DEFAULT_TEMPLATE_LANGUAGE = "pt_BR"
+
+
+class _SafeDict(dict):
+    """Variáveis ausentes no template viram string vazia"""
+
+    def __missing__(self, key):
+        return ""
+
+
+def validate_template(template: str) -> Optional[str]:
+    """
+    Mensagem de erro do template, ou None se ele é válido.
+    Só variáveis simples como {first_name}: acesso a atributo ({name.upper}),
+    índice ({tags[0]}) ou posicional ({}) é recusado.
+    """
+    try:
+        fields = list(string.Formatter().parse(template))
+    except ValueError as e:
+        return f"template inválido: {e}"
+    for _, field_name, format_spec, _ in fields:
+        if field_name is None:
+            continue
+        if not field_name.isidentifier():
+            return f"variável inválida no template: {{{field_name}}}"
+        if format_spec and "{" in format_spec:
+            return f"variável aninhada no template: {{{field_name}:{format_spec}}}"
+    return None
+
+
+def render_template(template: str, contact) -> str:
+    """
+    Renderiza o template da campanha para um contato.
+    Variáveis: {name}, {first_name}, {phone} e as chaves de contact_metadata.
+    """
+    if validate_template(template):
+        return template
+    name = contact.name or ""
+    values = _SafeDict(contact.contact_metadata or {})
+    values.update(
+        name=name,
+        first_name=name.split(" ")[0] if name else "",
+        phone=(contact.phone or "").replace("@s.whatsapp.net", "")
+    )
+    try:
+        return template.format_map(values)
+    except Exception:
+        # Template inválido (validate_template deveria ter barrado): envia como está
+        return template
+
+
+def _template_texts(node) -> List[str]:
+    """Valores de "text" dentro dos componentes de um template do WhatsApp"""
+    if isinstance(node, dict):
+        texts = [node["text"]] if isinstance(node.get("text"), str) else []
+        return texts + [text for key, value in node.items() if key != "text" for text in _template_texts(value)]
+    if isinstance(node, list):
+        return [text for item in node for text in _template_texts(item)]
+    return []
+
+
+def _render_texts(node, contact):
+    if isinstance(node, dict):
+        return {
+            key: render_template(value, contact) if key == "text" and isinstance(value, str) else _render_texts(value, contact)
+            for key, value in node.items()
+        }
+    if isinstance(node, list):
+        return [_render_texts(item, contact) for item in node]
+    return node
+
+
+def validate_whatsapp_template(template: Any) -> Optional[str]:
+    """Mensagem de erro do whatsapp_template, ou None se ele é válido"""
+    if not isinstance(template, dict) or not isinstance(template.get("name"), str) or not template["name"]:
+        return "whatsapp_template precisa de name (template aprovado no WhatsApp Manager)"
+    if not isinstance(template.get("language", DEFAULT_TEMPLATE_LANGUAGE), str):
+        return "whatsapp_template.language deve ser um código de idioma (ex.: pt_BR)"
+    components = template.get("components")
+    if components is not None and not isinstance(components, list):
+        return "whatsapp_template.components deve ser uma lista"
+    for text in _template_texts(components or []):
+        error = validate_template(text)
+        if error:
+            return error
+    return None
+
+
+def validate_campaign(message_template: Optional[str], whatsapp_template: Any, requires_template: bool) -> Optional[str]:
+    """Mensagem de erro do conteúdo da campanha, ou None se ela pode ser enviada"""
+    if whatsapp_template:
+        return validate_whatsapp_template(whatsapp_template)
+    if requires_template:
+        return (
+            "whatsapp_template é obrigatório: a Cloud API recusa texto livre "
+            "para quem está fora da janela de 24h"
+        )
+    if not message_template:
+        return "message_template ou whatsapp_template é obrigatório"
+    return validate_template(message_template)
+
+
+def render_content(content, contact):
+    """Texto (message_template) ou template do WhatsApp renderizado para o contato"""
+    if isinstance(content, dict):
+        return {
+            "name": content["name"],
+            "language": content.get("language") or DEFAULT_TEMPLATE_LANGUAGE,
+            "components": _render_texts(content.get("components") or [], contact),
+        }
+    return render_template(content, contact)
+
+
+def matches_audience(tags: Optional[List[str]], audience: Optional[Dict[str, Any]]) -> bool:
+    """True se as tags do contato satisfazem o público da campanha"""
+    audience = audience or {}
+    contact_tags = set(tags or [])
+
+    if contact_tags & set(audience.get("exclude_tags") or []):
+        return False
+
+    wanted = set(audience.get("tags") or [])
+    if not wanted:
+        return True
+    if audience.get("match", "any") == "all":
+        return wanted <= contact_tags
+    return bool(wanted & contact_tags)
+
+
+@dataclass
+class CampaignProgress:
+    """Progresso de uma execução (em memória, para o endpoint de status)"""
+    campaign_id: int
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    unknown: int = 0  # envio sem confirmação (pode ter sido entregue): não é reenviado
+    started_at: float = field(default_factory=time.monotonic)
+    sent_this_run: int = 0
+
+    def to_dict(self, status: str) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started_at
+        throughput = self.sent_this_run / elapsed if elapsed > 0 else 0.0
+        pending = max(self.total - self.sent - self.failed - self.unknown, 0)
+        return {
+            "campaign_id": self.campaign_id,
+            "status": status,
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "unknown": self.unknown,
+            "pending": pending,
+            "throughput_per_second": round(throughput, 2),
+            "eta_seconds": round(pending / throughput, 1) if throughput > 0 else None,
+        }
+
+
+class CampaignEngine:
+    """Executa campanhas em background, uma task por campanha"""
+
+    def __init__(
+        self,
+        adapter,
+        session_factory=None,
+        shared_limiter: Optional[RateLimiter] = None,
+        rate: float = CAMPAIGN_MESSAGES_PER_SECOND,
+        workers: int = CAMPAIGN_WORKERS
+    ):
+        if session_factory is None:
+            from database import SessionLocal
+            session_factory = SessionLocal
+        self.adapter = adapter
+        self._session_factory = session_factory
+        self._shared_limiter = shared_limiter
+        self._limiter = RateLimiter(rate)
+        self.workers = workers
+        self._runs: Dict[int, asyncio.Task] = {}
+        self._progress: Dict[int, CampaignProgress] = {}
+
+    # ---- controle ----
+
+    def start(self, campaign_id: int) -> bool:
+        """Inicia (ou retoma) a campanha. False se já está rodando."""
+        task = self._runs.get(campaign_id)
+        if task is not None and not task.done():
+            return False
+        self._runs[campaign_id] = asyncio.create_task(self._run(campaign_id))
+        return True
+
+    async def pause(self, campaign_id: int) -> bool:
+        """Pausa a campanha; as entregas pendentes continuam no checkpoint"""
+        await asyncio.to_thread(self._set_status, campaign_id, "paused")
+        task = self._runs.pop(campaign_id, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def resume_active(self) -> List[int]:
+        """Retoma campanhas que estavam ativas quando o processo parou (startup)"""
+        ids = await asyncio.to_thread(self._active_ids)
+        for campaign_id in ids:
+            self.start(campaign_id)
+        return ids
+
+    async def stop(self) -> None:
+        """Interrompe as execuções (shutdown); o status continua 'active' para retomar"""
+        tasks = [task for task in self._runs.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._runs = {}
+
+    async def progress(self, campaign_id: int) -> Optional[Dict[str, Any]]:
+        """Progresso da campanha (contagens do banco + vazão da execução atual)"""
+        loaded = await asyncio.to_thread(self._load_counts, campaign_id)
+        if loaded is None:
+            return None
+        status, counts = loaded
+
+        task = self._runs.get(campaign_id)
+        if task is not None and not task.done() and campaign_id in self._progress:
+            # Em execução: contagens em memória (o banco só vê o último checkpoint)
+            return self._progress[campaign_id].to_dict(status)
+
+        return CampaignProgress(
+            campaign_id,
+            total=sum(counts.values()),
+            sent=counts.get("sent", 0),
+            failed=counts.get("failed", 0),
+            unknown=counts.get("unknown", 0)
+        ).to_dict(status)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": [cid for cid, task in self._runs.items() if not task.done()],
+            "rate_limit_per_second": self._limiter.rate,
+            "workers": self.workers,
+        }
+
+    # ---- execução ----
+
+    async def _run(self, campaign_id: int) -> None:
+        try:
+            campaign = await asyncio.to_thread(self._prepare, campaign_id)
+            if campaign is None:
+                return
+
+            content, counts = campaign
+            progress = CampaignProgress(
+                campaign_id,
+                total=sum(counts.values()),
+                sent=counts.get("sent", 0),
+                failed=counts.get("failed", 0),
+            unknown=counts.get("unknown", 0)
+            )
+            self._progress[campaign_id] = progress
+            logger.info(
+                "campaign_started", "📣 Campanha %s: %d envio(s) pendente(s)", campaign_id,
+                progress.total - progress.sent - progress.failed, campaign_id=campaign_id
+            )
+
+            await self._send_pending(campaign_id, content, progress)
+
+            await asyncio.to_thread(self._finish, campaign_id)
+            logger.info(
+                "campaign_completed", "✅ Campanha %s concluída: %d enviada(s), %d falha(s)",
+                campaign_id, progress.sent, progress.failed, campaign_id=campaign_id
+            )
+        except asyncio.CancelledError:
+            logger.info("campaign_interrupted", "⏸️ Campanha %s interrompida", campaign_id, campaign_id=campaign_id)
+            raise
+        except Exception as e:
+            logger.exception("campaign_error", "❌ Erro na campanha %s: %s", campaign_id, e, campaign_id=campaign_id)
+
+    def _prepare(self, campaign_id: int):
+        """Marca a campanha como ativa e materializa as entregas (uma vez só)"""
+        from sqlalchemy import func
+        from models import Campaign, CampaignDelivery, Contact
+
+        db = self._session_factory()
+        try:
+            campaign = db.get(Campaign, campaign_id)
+            if campaign is None or campaign.status == "completed":
+                return None
+            error = validate_campaign(
+                campaign.message_template, campaign.whatsapp_template,
+                getattr(self.adapter, "requires_template", False)
+            )
+            if error:
+                logger.warning(
+                    "campaign_invalid_template", "⚠️ Campanha %s não iniciada: %s", campaign_id, error,
+                    campaign_id=campaign_id
+                )
+                return None
+
+            already_materialized = db.query(CampaignDelivery.id).filter(
+                CampaignDelivery.campaign_id == campaign_id
+            ).first() is not None
+
+            if not already_materialized:
+                # Público resolvido uma vez; contatos novos não entram no meio do envio
+                deliveries = [
+                    CampaignDelivery(campaign_id=campaign_id, contact_id=contact_id, phone=phone)
+                    for contact_id, phone, tags in db.query(Contact.id, Contact.phone, Contact.tags).yield_per(1000)
+                    if matches_audience(tags, campaign.target_audience)
+                ]
+                db.add_all(deliveries)
+
+            campaign.status = "active"
+            if campaign.started_at is None:
+                campaign.started_at = datetime.utcnow()
+            db.commit()
+
+            counts = dict(
+                db.query(CampaignDelivery.status, func.count(CampaignDelivery.id))
+                .filter(CampaignDelivery.campaign_id == campaign_id)
+                .group_by(CampaignDelivery.status)
+                .all()
+            )
+            return campaign.whatsapp_template or campaign.message_template, counts
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _next_batch(self, campaign_id: int, after_id: int) -> List[tuple]:
+        from models import CampaignDelivery, Contact
+
+        db = self._session_factory()
+        try:
+            return [
+                (delivery_id, phone, contact)
+                for delivery_id, phone, contact in db.query(CampaignDelivery.id, CampaignDelivery.phone, Contact)
+                .join(Contact, Contact.id == CampaignDelivery.contact_id)
+                .filter(
+                    CampaignDelivery.campaign_id == campaign_id,
+                    CampaignDelivery.status == "pending",
+                    CampaignDelivery.id > after_id
+                )
+                .order_by(CampaignDelivery.id)
+                .limit(CAMPAIGN_BATCH_SIZE)
+                .all()
+            ]
+        finally:
+            db.close()
+
+    async def _send_pending(self, campaign_id: int, content, progress: CampaignProgress) -> None:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        results: List[Dict[str, Any]] = []
+        sending: Dict[asyncio.Task, int] = {}  # worker -> entrega com envio em andamento
+        stopping = False
+        last_flush = time.monotonic()
+
+        async def flush():
+            nonlocal last_flush
+            if results:
+                batch = results[:]
+                results.clear()
+                await asyncio.to_thread(self._checkpoint, batch)
+            last_flush = time.monotonic()
+
+        def record(delivery_id: int, result: Dict[str, Any]) -> None:
+            status = {"success": "sent", "unknown": "unknown"}.get(result.get("status"), "failed")
+            if status == "sent":
+                progress.sent += 1
+                progress.sent_this_run += 1
+            elif status == "unknown":
+                progress.unknown += 1
+            else:
+                progress.failed += 1
+            results.append({
+                "id": delivery_id,
+                "status": status,
+                "message_id": provider_message_id(result),
+                "error_message": None if status == "sent" else str(result.get("error", "Unknown error")),
+                "sent_at": datetime.utcnow(),
+            })
+
+        async def worker():
+            me = asyncio.current_task()
+            while not stopping:
+                item = await queue.get()
+                try:
+                    if item is None:
+                        return
+                    delivery_id, phone, message = item
+                    await self._acquire()
+                    sending[me] = delivery_id
+                    try:
+                        result = await self._send(phone, message)
+                    finally:
+                        sending.pop(me, None)
+                    record(delivery_id, result)
+                    if len(results) >= CHECKPOINT_EVERY or time.monotonic() - last_flush >= CHECKPOINT_INTERVAL:
+                        await flush()
+                finally:
+                    queue.task_done()
+
+        async def shutdown():
+            """
+            Ao pausar/parar: workers ociosos (na fila ou no limitador) saem na hora,
+            os que estão com envio em andamento terminam e têm o resultado gravado.
+            Cancelar no meio do envio deixaria a entrega 'pending' com a mensagem
+            possivelmente já entregue, e o resume mandaria de novo.
+            """
+            nonlocal stopping
+            stopping = True
+            for task in tasks:
+                if task not in sending:
+                    task.cancel()
+            busy = [task for task in tasks if task in sending]
+            if busy:
+                _, stuck = await asyncio.wait(busy, timeout=SEND_DRAIN_TIMEOUT)
+                for task in stuck:
+                    # Sem resposta no prazo: não dá para saber se saiu, não reenviar
+                    record(sending[task], {"status": "unknown", "error": "envio interrompido ao pausar/parar"})
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Gravar o que já foi enviado (inclusive ao pausar/parar)
+            await flush()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            after_id = 0
+            while True:
+                batch = await asyncio.to_thread(self._next_batch, campaign_id, after_id)
+                if not batch:
+                    break
+                for delivery_id, phone, contact in batch:
+                    await queue.put((delivery_id, phone, render_content(content, contact)))
+                after_id = batch[-1][0]
+
+            for _ in tasks:
+                await queue.put(None)
+            # wait (e não gather): cancelar a execução não pode cancelar um envio em andamento
+            await asyncio.wait(tasks)
+            for task in tasks:
+                task.result()
+        finally:
+            await asyncio.shield(shutdown())
+
+    async def _acquire(self) -> None:
+        await self._limiter.acquire()
+        if self._shared_limiter is not None:
+            await self._shared_limiter.acquire()
+
+    async def _send(self, phone: str, message) -> Dict[str, Any]:
+        try:
+            if isinstance(message, dict):
+                return await self.adapter.send_template(
+                    phone, message["name"], message["language"], message["components"] or None
+                )
+            return await self.adapter.send_message(phone, message)
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+    def _checkpoint(self, results: List[Dict[str, Any]]) -> None:
+        """Grava um lote de resultados em uma única transação"""
+        from models import CampaignDelivery
+
+        db = self._session_factory()
+        try:
+            db.bulk_update_mappings(CampaignDelivery, results)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _finish(self, campaign_id: int) -> None:
+        from models import Campaign, CampaignDelivery
+
+        db = self._session_factory()
+        try:
+            pending = db.query(CampaignDelivery.id).filter(
+                CampaignDelivery.campaign_id == campaign_id,
+                CampaignDelivery.status == "pending"
+            ).first()
+            campaign = db.get(Campaign, campaign_id)
+            if pending is None and campaign is not None and campaign.status == "active":
+                campaign.status = "completed"
+                campaign.completed_at = datetime.utcnow()
+                db.commit()
+        finally:
+            db.close()
+
+    def _active_ids(self) -> List[int]:
+        from models import Campaign
+
+        db = self._session_factory()
+        try:
+            return [row[0] for row in db.query(Campaign.id).filter(Campaign.status == "active").all()]
+        finally:
+            db.close()
+
+    def _load_counts(self, campaign_id: int) -> Optional[tuple]:
+        """(status, {status da entrega: quantidade}) ou None se a campanha não existe"""
+        from sqlalchemy import func
+        from models import Campaign, CampaignDelivery
+
+        db = self._session_factory()
+        try:
+            campaign = db.get(Campaign, campaign_id)
+            if campaign is None:
+                return None
+            counts = dict(
+                db.query(CampaignDelivery.status, func.count(CampaignDelivery.id))
+                .filter(CampaignDelivery.campaign_id == campaign_id)
+                .group_by(CampaignDelivery.status)
+                .all()
+            )
+            return campaign.status, counts
+        finally:
+            db.close()
+
+    def _set_status(self, campaign_id: int, status: str) -> None:
+        from models import Campaign
+
+        db = self._session_factory()
+        try:
+            campaign = db.get(Campaign, campaign_id)
+            if campaign is not None and campaign.status != "completed":
+                campaign.status = status
+                db.commit()
+        finally:
+            db.close()
+
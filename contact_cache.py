@@ -0,0 +1,99 @@
+"""
+Cache quente de contato e conversa ativa por telefone
+
+Cada webhook resolvia Contact (por telefone) e Conversation (contato + status
+'active') no banco. Para quem manda mensagem o tempo todo é sempre o mesmo
+resultado, então o cache guarda telefone -> (contact_id, conversa ativa, nome):
+
+- LRU limitado (CONTACT_CACHE_SIZE) com TTL (CONTACT_CACHE_TTL_SECONDS)
+- Write-through: quem cria/atualiza contato ou conversa grava no cache
+- Invalidado quando a conversa é encerrada
+
+Com vários workers, cada um tem seu cache; o TTL limita por quanto tempo um
+worker pode enxergar uma conversa encerrada por outro.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONTACT_CACHE_SIZE = int(os.getenv("CONTACT_CACHE_SIZE", "5000"))
+CONTACT_CACHE_TTL_SECONDS = float(os.getenv("CONTACT_CACHE_TTL_SECONDS", "300"))
+
+
+@dataclass
+class CachedContact:
+    contact_id: int
+    conversation_id: int
+    name: Optional[str]
+    cached_at: float
+
+
+class ContactCache:
+    """LRU de telefone -> contato e conversa ativa"""
+
+    def __init__(self, max_size: int = CONTACT_CACHE_SIZE, ttl: float = CONTACT_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedContact]" = OrderedDict()
+        self._by_conversation: Dict[int, str] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, phone: str) -> Optional[CachedContact]:
+        entry = self._entries.get(phone)
+        if entry is None or time.monotonic() - entry.cached_at > self.ttl:
+            if entry is not None:
+                self.invalidate(phone)
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(phone)
+        self._hits += 1
+        return entry
+
+    def put(self, phone: str, contact_id: int, conversation_id: int, name: Optional[str]) -> None:
+        """Grava (ou atualiza) a entrada do telefone"""
+        previous = self._entries.get(phone)
+        if previous is not None and previous.conversation_id != conversation_id:
+            self._by_conversation.pop(previous.conversation_id, None)
+
+        self._entries[phone] = CachedContact(contact_id, conversation_id, name, time.monotonic())
+        self._entries.move_to_end(phone)
+        self._by_conversation[conversation_id] = phone
+
+        while len(self._entries) > self.max_size:
+            old_phone, old = self._entries.popitem(last=False)
+            self._by_conversation.pop(old.conversation_id, None)
+
+    def update_name(self, phone: str, name: str) -> None:
+        entry = self._entries.get(phone)
+        if entry is not None:
+            entry.name = name
+
+    def invalidate(self, phone: str) -> None:
+        entry = self._entries.pop(phone, None)
+        if entry is not None:
+            self._by_conversation.pop(entry.conversation_id, None)
+
+    def invalidate_conversation(self, conversation_id: int) -> None:
+        """Conversa encerrada: o próximo webhook do contato resolve no banco"""
+        phone = self._by_conversation.pop(conversation_id, None)
+        if phone is not None:
+            self._entries.pop(phone, None)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self._hits + self._misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,109 @@
+"""
+Histórico recente por conversa (ring buffer) para o contexto do agente
+
+Antes de cada execução o agente buscava as últimas 5 mensagens no banco e
+as convertia em mensagens do LangChain. Aqui cada conversa ativa mantém as
+últimas HISTORY_TURNS mensagens já convertidas:
+
+- Carregado do banco sob demanda (miss), depois atualizado a cada mensagem
+  recebida/enviada gravada por este processo
+- Limitado em número de conversas (LRU)
+- Desligado quando o empilhamento é compartilhado entre workers (outro
+  worker pode gravar mensagens que este não vê)
+"""
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, List, Optional
+import os
+import uuid
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+load_dotenv()
+
+HISTORY_TURNS = 5  # mesmo limite da consulta que este buffer substitui
+CONVERSATION_HISTORY_MAX = int(os.getenv("CONVERSATION_HISTORY_MAX", "2000"))
+
+
+def to_langchain_message(direction: str, text: str) -> Optional[BaseMessage]:
+    """Converte uma mensagem do banco (direction/text) em mensagem do LangChain"""
+    # id fixo: o reducer do LangGraph não precisa alterar o objeto compartilhado
+    if direction == "incoming":
+        return HumanMessage(content=text, id=str(uuid.uuid4()))
+    if direction == "outgoing":
+        return AIMessage(content=text, id=str(uuid.uuid4()))
+    return None
+
+
+class ConversationHistory:
+    """Últimas mensagens de cada conversa, já no formato do LangChain"""
+
+    def __init__(self, turns: int = HISTORY_TURNS, max_conversations: int = CONVERSATION_HISTORY_MAX, enabled: bool = True):
+        self.turns = turns
+        self.max_conversations = max_conversations
+        self.enabled = enabled
+        self._buffers: "OrderedDict[int, Deque[BaseMessage]]" = OrderedDict()
+        self._unloaded_writes = 0  # escritas em conversas fora do buffer (ver begin_load)
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, conversation_id: int) -> Optional[List[BaseMessage]]:
+        """Cópia do histórico da conversa, ou None se precisa carregar do banco"""
+        buffer = self._buffers.get(conversation_id) if self.enabled else None
+        if buffer is None:
+            self._misses += 1
+            return None
+
+        self._buffers.move_to_end(conversation_id)
+        self._hits += 1
+        return list(buffer)
+
+    def begin_load(self) -> int:
+        """Marcador tomado antes da consulta ao banco (passar para load)"""
+        return self._unloaded_writes
+
+    def load(self, conversation_id: int, rows: Iterable, marker: int) -> List[BaseMessage]:
+        """
+        Converte as mensagens do banco (ordem cronológica) e guarda no buffer.
+        Se alguma mensagem foi gravada enquanto a consulta rodava, não guarda
+        (a próxima execução consulta o banco de novo).
+        """
+        messages = [
+            converted for converted in (to_langchain_message(row.direction, row.text) for row in rows)
+            if converted is not None
+        ]
+
+        if self.enabled and marker == self._unloaded_writes:
+            self._buffers[conversation_id] = deque(messages, maxlen=self.turns)
+            self._buffers.move_to_end(conversation_id)
+            while len(self._buffers) > self.max_conversations:
+                self._buffers.popitem(last=False)
+        return messages
+
+    def append(self, conversation_id: Optional[int], direction: str, text: str) -> None:
+        """Registra uma mensagem gravada no banco"""
+        if not self.enabled or conversation_id is None:
+            return
+
+        buffer = self._buffers.get(conversation_id)
+        if buffer is None:
+            self._unloaded_writes += 1
+            return
+
+        message = to_langchain_message(direction, text)
+        if message is not None:
+            buffer.append(message)
+
+    def invalidate(self, conversation_id: int) -> None:
+        self._buffers.pop(conversation_id, None)
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self._hits + self._misses
+        return {
+            "enabled": self.enabled,
+            "conversations": len(self._buffers),
+            "max_conversations": self.max_conversations,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,301 @@
+"""
+Ciclo de vida das conversas: encerra conversas ociosas
+
+Antes, a conversa de um contato nunca saía de status 'active' e acumulava o
+histórico inteiro. Agora:
+
+- Toda mensagem (recebida ou enviada) atualiza `Conversation.last_message_at`
+  com `touch_conversation`, que só vale para conversas ainda ativas
+- Um job em background encerra conversas sem mensagens há
+  CONVERSATION_IDLE_MINUTES: status 'closed', `closed_at` e `summary`
+- A próxima mensagem do contato abre uma conversa nova (o webhook não
+  encontra conversa ativa, ou `touch_conversation` devolve False para a
+  conversa que estava no cache)
+
+O encerramento é um UPDATE condicional (ainda ativa e ainda ociosa), então
+vários workers podem rodar o job sem encerrar a mesma conversa duas vezes e
+uma mensagem que chega no meio do caminho não é perdida.
+
+Resumo via LLM (CONVERSATION_SUMMARY_MODE=llm, opcional; o padrão é o resumo
+simples) só para conversas que ficaram ociosas na última janela e no máximo
+CONVERSATION_SUMMARY_LLM_MAX por varredura. O histórico que já estava ocioso
+antes do job existir (primeira varredura num banco antigo) recebe o resumo
+simples, sem uma chamada ao LLM por conversa. Os tokens vão para o
+TokenUsageRecorder com tool_path "conversation_summary".
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Conversation, Message
+from structured_logging import get_logger
+from token_usage import usage_from_messages
+
+load_dotenv()
+
+logger = get_logger("conversation_lifecycle")
+
+CONVERSATION_IDLE_MINUTES = int(os.getenv("CONVERSATION_IDLE_MINUTES", "1440"))  # 0 desliga
+CONVERSATION_SWEEP_SECONDS = int(os.getenv("CONVERSATION_SWEEP_SECONDS", "300"))
+CONVERSATION_SUMMARY_MODE = os.getenv("CONVERSATION_SUMMARY_MODE", "simple")  # llm, simple ou off
+CONVERSATION_SUMMARY_MODEL = os.getenv("CONVERSATION_SUMMARY_MODEL", "gpt-4.1-mini")
+CONVERSATION_SUMMARY_LLM_MAX = int(os.getenv("CONVERSATION_SUMMARY_LLM_MAX", "20"))  # por varredura
+SUMMARY_TOOL_PATH = "conversation_summary"  # tool_path no token_usage_daily
+SWEEP_BATCH = 100  # conversas encerradas por transação
+SUMMARY_MAX_MESSAGES = 40  # mensagens mais recentes usadas no resumo
+SUMMARY_MAX_CHARS = 500  # por mensagem
+
+SUMMARY_PROMPT = (
+    "Resuma em até 3 frases, em português, a conversa de WhatsApp abaixo entre um "
+    "cliente e o assistente: o assunto, o que o cliente queria e como a conversa terminou.\n\n"
+    "{transcript}"
+)
+
+
+def last_activity():
+    """Última atividade da conversa (conversas antigas podem não ter last_message_at)"""
+    return func.coalesce(Conversation.last_message_at, Conversation.started_at)
+
+
+async def touch_conversation(db: AsyncSession, conversation_id: Optional[int]) -> bool:
+    """
+    Registra atividade na conversa (sem commit; vai na transação de quem chamou).
+    Retorna False se a conversa não está mais ativa: quem chamou deve abrir outra.
+    """
+    if conversation_id is None:
+        return False
+
+    result = await db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id, Conversation.status == "active")
+        .values(last_message_at=func.now())
+    )
+    return result.rowcount == 1
+
+
+def build_simple_summary(messages: List[Message]) -> str:
+    """Resumo sem LLM: contagens, período, primeira e última mensagem do contato"""
+    if not messages:
+        return "Conversa sem mensagens."
+
+    incoming = [m for m in messages if m.direction == "incoming"]
+    outgoing = [m for m in messages if m.direction == "outgoing"]
+    period = " e ".join(
+        dt.strftime("%d/%m/%Y %H:%M") for dt in (messages[0].created_at, messages[-1].created_at) if dt
+    )
+
+    summary = f"{len(incoming)} mensagem(ns) do contato e {len(outgoing)} resposta(s)"
+    if period:
+        summary += f" entre {period}"
+    summary += "."
+    if incoming:
+        summary += f' Primeira mensagem: "{(incoming[0].text or "")[:200]}".'
+        if len(incoming) > 1:
+            summary += f' Última mensagem do contato: "{(incoming[-1].text or "")[:200]}".'
+    return summary
+
+
+class ConversationLifecycle:
+    """Encerra conversas ociosas em background e gera o resumo"""
+
+    def __init__(
+        self,
+        contact_cache=None,
+        conversation_history=None,
+        session_factory=None,
+        idle_minutes: int = CONVERSATION_IDLE_MINUTES,
+        sweep_seconds: int = CONVERSATION_SWEEP_SECONDS,
+        summary_mode: str = CONVERSATION_SUMMARY_MODE,
+        usage_recorder=None,
+        llm_max_per_sweep: int = CONVERSATION_SUMMARY_LLM_MAX
+    ):
+        if session_factory is None:
+            from database import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+        self._session_factory = session_factory
+        self.contact_cache = contact_cache
+        self.conversation_history = conversation_history
+        self.idle_minutes = idle_minutes
+        self.sweep_seconds = sweep_seconds
+        self.summary_mode = summary_mode
+        self.usage_recorder = usage_recorder
+        self.llm_max_per_sweep = llm_max_per_sweep
+        self._llm = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed_total = 0
+        self._summaries = {"llm": 0, "simple": 0, "failed": 0, "backlog": 0, "capped": 0}
+        self._last_sweep_at: Optional[str] = None
+
+    # ---- controle ----
+
+    def start(self) -> None:
+        """Inicia o job no event loop atual"""
+        if self.idle_minutes > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                closed = await self.sweep()
+                if closed:
+                    logger.info("conversations_closed", "💤 %d conversa(s) ociosa(s) encerrada(s)", len(closed))
+            except Exception as e:
+                logger.exception("conversation_sweep_failed", "❌ Erro ao encerrar conversas ociosas: %s", e)
+            await asyncio.sleep(self.sweep_seconds)
+
+    # ---- encerramento ----
+
+    async def sweep(self) -> List[int]:
+        """Encerra todas as conversas ociosas (em lotes) e gera os resumos"""
+        cutoff = datetime.utcnow() - timedelta(minutes=self.idle_minutes)
+        # Ociosa antes disso: já estava parada antes de o job poder encerrá-la
+        # (histórico de antes do deploy ou processo fora do ar por mais de uma janela)
+        backlog_before = cutoff - timedelta(minutes=self.idle_minutes)
+        self._last_sweep_at = datetime.utcnow().isoformat(timespec="seconds")
+
+        closed: List[int] = []
+        llm_budget = self.llm_max_per_sweep
+        while True:
+            batch = await self._close_batch(cutoff)
+            closed.extend(conversation_id for conversation_id, _ in batch)
+            for conversation_id, activity in batch:
+                if activity is not None and activity.tzinfo is not None:
+                    activity = activity.astimezone(timezone.utc).replace(tzinfo=None)
+                use_llm = False
+                if self.summary_mode == "llm":
+                    if activity is not None and activity < backlog_before:
+                        self._summaries["backlog"] += 1
+                    elif llm_budget <= 0:
+                        self._summaries["capped"] += 1
+                    else:
+                        use_llm = True
+                        llm_budget -= 1
+                await self.summarize(conversation_id, use_llm=use_llm)
+            if len(batch) < SWEEP_BATCH:
+                return closed
+
+    async def _close_batch(self, cutoff: datetime) -> List[tuple]:
+        """Encerra um lote: [(conversation_id, última atividade)]"""
+        async with self._session_factory() as db:
+            candidates = (await db.execute(
+                select(Conversation.id, last_activity())
+                .where(Conversation.status == "active", last_activity() < cutoff)
+                .order_by(Conversation.id)
+                .limit(SWEEP_BATCH)
+            )).all()
+
+            closed = []
+            for conversation_id, activity in candidates:
+                # Condicional: outro worker pode ter encerrado, ou chegou mensagem agora
+                result = await db.execute(
+                    update(Conversation)
+                    .where(
+                        Conversation.id == conversation_id,
+                        Conversation.status == "active",
+                        last_activity() < cutoff
+                    )
+                    .values(status="closed", closed_at=func.now())
+                )
+                if result.rowcount == 1:
+                    closed.append((conversation_id, activity))
+            await db.commit()
+
+        for conversation_id, _ in closed:
+            self._forget(conversation_id)
+        self._closed_total += len(closed)
+        return closed
+
+    def _forget(self, conversation_id: int) -> None:
+        """A próxima mensagem do contato resolve a conversa no banco (e abre uma nova)"""
+        if self.contact_cache is not None:
+            self.contact_cache.invalidate_conversation(conversation_id)
+        if self.conversation_history is not None:
+            self.conversation_history.invalidate(conversation_id)
+
+    # ---- resumo ----
+
+    async def summarize(self, conversation_id: int, use_llm: Optional[bool] = None) -> Optional[str]:
+        """
+        Gera e grava o resumo da conversa (LLM, com o resumo simples como fallback).
+        `use_llm=None` segue o summary_mode; a varredura decide por conversa.
+        """
+        if self.summary_mode == "off":
+            return None
+
+        async with self._session_factory() as db:
+            messages = list(reversed((await db.scalars(
+                select(Message)
+                .where(Message.conversation_id == conversation_id)
+                .order_by(Message.created_at.desc(), Message.id.desc())
+                .limit(SUMMARY_MAX_MESSAGES)
+            )).all()))
+
+            if use_llm is None:
+                use_llm = self.summary_mode == "llm"
+            summary = None
+            if use_llm and messages:
+                try:
+                    summary = await self._llm_summary(conversation_id, messages)
+                    self._summaries["llm"] += 1
+                except Exception as e:
+                    self._summaries["failed"] += 1
+                    logger.warning(
+                        "summary_failed", "⚠️ Resumo via LLM falhou (conversa %s): %s", conversation_id, e,
+                        conversation_id=conversation_id
+                    )
+            if not summary:
+                summary = build_simple_summary(messages)
+                self._summaries["simple"] += 1
+
+            await db.execute(
+                update(Conversation).where(Conversation.id == conversation_id).values(summary=summary)
+            )
+            await db.commit()
+        return summary
+
+    async def _llm_summary(self, conversation_id: int, messages: List[Message]) -> str:
+        if self._llm is None:
+            from langchain_openai import ChatOpenAI
+            self._llm = ChatOpenAI(
+                model=CONVERSATION_SUMMARY_MODEL,
+                temperature=0.2,
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=30,
+                max_retries=1
+            )
+
+        transcript = "\n".join(
+            f"{'Cliente' if m.direction == 'incoming' else 'Assistente'}: {(m.text or '')[:SUMMARY_MAX_CHARS]}"
+            for m in messages
+        )
+        response = await self._llm.ainvoke(SUMMARY_PROMPT.format(transcript=transcript))
+        if self.usage_recorder is not None:
+            usage = usage_from_messages([response], CONVERSATION_SUMMARY_MODEL)
+            usage.path = SUMMARY_TOOL_PATH
+            self.usage_recorder.record(usage, conversation_id)
+        return (response.content or "").strip()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "idle_minutes": self.idle_minutes,
+            "sweep_seconds": self.sweep_seconds,
+            "summary_mode": self.summary_mode,
+            "summary_llm_max_per_sweep": self.llm_max_per_sweep,
+            "closed_total": self._closed_total,
+            "summaries": dict(self._summaries),
+            "last_sweep_at": self._last_sweep_at,
+        }
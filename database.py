@@ -1,20 +1,112 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 
+from metrics import instrument_engine
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./agente_campanhas.db")
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+
+def _async_url(url: str) -> str:
+    """Troca o driver síncrono pelo equivalente assíncrono (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2:", "postgresql:", "postgres:"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg:" + url[len(prefix):]
+    return url
+
+
+# Handlers e pipeline do agente usam o engine assíncrono (não bloqueiam o event loop);
+# o engine síncrono fica para init_db e código que roda em thread (asyncio.to_thread)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+
+# SQLite: WAL deixa leituras (agente) rodarem junto com escritas (webhook)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # seguro com WAL
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Postgres (ou outro servidor): pool de conexões
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def _create_engine():
+    if IS_SQLITE:
+        return create_engine(
+            DATABASE_URL,
+            connect_args={
+                "check_same_thread": False,
+                "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000
+            }
+        )
+    
+    return create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True
+    )
+
+
+def _create_async_engine():
+    if IS_SQLITE:
+        return create_async_engine(
+            ASYNC_DATABASE_URL,
+            connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        )
+    
+    return create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True
+    )
+
+
+engine = _create_engine()
+async_engine = _create_async_engine()
+
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Aplica os PRAGMAs em cada conexão nova"""
+    cursor = dbapi_connection.cursor()
+    # Só vale em banco novo (antes da primeira tabela); bancos antigos: python retention.py --vacuum
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+# Tempo de cada consulta em /metrics
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# expire_on_commit=False: objetos continuam legíveis depois do commit sem nova consulta
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -27,8 +119,61 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """
+    Dependency para obter sessão assíncrona do banco de dados
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def init_db():
     """
     Inicializa o banco de dados criando todas as tabelas
+    e aplicando as migrações pendentes (Alembic)
     """
+    import models  # noqa: F401 (registra as tabelas no Base.metadata)
+    
     Base.metadata.create_all(bind=engine)
+    run_migrations()
+
+def run_migrations():
+    """
+    Aplica as migrações do Alembic até a última revisão (alembic upgrade head).
+    As migrações são idempotentes, então rodam também em bancos criados pelo create_all.
+    """
+    from alembic import command
+    from alembic.config import Config
+    
+    config = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini"))
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+
+def describe_engine() -> dict:
+    """
+    Configuração ativa do banco (exibida no startup).
+    No SQLite lê os PRAGMAs da conexão, para mostrar o que realmente valeu.
+    """
+    if IS_SQLITE:
+        with engine.connect() as connection:
+            def pragma(name):
+                return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+            return {
+                "dialect": "sqlite",
+                "journal_mode": pragma("journal_mode"),
+                "synchronous": {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}.get(pragma("synchronous")),
+                "busy_timeout_ms": pragma("busy_timeout"),
+                "mmap_size": pragma("mmap_size"),
+                "async_driver": async_engine.dialect.driver,
+            }
+    
+    return {
+        "dialect": engine.dialect.name,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        "async_driver": async_engine.dialect.driver,
+    }
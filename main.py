@@ -1,36 +1,81 @@
 from fastapi import FastAPI, Request, Depends, Query
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from dotenv import load_dotenv
 import os
-import httpx
-from typing import Dict, Any
-from datetime import datetime
+from datetime import datetime, timedelta
 import asyncio
-from collections import defaultdict
 import hmac
 import hashlib
+import time
+from logging import DEBUG
 
-from database import get_db, init_db
-from models import Message, Campaign, Contact, Conversation, AgentLog
+from database import get_async_db, init_db, describe_engine, AsyncSessionLocal, async_engine
+from models import Message, Campaign, Contact, Conversation
 from agent import run_agent
 from whatsapp_config import ACTIVE_WHATSAPP_CONFIG
 from whatsapp_adapters import get_whatsapp_adapter
-import re
+from message_stacking import (
+    get_stacking_backend, make_owner_id, STACKING_BACKEND, STACKING_LEASE_SECONDS, STACKING_RECOVERY_HOURS
+)
+from timer_wheel import TimerWheel
+from outbound import OutboundDispatcher, OutboundPart, OutboundReply, SentPart
+from campaign_engine import CampaignEngine, validate_campaign
+from adaptive_debounce import AdaptiveDebounce, HISTORY_SIZE
+from agent_scheduler import ConversationScheduler
+from contact_cache import ContactCache
+from conversation_history import ConversationHistory, HISTORY_TURNS
+from agent_log_writer import AgentLogWriter, ToolCallLogger, elapsed_ms
+from retention import RetentionManager
+from whatsapp_formatter import format_for_whatsapp
+from message_splitter import MESSAGE_LIMITS, split_interactive_body, split_message
+from conversation_lifecycle import ConversationLifecycle, touch_conversation
+import metrics
+from metrics import AGENT_RUN_SECONDS, DEBOUNCE_WAIT_SECONDS, GRAPH_EVENT_HOOKS, MetricsMiddleware
+from tracing import tracer, instrument_graph_hooks
+from token_usage import TokenUsageRecorder, cost_report
+import structured_logging
+from structured_logging import get_logger
 
 load_dotenv()
 
+logger = get_logger("main")
+
 # Inicializar adaptador WhatsApp baseado na config
 whatsapp_adapter = get_whatsapp_adapter(ACTIVE_WHATSAPP_CONFIG)
 
+# Respostas longas vão em partes de até 800 caracteres (mais fáceis de ler que
+# um bloco de 4096); o limite da Cloud API por tipo fica em MESSAGE_LIMITS
+TEXT_PART_CHARS = 800
+
 # Sistema de empilhamento de mensagens (debounce)
-message_queue: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
-    "messages": [],
-    "timer": None,
-    "contact_name": None,
-    "conversation_id": None
-})
-DEBOUNCE_TIME = 6  # segundos para esperar antes de processar
+# A pilha fica no backend configurado (memória ou banco compartilhado entre workers);
+# os deadlines ficam na timer wheel local de cada worker.
+stacking_backend = get_stacking_backend()
+STACKING_OWNER = make_owner_id()
+DEBOUNCE_TIME = 6  # segundos para esperar antes de processar (contatos sem histórico)
+adaptive_debounce = AdaptiveDebounce(default=DEBOUNCE_TIME)
+
+# Telefone -> contato e conversa ativa (evita duas consultas por webhook)
+contact_cache = ContactCache()
+
+# Últimas mensagens de cada conversa já convertidas para o agente
+# (desligado com backend compartilhado: outros workers gravam mensagens que este não vê)
+conversation_history = ConversationHistory(enabled=not stacking_backend.shared)
+
+# AgentLog gravado em lote fora do caminho da requisição
+agent_log_writer = AgentLogWriter()
+
+# Tokens reais do LLM por execução (AgentLog llm_call + rollup token_usage_daily)
+token_usage_recorder = TokenUsageRecorder(log_writer=agent_log_writer)
+
+# Encerra conversas ociosas (a próxima mensagem do contato abre uma nova)
+conversation_lifecycle = ConversationLifecycle(contact_cache, conversation_history, usage_recorder=token_usage_recorder)
+
+# Retenção/arquivamento de dados antigos (job em background, fora do horário comercial)
+retention_manager = RetentionManager()
 
 
 async def simulate_typing(phone: str, duration: float = 3.0):
@@ -42,120 +87,217 @@ async def simulate_typing(phone: str, duration: float = 3.0):
     return
 
 
-async def split_long_message(content: str, max_chars: int = 800) -> list[str]:
+async def build_text_parts(message: str) -> list[OutboundPart]:
     """
-    Divide mensagem longa em partes menores de forma inteligente.
-    
-    Critérios de divisão:
-    - Respeita parágrafos e seções
-    - Máximo de max_chars por parte
-    - Divide em pontos naturais (quebras de linha duplas, listas, etc)
+    Formata a mensagem para WhatsApp e divide em partes de texto.
+    Retorna lista vazia se não sobrar conteúdo.
     """
-    # Se a mensagem é curta, retorna como está
-    if len(content) <= max_chars:
-        return [content.strip()]
-    
-    parts = []
-    current_part = ""
+    # Validar mensagem antes de processar
+    if not message or not message.strip():
+        return []
     
-    # Dividir por seções (quebras de linha duplas)
-    sections = content.split('\n\n')
+    # Formatar mensagem (texto que já veio formatado do agente é devolvido sem reprocessar)
+    formatted_message = format_for_whatsapp(message)
     
-    for section in sections:
-        section = section.strip()
-        if not section:
-            continue
-        
-        # Se adicionar esta seção ultrapassa o limite
-        if len(current_part) + len(section) + 2 > max_chars and current_part:
-            # Salvar parte atual e começar nova
-            parts.append(current_part.strip())
-            current_part = section + '\n\n'
-        else:
-            current_part += section + '\n\n'
+    # Validar após formatação
+    if not formatted_message or not formatted_message.strip():
+        logger.warning("empty_after_format", "⚠️ Mensagem ficou vazia após formatação", chars=len(message))
+        logger.debug("empty_after_format_original", "Original: %.100s", message)
+        return []
     
-    # Adicionar última parte
-    if current_part.strip():
-        parts.append(current_part.strip())
+    # Dividir se necessário (parágrafo -> linha -> frase -> palavra)
+    parts = split_message(formatted_message, max_chars=TEXT_PART_CHARS)
+    return [OutboundPart(kind="text", text=part) for part in parts]
+
+
+def fit_interactive_body(payload: dict) -> tuple[dict, list[OutboundPart]]:
+    """
+    Corpo de botões/lista acima do limite da Cloud API (1024): o início vai antes
+    em partes de texto e o final fica no corpo. Retorna (payload, partes de texto).
+    """
+    body = payload.get("body")
+    body_text = body.get("text") if isinstance(body, dict) else body
+    if not body_text or len(body_text) <= MESSAGE_LIMITS["interactive_body"]:
+        return payload, []
     
-    return parts
+    leading, tail = split_interactive_body(body_text, TEXT_PART_CHARS)
+    new_body = {**body, "text": tail} if isinstance(body, dict) else tail
+    return {**payload, "body": new_body}, [OutboundPart(kind="text", text=part) for part in leading]
 
 
-def format_message_for_whatsapp(content: str) -> str:
+async def send_and_save_message(phone: str, message: str, conversation_id: int, message_ids: list[int] = None):
     """
-    Formata mensagem removendo Markdown e convertendo para formatação WhatsApp.
-    Não divide - apenas formata.
+    Entrega a mensagem ao dispatcher de envio (que envia e salva no banco em background).
+    Se mensagem for longa, divide em múltiplas partes enviadas em ordem.
     """
-    # Converter Markdown headers ## -> negrito
-    content = re.sub(r'###?\s+(.*?)(?:\n|$)', r'*\1*\n', content)
+    # Validar mensagem antes de processar
+    if not message or not message.strip():
+        logger.warning("empty_message", "⚠️ Tentativa de enviar mensagem vazia para %s", phone, phone=phone)
+        return
+    
+    parts = await build_text_parts(message)
+    if not parts:
+        return
     
-    # Markdown bold ** -> WhatsApp bold *
-    content = re.sub(r'\*\*(.*?)\*\*', r'*\1*', content)
+    logger.info("reply_enqueued", "📤 Enfileirando %d parte(s) para %s", len(parts), phone, phone=phone, parts=len(parts))
+    if logger.is_enabled(DEBUG):
+        for i, part in enumerate(parts, 1):
+            logger.debug("reply_part", "Parte %d/%d (%d caracteres): %.100s", i, len(parts), len(part.text), part.text)
     
-    # Markdown code ` -> remover
-    content = re.sub(r'`(.*?)`', r'\1', content)
+    outbound_dispatcher.enqueue(OutboundReply(
+        phone=phone,
+        conversation_id=conversation_id,
+        parts=parts,
+        message_ids=message_ids or []
+    ))
+
+
+async def persist_outbound_reply(reply: OutboundReply, sent: list[SentPart]):
+    """
+    Salva no banco as partes enviadas pelo dispatcher (com o wamid de cada uma)
+    e marca como processadas as mensagens recebidas que a resposta atendeu.
+    Tudo em uma única transação, gravada depois do envio.
+
+    Se nenhuma parte saiu (todas "failed"), as mensagens recebidas continuam
+    pendentes e recover_pending_stacks() responde de novo no próximo startup.
+    Parte "unknown" conta como enviada: a Meta pode ter entregue.
+    """
+    delivered = any(item.ok or item.unknown for item in sent)
+    async with AsyncSessionLocal() as db:
+        db.add_all([
+            Message(
+                instance="whatsapp_business",
+                remote_jid=reply.phone,
+                message_id=item.provider_message_id,
+                direction="outgoing",
+                from_me=True,
+                text=item.part.text,
+                status="sent" if item.ok else ("unknown" if item.unknown else "failed"),
+                error_message=item.error,
+                conversation_id=reply.conversation_id
+            )
+            for item in sent
+        ])
+        await touch_conversation(db, reply.conversation_id)
+        if delivered:
+            await mark_messages_processed(db, reply.message_ids, commit=False)
+        await db.commit()
     
-    # Remover links markdown [texto](url) -> texto (url)
-    content = re.sub(r'\[(.*?)\]\((.*?)\)', r'\1 (\2)', content)
+    if not delivered:
+        logger.warning(
+            "reply_not_delivered", "⚠️ Nenhuma parte enviada para %s: %d mensagem(ns) ficam pendentes",
+            reply.phone, len(reply.message_ids), phone=reply.phone
+        )
     
-    # Limpar quebras de linha excessivas
-    content = re.sub(r'\n{3,}', r'\n\n', content)
+    for item in sent:
+        conversation_history.append(reply.conversation_id, "outgoing", item.part.text)
     
-    return content.strip()
+    failed = [item for item in sent if not item.ok]
+    agent_log_writer.record(
+        "send_message",
+        reply.conversation_id,
+        input_data={"phone": reply.phone, "parts": len(reply.parts)},
+        output_data={"sent": len(sent) - len(failed), "failed": len(failed)},
+        status="error" if failed else "success",
+        error_message=failed[0].error if failed else None,
+        execution_time=int((time.monotonic() - reply.enqueued_at) * 1000)
+    )
+
+
+# Fila de envio: o agente entrega a resposta e fica livre na hora
+outbound_dispatcher = OutboundDispatcher(whatsapp_adapter, persist_outbound_reply)
+
+# Campanhas: limite próprio + limitador global compartilhado com o agente
+campaign_engine = CampaignEngine(whatsapp_adapter, shared_limiter=outbound_dispatcher.limiter)
 
 
-async def send_and_save_message(phone: str, message: str, conversation_id: int, db):
+async def enrich_interactive_text(db: AsyncSession, conversation_id: int, text: str) -> str:
     """
-    Envia mensagem via WhatsApp adapter e salva no banco.
-    Se mensagem for longa, divide e envia múltiplas partes.
+    Enriquece resposta interativa (botão/lista) com a mensagem do bot que a originou.
     """
-    # Validar mensagem antes de processar
-    if not message or not message.strip():
-        print(f"⚠️ Tentativa de enviar mensagem vazia para {phone}")
-        return
+    last_bot_msg = await db.scalar(
+        select(Message).where(
+            Message.conversation_id == conversation_id,
+            Message.direction == "outgoing"
+        ).order_by(Message.created_at.desc()).limit(1)
+    )
     
-    # Formatar mensagem
-    formatted_message = format_message_for_whatsapp(message)
+    if last_bot_msg:
+        context_preview = last_bot_msg.text[:150].replace('\n', ' ')
+        logger.debug("interactive_enriched", "📝 Texto enriquecido com contexto da mensagem anterior")
+        return f"[CONTEXTO: O usuário clicou no botão/lista '{text}' em resposta à mensagem: '{context_preview}...']\n\nUsuário selecionou: {text}"
     
-    # Validar após formatação
-    if not formatted_message or not formatted_message.strip():
-        print(f"⚠️ Mensagem ficou vazia após formatação. Original: {message[:100]}")
+    return f"[CONTEXTO: O usuário clicou no botão/lista '{text}']\n\nUsuário selecionou: {text}"
+
+
+async def fetch_recent_history(db: AsyncSession, conversation_id: int) -> list:
+    """
+    Busca as últimas mensagens da conversa no banco e carrega o histórico em memória.
+    Usado só no miss de `conversation_history.get()`.
+    """
+    marker = conversation_history.begin_load()
+    rows = list(await db.scalars(
+        select(Message).where(
+            Message.conversation_id == conversation_id
+        ).order_by(Message.created_at.desc()).limit(HISTORY_TURNS)
+    ))
+    rows.reverse()
+    return conversation_history.load(conversation_id, rows, marker)
+
+
+async def mark_messages_processed(db: AsyncSession, message_ids: list[int], commit: bool = True):
+    """
+    Marca mensagens recebidas como processadas (Message.processed/processed_at).
+    Mensagens não processadas são retomadas no startup.
+    """
+    if not message_ids:
         return
     
-    # Dividir se necessário
-    parts = await split_long_message(formatted_message, max_chars=800)
-    
-    print(f"📤 Enviando {len(parts)} parte(s) para {phone}")
-    
-    # Enviar cada parte com pequeno delay entre elas
-    for i, part in enumerate(parts, 1):
-        if len(parts) > 1:
-            print(f"   Parte {i}/{len(parts)}: {len(part)} caracteres")
-        
-        # Debug: mostrar preview da mensagem
-        print(f"   Preview: {part[:100]}...")
+    await db.execute(
+        update(Message)
+        .where(Message.id.in_(message_ids))
+        .values(processed=True, processed_at=datetime.utcnow())
+    )
+    if commit:
+        await db.commit()
+
+
+# Ordem dos status de entrega (webhooks podem chegar fora de ordem)
+DELIVERY_STATUS_ORDER = ["pending", "sent", "delivered", "read"]
+
+
+async def apply_status_updates(db: AsyncSession, statuses: list[dict]) -> int:
+    """
+    Atualiza Message.status das mensagens enviadas a partir dos status
+    de entrega da Cloud API (casados pelo wamid). Um único commit.
+    Nunca rebaixa o status (ex: 'delivered' atrasado depois de 'read').
+    Retorna quantas mensagens foram atualizadas.
+    """
+    updated = 0
+    for status in statuses:
+        wamid = status.get("message_id")
+        new_status = status.get("status")
+        if not wamid or not new_status:
+            continue
         
-        # Enviar via WhatsApp adapter
-        result = await whatsapp_adapter.send_message(phone, part)
+        stmt = update(Message).where(
+            Message.message_id == wamid,
+            Message.direction == "outgoing"
+        )
         
-        if result.get("status") != "success":
-            print(f"⚠️ Erro ao enviar mensagem: {result.get('error', 'Unknown error')}")
+        if new_status == "failed":
+            stmt = stmt.values(status=new_status, error_message=str(status.get("errors") or "Unknown error"))
+        elif new_status in DELIVERY_STATUS_ORDER:
+            previous = DELIVERY_STATUS_ORDER[:DELIVERY_STATUS_ORDER.index(new_status)]
+            stmt = stmt.where(Message.status.in_(previous)).values(status=new_status)
         else:
-            print(f"✅ Mensagem enviada com sucesso")
-        
-        # Salvar no banco (salva cada parte como mensagem separada)
-        new_message = Message(
-            conversation_id=conversation_id,
-            text=part,
-            direction="outgoing",
-            status="sent"
-        )
-        db.add(new_message)
-        db.commit()
+            continue
         
-        # Delay entre mensagens (se houver múltiplas partes)
-        if i < len(parts):
-            await asyncio.sleep(1.5)  # 1.5s entre cada parte para parecer mais natural
+        result = await db.execute(stmt)
+        updated += result.rowcount
+    
+    await db.commit()
+    return updated
 
 
 async def process_stacked_messages(phone: str):
@@ -163,170 +305,273 @@ async def process_stacked_messages(phone: str):
     Processa mensagens empilhadas após o tempo de debounce.
     Junta todas as mensagens em uma única string e processa com o agente.
     """
+    # Reivindicar a pilha (lease de posse do telefone)
     try:
-        queue_data = message_queue[phone]
-        messages = queue_data["messages"]
-        contact_name = queue_data["contact_name"]
-        conversation_id = queue_data["conversation_id"]
-        
-        if not messages:
-            return
+        stack = await stacking_backend.claim(phone, STACKING_OWNER, STACKING_LEASE_SECONDS)
+    except Exception as e:
+        logger.error("stack_claim_failed", "❌ Erro ao reivindicar pilha de %s: %s", phone, e, phone=phone)
+        return
+    
+    if stack is None:
+        # Nada pendente, deadline foi estendido ou outro worker está processando
+        return
+    
+    # Trace do turno aberto no webhook (spans do processamento e do envio)
+    trace = tracer.take_turn(
+        phone, phone=phone, conversation_id=stack.conversation_id, messages=len(stack.messages)
+    )
+    trace_token = tracer.attach(trace)
+    
+    if stack.first_stacked_at is not None:
+        DEBOUNCE_WAIT_SECONDS.observe(max(0.0, time.time() - stack.first_stacked_at))
+        tracer.add_span("debounce_wait", stack.first_stacked_at, time.time())
+    
+    completed = False
+    try:
+        messages = stack.messages
+        contact_name = stack.contact_name
+        conversation_id = stack.conversation_id
         
         # Juntar todas as mensagens com quebra de linha
         combined_message = "\n".join(messages)
         
-        print(f"📦 Processando {len(messages)} mensagem(ns) empilhada(s) de {phone}")
-        print(f"💬 Mensagem combinada: {combined_message}")
+        logger.info(
+            "stack_processing", "📦 Processando %d mensagem(ns) empilhada(s) de %s", len(messages), phone,
+            phone=phone, conversation_id=conversation_id, messages=len(messages)
+        )
+        logger.debug("stack_combined", "💬 Mensagem combinada: %s", combined_message)
         
-        # Buscar últimas 5 mensagens para contexto
-        from database import SessionLocal
-        db = SessionLocal()
+        # Últimas 5 mensagens para contexto: histórico em memória, banco só no miss
+        # (a sessão é fechada antes da chamada ao agente, sem segurar conexão)
+        with tracer.span("context_load") as span:
+            previous_messages = conversation_history.get(conversation_id)
+            if span is not None:
+                span.attributes["source"] = "memory" if previous_messages is not None else "db"
+            if previous_messages is None:
+                async with AsyncSessionLocal() as db:
+                    conversation = await db.get(Conversation, conversation_id)
+                    
+                    if not conversation:
+                        logger.warning("conversation_not_found", "⚠️ Conversação %s não encontrada", conversation_id)
+                        await mark_messages_processed(db, stack.message_ids)
+                        completed = True
+                        return
+                    
+                    previous_messages = await fetch_recent_history(db, conversation_id)
+        
+        # Iniciar digitação em paralelo ao processamento
+        typing_task = asyncio.create_task(simulate_typing(phone, duration=8.0))
         
         try:
-            # Buscar conversação
-            conversation = db.query(Conversation).filter(
-                Conversation.id == conversation_id
-            ).first()
+            # Processar com o agente (enquanto simula digitação em paralelo)
+            with tracer.span("agent_run"), AGENT_RUN_SECONDS.time(), agent_log_writer.timed(
+                "agent_run",
+                conversation_id,
+                {"messages": len(messages), "chars": len(combined_message)}
+            ) as log_output:
+                reply = await run_agent(
+                    message=combined_message,
+                    conversation_id=conversation_id,
+                    previous_messages=previous_messages,
+                    contact_name=contact_name,
+                    callbacks=[ToolCallLogger(agent_log_writer, conversation_id)]
+                )
+                log_output.update(
+                    response_chars=len(reply.text or ""),
+                    buttons=bool(reply.buttons),
+                    list=bool(reply.list_data)
+                )
             
-            if not conversation:
-                print(f"⚠️ Conversação {conversation_id} não encontrada")
-                return
+            # contact_id do cache quando bate com a conversa; senão é resolvido na gravação
+            cached = contact_cache.get(phone)
+            token_usage_recorder.record(
+                reply.usage,
+                conversation_id,
+                cached.contact_id if cached and cached.conversation_id == conversation_id else None
+            )
+            response = reply.text
             
-            # Buscar últimas 5 mensagens
-            previous_messages = db.query(Message).filter(
-                Message.conversation_id == conversation_id
-            ).order_by(Message.created_at.desc()).limit(5).all()
+            logger.info(
+                "agent_reply", "🤖 Resposta do agente: %d caracteres", len(response or ""),
+                conversation_id=conversation_id, buttons=bool(reply.buttons), list=bool(reply.list_data)
+            )
+            logger.debug("agent_reply_text", "Resposta: %s", response)
             
-            previous_messages.reverse()
+            # Validar resposta
+            if not response or not response.strip():
+                logger.error("agent_empty_reply", "❌ Agente retornou resposta vazia", conversation_id=conversation_id)
+                response = "Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente."
             
-            # Iniciar digitação em paralelo ao processamento
-            typing_task = asyncio.create_task(simulate_typing(phone, duration=8.0))
+            # Verificar se há lista ou botões preparados nesta execução
+            if reply.list_data:
+                # Lista interativa (fallback: texto formatado)
+                from whatsapp_tools import format_list_as_text
+                list_text = response if response else reply.list_data.get("body", "Lista de opções")
+                payload, parts = fit_interactive_body(reply.list_data)
+                parts.append(OutboundPart(
+                    kind="list",
+                    text=list_text,
+                    payload=payload,
+                    fallback=await build_text_parts(format_list_as_text(payload))
+                ))
+            
+            elif reply.buttons:
+                # Botões interativos (fallback: texto normal)
+                payload, parts = fit_interactive_body(reply.buttons)
+                # Se o início do corpo já vai como texto, a parte interativa é só o restante
+                buttons_text = payload["body"]["text"] if parts else response
+                parts.append(OutboundPart(
+                    kind="buttons",
+                    text=buttons_text,
+                    payload=payload,
+                    fallback=await build_text_parts(buttons_text)
+                ))
+            
+            else:
+                # Resposta normal
+                parts = await build_text_parts(response)
+            
+            # Entregar ao dispatcher; as mensagens são marcadas como
+            # processadas depois que a resposta for enviada e salva
+            outbound_dispatcher.enqueue(OutboundReply(
+                phone=phone,
+                conversation_id=conversation_id,
+                parts=parts,
+                message_ids=stack.message_ids,
+                trace=trace
+            ))
             
-            try:
-                # Processar com o agente (enquanto simula digitação em paralelo)
-                print(f"🤖 Chamando agente com mensagem: {combined_message}")
-                response = await run_agent(
-                    message=combined_message,
-                    conversation_id=conversation_id,
-                    previous_messages=previous_messages,
-                    contact_name=contact_name
-                )
-                
-                # Debug detalhado da resposta
-                print(f"🤖 Resposta do agente recebida:")
-                print(f"   - Tipo: {type(response)}")
-                print(f"   - Tamanho: {len(response) if response else 0} caracteres")
-                print(f"   - Preview: {response[:100] if response else 'VAZIO'}...")
-                
-                # Validar resposta
-                if not response or not response.strip():
-                    print("❌ ERRO: Agente retornou resposta vazia!")
-                    response = "Desculpe, ocorreu um erro ao processar sua mensagem. Por favor, tente novamente."
-                
-                # Verificar se há lista ou botões pendentes
-                from tools.whatsapp_list import get_pending_list
-                from tools.whatsapp_buttons import pending_buttons
-                
-                pending_list = get_pending_list()
-                
-                if pending_list.get("list_data"):
-                    # Enviar lista interativa
-                    print(f"📋 Enviando lista interativa para {phone}")
-                    result = await whatsapp_adapter.send_list(phone, pending_list["list_data"])
-                    
-                    if result.get("status") == "success":
-                        print(f"✅ Lista enviada com sucesso")
-                        # Salvar mensagem no banco para manter contexto
-                        list_text = response if response else pending_list["list_data"].get("body", "Lista de opções")
-                        new_message = Message(
-                            conversation_id=conversation_id,
-                            text=list_text,
-                            direction="outgoing",
-                            status="sent"
-                        )
-                        db.add(new_message)
-                        db.commit()
-                    else:
-                        # Fallback: enviar como texto formatado
-                        print(f"⚠️ Falha ao enviar lista, enviando como texto: {result.get('error')}")
-                        from whatsapp_tools import format_list_as_text
-                        text_version = format_list_as_text(pending_list["list_data"])
-                        await send_and_save_message(phone, text_version, conversation_id, db)
-                
-                elif pending_buttons:
-                    # Enviar botões interativos
-                    print(f"🔘 Enviando botões interativos para {phone}")
-                    result = await whatsapp_adapter.send_buttons(phone, response, pending_buttons)
-                    
-                    if result.get("status") == "success":
-                        print(f"✅ Botões enviados com sucesso")
-                        # Salvar mensagem no banco para manter contexto
-                        new_message = Message(
-                            conversation_id=conversation_id,
-                            text=response,
-                            direction="outgoing",
-                            status="sent"
-                        )
-                        db.add(new_message)
-                        db.commit()
-                    else:
-                        # Fallback: enviar como texto normal
-                        print(f"⚠️ Falha ao enviar botões, enviando como texto: {result.get('error')}")
-                        await send_and_save_message(phone, response, conversation_id, db)
-                    
-                    # Limpar botões pendentes
-                    import tools.whatsapp_buttons
-                    tools.whatsapp_buttons.pending_buttons = None
-                
-                else:
-                    # Enviar resposta normal
-                    await send_and_save_message(phone, response, conversation_id, db)
-                
-                print(f"✅ Resposta enviada para {phone}")
-                
-            finally:
-                # Cancelar digitação se ainda estiver rodando
-                if not typing_task.done():
-                    typing_task.cancel()
             
         finally:
-            db.close()
-        
-        # Limpar fila
-        message_queue[phone] = {
-            "messages": [],
-            "timer": None,
-            "contact_name": None,
-            "conversation_id": None
-        }
+            # Cancelar digitação se ainda estiver rodando
+            if not typing_task.done():
+                typing_task.cancel()
+        
+        completed = True
         
     except Exception as e:
-        print(f"❌ Erro ao processar mensagens empilhadas: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("stack_processing_failed", "❌ Erro ao processar mensagens empilhadas: %s", e, phone=phone)
+        agent_log_writer.record(
+            "error",
+            stack.conversation_id,
+            input_data={"phone": phone, "messages": len(stack.messages)},
+            status="error",
+            error_message=str(e)
+        )
+    
+    finally:
+        tracer.detach(trace_token)
+        try:
+            if completed:
+                # Limpar fila (apenas o que foi processado)
+                remaining = await stacking_backend.complete(phone, STACKING_OWNER, stack)
+                if remaining and phone not in debounce_wheel:
+                    # Mensagens chegaram durante o processamento e o timer delas já
+                    # disparou (aqui ou em outro worker): junta tudo na próxima rodada
+                    logger.info(
+                        "stack_rerun", "📥 %d mensagem(ns) chegaram durante o processamento de %s", remaining, phone,
+                        phone=phone
+                    )
+                    agent_scheduler.submit(phone)
+            else:
+                # Mantém a pilha para a próxima tentativa
+                await stacking_backend.release(phone, STACKING_OWNER)
+        except Exception as e:
+            logger.error("stack_release_failed", "❌ Erro ao liberar pilha de %s: %s", phone, e, phone=phone)
 
 
-async def schedule_message_processing(phone: str):
+async def schedule_message_processing(phone: str, delay: float = None):
     """
     Agenda o processamento das mensagens após o tempo de debounce.
     Se uma nova mensagem chegar, cancela o timer anterior e cria um novo.
     """
-    queue_data = message_queue[phone]
+    if delay is None:
+        delay = DEBOUNCE_TIME
     
-    # Cancelar timer anterior se existir
-    if queue_data["timer"] is not None:
-        queue_data["timer"].cancel()
-        print(f"⏱️ Timer cancelado para {phone}, reagendando...")
+    # Reagendar é só mover o deadline na timer wheel
+    rescheduled = phone in debounce_wheel
+    debounce_wheel.schedule(phone, delay)
     
-    # Criar novo timer
-    loop = asyncio.get_event_loop()
-    timer = loop.call_later(
-        DEBOUNCE_TIME,
-        lambda: asyncio.create_task(process_stacked_messages(phone))
+    logger.debug(
+        "debounce_scheduled", "⏱️ Timer de %.1fs %s para %s", delay,
+        "reagendado" if rescheduled else "iniciado", phone
     )
+
+
+def on_debounce_expired(phone: str):
+    """Callback da timer wheel quando o debounce de um telefone expira"""
+    agent_scheduler.submit(phone)
+
+
+# Timer wheel dona de todos os deadlines de debounce (tick de 250ms)
+debounce_wheel = TimerWheel(on_debounce_expired, tick=0.25)
+
+# Uma execução do agente por conversa, limitado a AGENT_MAX_WORKERS simultâneas
+agent_scheduler = ConversationScheduler(process_stacked_messages)
+
+
+async def recover_pending_stacks():
+    """
+    Reconstrói as pilhas a partir das mensagens recebidas e não processadas
+    (reinício durante o debounce ou no meio de uma execução do agente).
+    
+    Só considera mensagens das últimas STACKING_RECOVERY_HOURS horas que
+    ainda não têm resposta do bot depois delas na conversa (envios que
+    falharam não contam como resposta).
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=STACKING_RECOVERY_HOURS)
+    
+    async with AsyncSessionLocal() as db:
+        # Última resposta do bot por conversa
+        last_outgoing = select(
+            Message.conversation_id,
+            func.max(Message.created_at).label("last_at")
+        ).where(
+            Message.direction == "outgoing",
+            Message.status.is_(None) | (Message.status != "failed")
+        ).group_by(Message.conversation_id).subquery()
+        
+        pending = list(await db.scalars(
+            select(Message).outerjoin(
+                last_outgoing, last_outgoing.c.conversation_id == Message.conversation_id
+            ).where(
+                Message.direction == "incoming",
+                Message.processed == False,  # noqa: E712
+                Message.remote_jid.isnot(None),
+                Message.conversation_id.isnot(None),
+                Message.created_at >= cutoff,
+                (last_outgoing.c.last_at.is_(None)) | (Message.created_at > last_outgoing.c.last_at)
+            ).order_by(Message.created_at).options(selectinload(Message.contact))
+        ))
+        
+        if not pending:
+            return 0
+        
+        phones = set()
+        for msg in pending:
+            parsed = whatsapp_adapter.parse_webhook(msg.raw_data) if msg.raw_data else None
+            is_interactive = bool(parsed and parsed.get("interactive_data"))
+            text = await enrich_interactive_text(db, msg.conversation_id, msg.text) if is_interactive else msg.text
+            contact_name = msg.contact.name if msg.contact else None
+            
+            await stacking_backend.push(
+                msg.remote_jid,
+                text,
+                contact_name,
+                msg.conversation_id,
+                0,
+                message_row_id=msg.id
+            )
+            phones.add(msg.remote_jid)
     
-    queue_data["timer"] = timer
-    print(f"⏱️ Timer de {DEBOUNCE_TIME}s iniciado para {phone}")
+    for phone in phones:
+        await schedule_message_processing(phone, 1.0)
+    
+    logger.info(
+        "stacks_recovered", "♻️ %d mensagem(ns) não processada(s) retomada(s) para %d contato(s)",
+        len(pending), len(phones)
+    )
+    return len(pending)
 
 
 async def mark_message_as_read(phone: str, message_id: str, delay: float = 1.5):
@@ -345,13 +590,11 @@ async def mark_message_as_read(phone: str, message_id: str, delay: float = 1.5):
         # Aguardar o delay
         await asyncio.sleep(delay)
         
-        print(f"👀 Marcando mensagem como lida para {phone} (ID: {message_id})")
-        
         # Marcar como lida via adapter
         result = await whatsapp_adapter.mark_as_read(phone, message_id)
         
         if result.get("status") == "success":
-            print(f"✅ Mensagem marcada como lida para {phone}")
+            logger.debug("marked_read", "👀 Mensagem %s marcada como lida para %s", message_id, phone)
         elif result.get("status") == "not_supported":
             pass  # Silenciar
         else:
@@ -359,7 +602,7 @@ async def mark_message_as_read(phone: str, message_id: str, delay: float = 1.5):
             if isinstance(error, dict):
                 # Silenciar erros conhecidos da API oficial
                 return
-            print(f"⚠️ Falha ao marcar como lida")
+            logger.warning("mark_read_failed", "⚠️ Falha ao marcar como lida", phone=phone)
     
     except Exception as e:
         pass  # Silenciar erros de marcar como lida
@@ -369,17 +612,87 @@ load_dotenv()
 
 app = FastAPI()
 
+# Latência por rota/status em /metrics (inclui o recebimento do webhook)
+app.add_middleware(MetricsMiddleware)
+
+# Spans `graph_api` no trace do turno (mesmos event hooks das métricas)
+instrument_graph_hooks(GRAPH_EVENT_HOOKS)
+
+# Filas e execuções em andamento (lidas só quando /metrics é consultado)
+metrics.REGISTRY.gauge(
+    "outbound_queue_depth", "Partes de resposta aguardando envio",
+    lambda: outbound_dispatcher.stats()["queue_depth"]
+)
+metrics.REGISTRY.gauge(
+    "agent_runs_queued", "Conversas aguardando uma vaga no pool do agente",
+    lambda: agent_scheduler.stats()["queued"]
+)
+metrics.REGISTRY.gauge(
+    "agent_runs_in_flight", "Execuções do agente em andamento",
+    lambda: agent_scheduler.stats()["in_flight"]
+)
+metrics.REGISTRY.gauge(
+    "debounce_timers_pending", "Contatos com debounce em andamento neste worker",
+    lambda: debounce_wheel.stats()["pending"]
+)
+metrics.REGISTRY.gauge(
+    "agent_log_buffered", "Registros de AgentLog aguardando gravação em lote",
+    lambda: agent_log_writer.stats()["buffered"]
+)
+
 # Inicializar banco de dados na inicialização da aplicação
 @app.on_event("startup")
 async def startup_event():
     init_db()
-    print("Banco de dados inicializado!")
-    print(f"⏱️ Sistema de empilhamento: {DEBOUNCE_TIME}s de espera entre mensagens")
-    print(f"📱 Provider: WhatsApp Business API (Oficial)")
-    print(f"✅ Envio de mensagens: Suportado")
-    print(f"✅ Recebimento de webhooks: Suportado")
-    print(f"✅ Status de entrega: Suportado")
-    print(f"✅ Marcar como lida: Suportado")
+    logger.info("startup", "🗄️ Banco de dados inicializado: %s", describe_engine())
+    logger.info("startup", "⏱️ Sistema de empilhamento: janela adaptativa por contato (padrão %ss)", DEBOUNCE_TIME)
+    logger.info("startup", "📦 Backend de empilhamento: %s (worker %s)", STACKING_BACKEND, STACKING_OWNER)
+    
+    debounce_wheel.start()
+    agent_scheduler.start()
+    agent_log_writer.start()
+    token_usage_recorder.start()
+    retention_manager.start()
+    conversation_lifecycle.start()
+    if tracer.exporter is not None:
+        tracer.exporter.start()
+        logger.info("startup", "🔭 Exportando traces para %s", tracer.exporter.url)
+    logger.info("startup", "🤖 Pool do agente: %d execuções simultâneas", agent_scheduler.max_workers)
+    
+    # Retomar pilhas que ficaram pendentes no backend compartilhado
+    if stacking_backend.shared:
+        for phone in await stacking_backend.pending_phones():
+            await schedule_message_processing(phone)
+    
+    # Retomar mensagens recebidas e não processadas (reinício/deploy)
+    try:
+        await recover_pending_stacks()
+    except Exception as e:
+        logger.warning("stacks_recovery_failed", "⚠️ Erro ao retomar mensagens pendentes: %s", e)
+    
+    # Retomar campanhas que estavam em envio
+    resumed = await campaign_engine.resume_active()
+    if resumed:
+        logger.info("startup", "📣 Campanhas retomadas: %s", resumed)
+    logger.info("startup", "📱 Provider: WhatsApp Business API (Oficial)")
+    if os.getenv("WHATSAPP_DISABLE_SIGNATURE_VALIDATION", "false").lower() == "true":
+        logger.warning("startup", "⚠️ Validação de assinatura do webhook desabilitada")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    debounce_wheel.stop()
+    await agent_scheduler.drain(timeout=5.0)
+    await campaign_engine.stop()
+    await retention_manager.stop()
+    await conversation_lifecycle.stop()
+    await outbound_dispatcher.drain(timeout=10.0)
+    await token_usage_recorder.stop()
+    await agent_log_writer.stop()
+    if tracer.exporter is not None:
+        await tracer.exporter.stop()
+    await whatsapp_adapter.aclose()
+    await async_engine.dispose()
 
 FACEBOOK_ACCESS_TOKEN = os.getenv("FACEBOOK_ACCESS_TOKEN")
 
@@ -387,12 +700,159 @@ FACEBOOK_ACCESS_TOKEN = os.getenv("FACEBOOK_ACCESS_TOKEN")
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/debug/stacking")
+async def stacking_stats():
+    """
+    Métricas do sistema de empilhamento: pilhas pendentes e atraso dos timers
+    """
+    return {
+        "backend": STACKING_BACKEND,
+        "worker": STACKING_OWNER,
+        "timers": debounce_wheel.stats(),
+        "debounce": adaptive_debounce.stats(),
+        "agent_pool": agent_scheduler.stats(),
+        "contact_cache": contact_cache.stats(),
+        "conversation_history": conversation_history.stats(),
+        "conversation_lifecycle": conversation_lifecycle.stats(),
+        "agent_log": agent_log_writer.stats(),
+        "pending_stacks": len(await stacking_backend.pending_phones())
+    }
+
+@app.get("/debug/outbound")
+async def outbound_stats():
+    """
+    Fila de envio: profundidade e atraso entre enfileirar e enviar
+    """
+    return outbound_dispatcher.stats()
+
+@app.get("/debug/whatsapp")
+async def whatsapp_stats():
+    """
+    Latência, retentativas e falhas por endpoint da WhatsApp Cloud API
+    """
+    return whatsapp_adapter.stats()
+
+@app.get("/debug/retention")
+async def retention_stats():
+    """
+    Políticas de retenção, última execução e totais arquivados/apagados
+    """
+    return retention_manager.stats()
+
+@app.get("/debug/logging")
+async def logging_stats():
+    """
+    Nível e formato do log, fila do handler, descartes e eventos amostrados
+    """
+    return structured_logging.stats()
+
+@app.get("/debug/traces")
+async def recent_traces(limit: int = Query(50, ge=1, le=500)):
+    """
+    Últimos traces de turno (resumo) e estado do buffer/exportador
+    """
+    return {"tracer": tracer.stats(), "traces": tracer.recent(limit)}
+
+@app.get("/debug/traces/{trace_id}")
+async def trace_detail(trace_id: str):
+    """
+    Spans de um turno: webhook -> debounce -> contexto -> agente/ferramentas -> envio
+    """
+    trace = tracer.get(trace_id)
+    if trace is None:
+        return JSONResponse(content={"error": "Trace não encontrado (expirou do buffer?)"}, status_code=404)
+    return trace.to_dict()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Métricas do pipeline no formato de texto do Prometheus
+    """
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/metrics/cost")
+async def token_cost(days: int = Query(30, ge=1, le=365), db: AsyncSession = Depends(get_async_db)):
+    """
+    Tokens e custo reais do LLM por dia, contato e caminho de ferramentas
+    """
+    # Inclui as execuções que ainda estão no buffer
+    await token_usage_recorder.flush()
+    report = await db.run_sync(lambda session: cost_report(session, days))
+    return {**report, "recorder": token_usage_recorder.stats()}
+
+@app.post("/campaigns")
+async def create_campaign(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Cria uma campanha (status draft)
+    Body: {"name": "...", "whatsapp_template": {"name": "promo", "language": "pt_BR", "components": [...]},
+           "target_audience": {"tags": ["cliente"]}}
+    Na Cloud API o whatsapp_template (template aprovado) é obrigatório; message_template
+    (texto livre, "Olá {first_name}!") só é aceito por adaptadores sem a janela de 24h.
+    """
+    data = await request.json()
+    if not data.get("name"):
+        return {"status": "error", "message": "name é obrigatório"}
+    error = validate_campaign(
+        data.get("message_template"), data.get("whatsapp_template"), whatsapp_adapter.requires_template
+    )
+    if error:
+        return {"status": "error", "message": error}
+    
+    campaign = Campaign(
+        name=data["name"],
+        description=data.get("description"),
+        message_template=data.get("message_template"),
+        whatsapp_template=data.get("whatsapp_template"),
+        target_audience=data.get("target_audience") or {},
+        status="draft"
+    )
+    db.add(campaign)
+    await db.commit()
+    return {"status": "success", "campaign_id": campaign.id}
+
+@app.post("/campaigns/{campaign_id}/start")
+async def start_campaign(campaign_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Inicia (ou retoma) o envio da campanha em background
+    """
+    campaign = await db.get(Campaign, campaign_id)
+    if not campaign:
+        return {"status": "error", "message": "Campanha não encontrada"}
+    if campaign.status == "completed":
+        return {"status": "error", "message": "Campanha já concluída"}
+    error = validate_campaign(
+        campaign.message_template, campaign.whatsapp_template, whatsapp_adapter.requires_template
+    )
+    if error:
+        return {"status": "error", "message": error}
+    
+    started = campaign_engine.start(campaign_id)
+    return {"status": "success", "message": "Campanha iniciada" if started else "Campanha já em envio"}
+
+@app.post("/campaigns/{campaign_id}/pause")
+async def pause_campaign(campaign_id: int):
+    """
+    Pausa o envio; as entregas pendentes são enviadas ao retomar
+    """
+    await campaign_engine.pause(campaign_id)
+    return {"status": "success", "message": "Campanha pausada"}
+
+@app.get("/campaigns/{campaign_id}/progress")
+async def campaign_progress(campaign_id: int):
+    """
+    Progresso da campanha: enviadas, falhas, pendentes, vazão (msgs/s) e ETA
+    """
+    progress = await campaign_engine.progress(campaign_id)
+    if progress is None:
+        return {"status": "error", "message": "Campanha não encontrada"}
+    return progress
+
 @app.get("/")
 async def root():
     return {"message": "Agente de Campanhas API"}
 
 @app.post("/test/message")
-async def test_message(request: Request, db: Session = Depends(get_db)):
+async def test_message(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Endpoint de teste para simular mensagem direta ao agente
     Body: {"message": "sua mensagem aqui", "phone": "5511999999999"}
@@ -403,28 +863,30 @@ async def test_message(request: Request, db: Session = Depends(get_db)):
         phone = data.get("phone", "5511999999999")
         contact_name = data.get("name", "Teste")
         
-        print(f"\n{'='*50}")
-        print(f"🧪 TESTE DIRETO - Mensagem: {message}")
-        print(f"{'='*50}\n")
+        logger.info("test_message", "🧪 Teste direto (%d caracteres)", len(message))
+        logger.debug("test_message_text", "Mensagem: %s", message)
         
         # Criar ou buscar contato e conversação
-        contact = db.query(Contact).filter(Contact.phone == phone).first()
+        contact = await db.scalar(select(Contact).where(Contact.phone == phone))
         
         if not contact:
             contact = Contact(phone=phone, name=contact_name)
             db.add(contact)
-            db.commit()
-            db.refresh(contact)
+            await db.commit()
+            await db.refresh(contact)
         
-        conversation = db.query(Conversation).filter(
-            Conversation.contact_id == contact.id
-        ).first()
+        conversation = await db.scalar(
+            select(Conversation).where(
+                Conversation.contact_id == contact.id,
+                Conversation.status == "active"
+            ).limit(1)
+        )
         
         if not conversation:
             conversation = Conversation(contact_id=contact.id)
             db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
+            await db.commit()
+            await db.refresh(conversation)
         
         # Salvar mensagem recebida
         incoming_msg = Message(
@@ -434,30 +896,28 @@ async def test_message(request: Request, db: Session = Depends(get_db)):
             status="received"
         )
         db.add(incoming_msg)
-        db.commit()
+        await db.commit()
+        conversation_history.append(conversation.id, "incoming", message)
         
         # Buscar contexto
-        previous_messages = db.query(Message).filter(
-            Message.conversation_id == conversation.id
-        ).order_by(Message.created_at.desc()).limit(5).all()
-        previous_messages.reverse()
+        previous_messages = conversation_history.get(conversation.id)
+        if previous_messages is None:
+            previous_messages = await fetch_recent_history(db, conversation.id)
         
         # Chamar agente
-        print(f"🤖 Chamando agente...")
-        response = await run_agent(
-            message=message,
-            conversation_id=conversation.id,
-            previous_messages=previous_messages,
-            contact_name=contact_name
-        )
+        with agent_log_writer.timed("agent_run", conversation.id, {"messages": 1, "chars": len(message)}):
+            reply = await run_agent(
+                message=message,
+                conversation_id=conversation.id,
+                previous_messages=previous_messages,
+                contact_name=contact_name,
+                callbacks=[ToolCallLogger(agent_log_writer, conversation.id)]
+            )
+        token_usage_recorder.record(reply.usage, conversation.id, contact.id)
+        response = reply.text
         
-        print(f"\n{'='*50}")
-        print(f"🤖 RESPOSTA DO AGENTE:")
-        print(f"{'='*50}")
-        print(f"Tipo: {type(response)}")
-        print(f"Tamanho: {len(response) if response else 0} caracteres")
-        print(f"Conteúdo:\n{response}")
-        print(f"{'='*50}\n")
+        logger.info("test_reply", "🤖 Resposta do agente: %d caracteres", len(response or ""))
+        logger.debug("test_reply_text", "Resposta: %s", response)
         
         # Salvar resposta
         outgoing_msg = Message(
@@ -467,19 +927,21 @@ async def test_message(request: Request, db: Session = Depends(get_db)):
             status="sent"
         )
         db.add(outgoing_msg)
-        db.commit()
+        await mark_messages_processed(db, [incoming_msg.id], commit=False)
+        await db.commit()
+        conversation_history.append(conversation.id, "outgoing", response)
         
         return {
             "status": "success",
             "message": message,
             "response": response,
-            "response_length": len(response) if response else 0
+            "response_length": len(response) if response else 0,
+            "buttons": reply.buttons,
+            "list": reply.list_data
         }
         
     except Exception as e:
-        print(f"❌ Erro no teste: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("test_message_failed", "❌ Erro no teste: %s", e)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
@@ -498,32 +960,29 @@ async def whatsapp_business_webhook_verify(
         
         config = ACTIVE_WHATSAPP_CONFIG
         
-        print(f"🔍 Webhook verification started")
-        print(f"🔍 mode={mode}, token={token}, challenge={challenge}")
-        
         # Verificar token
         if mode == "subscribe" and token == config.webhook_verify_token:
-            print("✅ Webhook verified successfully")
+            logger.info("webhook_verified", "✅ Webhook verificado")
             return PlainTextResponse(content=challenge, status_code=200)
         else:
-            print("⚠️ Webhook verification failed")
+            logger.warning("webhook_verify_failed", "⚠️ Falha na verificação do webhook", mode=mode)
             return JSONResponse(content={"error": "Verification failed"}, status_code=403)
     except Exception as e:
-        print(f"💥 Exception in webhook verify: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("webhook_verify_error", "💥 Erro na verificação do webhook: %s", e)
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
 
 @app.post("/webhook/whatsapp")
-async def whatsapp_business_webhook(request: Request, db: Session = Depends(get_db)):
+async def whatsapp_business_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Webhook para receber mensagens da WhatsApp Business API
     POST endpoint para processar eventos do WhatsApp
     
     Segurança: Valida assinatura X-Hub-Signature-256 do Meta
     """
+    request_start = time.perf_counter()
+    request_started_at = time.time()
     try:
         # Ler body uma vez só (necessário para validação de assinatura)
         body = await request.body()
@@ -537,7 +996,7 @@ async def whatsapp_business_webhook(request: Request, db: Session = Depends(get_
             signature = request.headers.get("X-Hub-Signature-256", "")
             
             if not signature:
-                print("🚫 Requisição sem assinatura - rejeitada")
+                logger.warning("webhook_rejected", "🚫 Requisição sem assinatura - rejeitada")
                 return JSONResponse(content={"error": "Missing signature"}, status_code=403)
             
             expected_signature = "sha256=" + hmac.new(
@@ -547,22 +1006,17 @@ async def whatsapp_business_webhook(request: Request, db: Session = Depends(get_
             ).hexdigest()
             
             if not hmac.compare_digest(signature, expected_signature):
-                print(f"🚫 Assinatura inválida - rejeitada")
+                logger.warning("webhook_rejected", "🚫 Assinatura inválida - rejeitada")
                 return JSONResponse(content={"error": "Invalid signature"}, status_code=403)
-            
-            print("✅ Assinatura válida")
-        elif disable_signature:
-            print("⚠️ Validação de assinatura desabilitada")
         
-        print(f"📱 WhatsApp Business webhook recebido: {data}")
+        # Payload completo só em DEBUG (formatado no listener, fora da requisição)
+        logger.debug("webhook_payload", "📱 Webhook recebido: %s", data)
         
         # Parse webhook usando adaptador
         parsed_data = whatsapp_adapter.parse_webhook(data)
         
-        print(f"🔍 Parsed data: {parsed_data}")
-        
         if not parsed_data:
-            print("❌ Parse retornou None/vazio")
+            logger.debug("webhook_ignored", "Evento sem mensagem/status ignorado")
             return {"status": "ignored", "reason": "not a message event"}
         
         if parsed_data["type"] == "message":
@@ -580,36 +1034,63 @@ async def whatsapp_business_webhook(request: Request, db: Session = Depends(get_
             interactive_data = parsed_data.get("interactive_data")
             is_interactive = interactive_data is not None
             
-            if is_interactive:
-                print(f"🔘 Resposta interativa de {remote_jid}: {text}")
-            else:
-                print(f"💬 Mensagem de {remote_jid}: {text}")
-            
-            # Verificar/criar contato
-            contact = db.query(Contact).filter(Contact.phone == remote_jid).first()
-            if not contact:
-                contact = Contact(
-                    phone=remote_jid,
-                    name=push_name,
-                    last_interaction=datetime.utcnow()
-                )
-                db.add(contact)
-                db.flush()
-            else:
-                if push_name and not contact.name:
-                    contact.name = push_name
-                contact.last_interaction = datetime.utcnow()
+            logger.info(
+                "webhook_received", "%s de %s (%d caracteres)",
+                "🔘 Resposta interativa" if is_interactive else "💬 Mensagem", remote_jid, len(text or ""),
+                phone=remote_jid, message_id=message_id
+            )
+            logger.debug("webhook_text", "Texto: %s", text)
             
-            # Verificar/criar conversação ativa
-            conversation = db.query(Conversation).filter(
-                Conversation.contact_id == contact.id,
-                Conversation.status == "active"
-            ).first()
+            # Contato e conversa ativa: cache quente primeiro, banco só no miss
+            cached = contact_cache.get(remote_jid)
+            if cached and not await touch_conversation(db, cached.conversation_id):
+                # Conversa encerrada por inatividade: resolve no banco e abre outra
+                contact_cache.invalidate(remote_jid)
+                cached = None
             
-            if not conversation:
-                conversation = Conversation(contact_id=contact.id, context={})
-                db.add(conversation)
-                db.flush()
+            if cached:
+                contact_id = cached.contact_id
+                conversation_id = cached.conversation_id
+                contact_name = cached.name
+                
+                values = {"last_interaction": datetime.utcnow()}
+                if push_name and not contact_name:
+                    values["name"] = contact_name = push_name
+                await db.execute(update(Contact).where(Contact.id == contact_id).values(**values))
+            else:
+                # Verificar/criar contato
+                contact = await db.scalar(select(Contact).where(Contact.phone == remote_jid))
+                if not contact:
+                    contact = Contact(
+                        phone=remote_jid,
+                        name=push_name,
+                        last_interaction=datetime.utcnow()
+                    )
+                    db.add(contact)
+                    await db.flush()
+                else:
+                    if push_name and not contact.name:
+                        contact.name = push_name
+                    contact.last_interaction = datetime.utcnow()
+                
+                # Verificar/criar conversação ativa
+                conversation = await db.scalar(
+                    select(Conversation).where(
+                        Conversation.contact_id == contact.id,
+                        Conversation.status == "active"
+                    ).limit(1)
+                )
+                if conversation and not await touch_conversation(db, conversation.id):
+                    conversation = None  # encerrada entre a consulta e agora
+                
+                if not conversation:
+                    conversation = Conversation(contact_id=contact.id, context={})
+                    db.add(conversation)
+                    await db.flush()
+                
+                contact_id = contact.id
+                conversation_id = conversation.id
+                contact_name = contact.name
             
             # Salvar mensagem
             db_message = Message(
@@ -621,73 +1102,87 @@ async def whatsapp_business_webhook(request: Request, db: Session = Depends(get_
                 text=text,
                 status="received",
                 raw_data=data,
-                contact_id=contact.id,
-                conversation_id=conversation.id
+                contact_id=contact_id,
+                conversation_id=conversation_id
             )
             db.add(db_message)
-            db.commit()
+            await db.commit()
+            
+            # Write-through (só depois do commit, para não cachear linha desfeita)
+            contact_cache.put(remote_jid, contact_id, conversation_id, contact_name)
+            conversation_history.append(conversation_id, "incoming", text)
             
             # Se for mensagem interativa, enriquecer com contexto
-            if is_interactive:
-                last_bot_msg = db.query(Message).filter(
-                    Message.conversation_id == conversation.id,
-                    Message.direction == "outgoing"
-                ).order_by(Message.created_at.desc()).first()
-                
-                if last_bot_msg:
-                    context_preview = last_bot_msg.text[:150].replace('\n', ' ')
-                    enriched_text = f"[CONTEXTO: O usuário clicou no botão/lista '{text}' em resposta à mensagem: '{context_preview}...']\n\nUsuário selecionou: {text}"
-                    print(f"📝 Texto enriquecido com contexto da mensagem anterior")
-                else:
-                    enriched_text = f"[CONTEXTO: O usuário clicou no botão/lista '{text}']\n\nUsuário selecionou: {text}"
-            else:
-                enriched_text = text
+            enriched_text = await enrich_interactive_text(db, conversation_id, text) if is_interactive else text
             
-            # Log
-            agent_log = AgentLog(
-                conversation_id=conversation.id,
-                action="receive_message",
+            # Log (gravado em lote, sem commit extra)
+            agent_log_writer.record(
+                "receive_message",
+                conversation_id,
                 input_data={"message_id": message_id, "text": text},
-                status="success"
+                execution_time=elapsed_ms(request_start)
             )
-            db.add(agent_log)
-            db.commit()
             
             # Marcar como lida
             asyncio.create_task(mark_message_as_read(remote_jid, message_id, delay=1.5))
             
+            # Janela de debounce adaptativa (aprende com o histórico do contato)
+            if adaptive_debounce.needs_history(remote_jid):
+                history = await db.scalars(
+                    select(Message.created_at).where(
+                        Message.contact_id == contact_id,
+                        Message.direction == "incoming"
+                    ).order_by(Message.created_at.desc()).limit(HISTORY_SIZE)
+                )
+                adaptive_debounce.load_history(remote_jid, list(history))
+            else:
+                adaptive_debounce.observe(remote_jid)
+            
+            debounce_window = adaptive_debounce.window(remote_jid, text, is_interactive)
+            
             # Sistema de empilhamento
-            queue_data = message_queue[remote_jid]
-            queue_data["messages"].append(enriched_text)  # Usa texto enriquecido se interativo
-            queue_data["contact_name"] = contact.name
-            queue_data["conversation_id"] = conversation.id
+            queue_size = await stacking_backend.push(
+                remote_jid,
+                enriched_text,  # Usa texto enriquecido se interativo
+                contact_name,
+                conversation_id,
+                debounce_window,
+                message_row_id=db_message.id
+            )
             
-            print(f"📥 Mensagem adicionada à fila ({len(queue_data['messages'])} total)")
+            await schedule_message_processing(remote_jid, debounce_window)
             
-            await schedule_message_processing(remote_jid)
+            # Mensagens do mesmo debounce entram no mesmo trace
+            trace = tracer.turn(remote_jid, phone=remote_jid, conversation_id=conversation_id)
+            tracer.add_span(
+                "webhook", request_started_at, time.time(), trace=trace,
+                message_id=message_id, queue_size=queue_size
+            )
             
             return {
                 "status": "queued",
                 "from": remote_jid,
                 "message": text,
                 "saved": True,
-                "conversation_id": conversation.id,
-                "queue_size": len(queue_data["messages"]),
-                "timer_seconds": DEBOUNCE_TIME
+                "conversation_id": conversation_id,
+                "queue_size": queue_size,
+                "timer_seconds": debounce_window,
+                "trace_id": trace.trace_id
             }
         
         elif parsed_data["type"] == "status":
             # Status update (delivered, read, etc)
-            print(f"📊 Status update: {parsed_data}")
-            return {"status": "received", "type": "status"}
+            statuses = parsed_data.get("statuses") or [parsed_data]
+            logger.info("webhook_status", "📊 %d atualização(ões) de status", len(statuses))
+            logger.debug("webhook_status_payload", "Status: %s", statuses)
+            updated = await apply_status_updates(db, statuses)
+            return {"status": "received", "type": "status", "updated": updated}
         
         return {"status": "received"}
         
     except Exception as e:
-        print(f"❌ Erro ao processar WhatsApp Business webhook: {e}")
-        import traceback
-        traceback.print_exc()
-        db.rollback()
+        logger.exception("webhook_error", "❌ Erro ao processar WhatsApp Business webhook: %s", e)
+        await db.rollback()
         return {"status": "error", "message": str(e)}
 
 
@@ -698,7 +1193,7 @@ async def send_message_endpoint(
     phone: str,
     message: str,
     conversation_id: int = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Endpoint para enviar mensagens manualmente.
@@ -708,7 +1203,7 @@ async def send_message_endpoint(
         # Se não tem conversation_id, buscar ou criar
         if not conversation_id:
             # Buscar/criar contato
-            contact = db.query(Contact).filter(Contact.phone == phone).first()
+            contact = await db.scalar(select(Contact).where(Contact.phone == phone))
             if not contact:
                 contact = Contact(
                     phone=phone,
@@ -716,23 +1211,27 @@ async def send_message_endpoint(
                     last_interaction=datetime.utcnow()
                 )
                 db.add(contact)
-                db.flush()
+                await db.flush()
             
             # Buscar/criar conversação
-            conversation = db.query(Conversation).filter(
-                Conversation.contact_id == contact.id,
-                Conversation.status == "active"
-            ).first()
+            conversation = await db.scalar(
+                select(Conversation).where(
+                    Conversation.contact_id == contact.id,
+                    Conversation.status == "active"
+                ).limit(1)
+            )
             
             if not conversation:
                 conversation = Conversation(contact_id=contact.id, context={})
                 db.add(conversation)
-                db.flush()
+                await db.flush()
             
             conversation_id = conversation.id
+            await db.commit()
+            contact_cache.put(phone, contact.id, conversation_id, contact.name)
         
-        await send_and_save_message(phone, message, conversation_id, db)
-        return {"status": "success", "message": "Message sent"}
+        await send_and_save_message(phone, message, conversation_id)
+        return {"status": "success", "message": "Message queued"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -768,8 +1267,10 @@ async def chat_with_agent(message: str, conversation_id: int = None):
     Endpoint para conversar diretamente com o agente
     """
     try:
-        response = await run_agent(message, conversation_id=conversation_id)
-        return {"status": "success", "response": response}
+        reply = await run_agent(message, conversation_id=conversation_id)
+        # contact_id é resolvido pela conversa na gravação (None se não houver conversa)
+        token_usage_recorder.record(reply.usage, conversation_id, None)
+        return {"status": "success", "response": reply.text, "buttons": reply.buttons, "list": reply.list_data}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
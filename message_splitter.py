@@ -0,0 +1,133 @@
+"""
+Divisão de mensagens longas em partes para o WhatsApp
+
+O split antigo juntava seções (`\\n\\n`) por concatenação e mandava inteira
+qualquer seção maior que o limite. Aqui as partes saem de fatias do texto
+original, em tempo linear:
+
+- Procura o ponto de corte de trás para frente dentro da janela de max_chars,
+  caindo de parágrafo -> linha -> frase -> palavra (e corte seco em último caso)
+- Só aceita cortes na segunda metade da janela, então cada parte avança pelo
+  menos max_chars/2 e a busca total é O(n)
+- Nunca corta dentro de um trecho em negrito (`*assim*`)
+
+Limites da Cloud API por tipo de mensagem em MESSAGE_LIMITS; quem chama pode
+pedir partes menores (ex: respostas do agente em partes de 800 caracteres).
+"""
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+import re
+
+MESSAGE_LIMITS = {
+    "text": 4096,  # mensagem de texto
+    "interactive_body": 1024,  # corpo de botões/lista
+}
+
+_BOLD = re.compile(r"\*[^*\n]+\*")
+
+# Separadores em ordem de preferência; o corte fica logo depois do separador
+_BOUNDARIES = (
+    ("\n\n",),
+    ("\n",),
+    (". ", "! ", "? "),
+    (" ", "\t"),
+)
+
+
+def _bold_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    (início, fim) dos negritos do texto inteiro, casados uma vez só. Casar por
+    parte erraria os pares de `*` depois de um corte seco dentro de um negrito.
+    """
+    if "*" not in text:
+        return []
+    return [match.span() for match in _BOLD.finditer(text)]
+
+
+def _bold_containing(bolds: List[Tuple[int, int]], cut: int) -> Optional[int]:
+    """Início do negrito que um corte em `cut` partiria (None se nenhum)"""
+    index = bisect_left(bolds, (cut,)) - 1
+    if index >= 0 and bolds[index][1] > cut:
+        return bolds[index][0]
+    return None
+
+
+def _last_boundary(text: str, separators: Tuple[str, ...], low: int, high: int) -> int:
+    """Posição logo depois do último separador dentro de text[low:high] (-1 se não houver)"""
+    best = -1
+    for sep in separators:
+        found = text.rfind(sep, low, high)
+        if found >= 0:
+            best = max(best, found + len(sep))
+    return best
+
+
+def _find_cut(text: str, start: int, end: int, bolds: List[Tuple[int, int]]) -> int:
+    """Melhor ponto de corte na segunda metade da janela text[start:end]"""
+    low = start + (end - start) // 2
+
+    for separators in _BOUNDARIES:
+        high = end
+        while high > low:
+            cut = _last_boundary(text, separators, low, high)
+            if cut <= low:
+                break
+            inside = _bold_containing(bolds, cut)
+            if inside is None:
+                return cut
+            high = inside  # procura de novo antes do negrito
+
+    # Sem separador: corte seco (antes do negrito, se couber na janela)
+    inside = _bold_containing(bolds, end)
+    return inside if inside is not None and inside > low else end
+
+
+def _split_spans(content: str, max_chars: int) -> List[Tuple[int, int]]:
+    """(início, fim) de cada parte em `content`, sem espaços nas pontas"""
+    spans = []
+    start = 0
+    total = len(content)
+    bolds = _bold_spans(content)
+    while True:
+        while start < total and content[start].isspace():
+            start += 1
+        if start >= total:
+            return spans
+        if total - start <= max_chars:
+            end = total
+        else:
+            end = _find_cut(content, start, start + max_chars, bolds)
+
+        stripped_end = end
+        while content[stripped_end - 1].isspace():
+            stripped_end -= 1
+        spans.append((start, stripped_end))
+        start = end
+
+
+def _limit(max_chars: Optional[int], kind: str) -> int:
+    limit = MESSAGE_LIMITS[kind]
+    return min(max_chars or limit, limit)
+
+
+def split_message(content: str, max_chars: Optional[int] = None, kind: str = "text") -> List[str]:
+    """
+    Divide o texto em partes de no máximo max_chars (limitado ao da Cloud API
+    para o tipo de mensagem). Partes vêm sem espaços nas pontas e nunca vazias.
+    """
+    if not content:
+        return []
+    return [content[start:end] for start, end in _split_spans(content, _limit(max_chars, kind))]
+
+
+def split_interactive_body(content: str, text_chars: Optional[int] = None) -> Tuple[List[str], str]:
+    """
+    Texto de uma mensagem interativa (botões/lista) que pode passar do limite do corpo:
+    retorna (partes de texto enviadas antes, corpo), com o corpo sendo o final do texto.
+    """
+    spans = _split_spans(content or "", MESSAGE_LIMITS["interactive_body"])
+    if not spans:
+        return [], ""
+
+    body_start, body_end = spans[-1]
+    return split_message(content[:body_start], text_chars), content[body_start:body_end]
@@ -0,0 +1,379 @@
+"""
+Backends do sistema de empilhamento de mensagens (debounce)
+
+O webhook empilha as mensagens de cada telefone e, após o tempo de debounce,
+um único processamento consome a pilha inteira. Para funcionar com vários
+workers/réplicas, a pilha fica atrás de uma interface com dois backends:
+
+- memory: fila em memória do processo (padrão, um único worker)
+- database: tabelas compartilhadas no banco (funciona entre workers)
+
+Cada telefone tem um lease de posse: só quem detém o lease processa a pilha
+daquele telefone, e o lease expira sozinho se o worker morrer no meio.
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STACKING_BACKEND = os.getenv("STACKING_BACKEND", "memory").lower()
+STACKING_LEASE_SECONDS = float(os.getenv("STACKING_LEASE_SECONDS", "300"))
+# Janela de mensagens não processadas retomadas no startup
+STACKING_RECOVERY_HOURS = float(os.getenv("STACKING_RECOVERY_HOURS", "6"))
+
+# Folga ao comparar o deadline (relógio do timer vs relógio de parede)
+DEADLINE_TOLERANCE = 0.5
+
+
+@dataclass
+class PendingStack:
+    """Pilha de mensagens reivindicada para processamento"""
+    phone: str
+    messages: List[str]
+    contact_name: Optional[str]
+    conversation_id: Optional[int]
+    last_entry_id: int  # Marcador usado em complete() para remover só o que foi processado
+    message_ids: List[int] = field(default_factory=list)  # Linhas de Message incluídas na pilha
+    first_stacked_at: Optional[float] = None  # Epoch da mensagem mais antiga (espera do debounce)
+
+
+def make_owner_id() -> str:
+    """Identificador único deste worker (usado como dono dos leases)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class StackingBackend(ABC):
+    """Interface base para o armazenamento das pilhas de mensagens"""
+
+    # True quando a pilha é visível para todos os workers
+    shared: bool = False
+
+    @abstractmethod
+    async def push(
+        self,
+        phone: str,
+        text: str,
+        contact_name: Optional[str],
+        conversation_id: Optional[int],
+        debounce: float,
+        message_row_id: Optional[int] = None
+    ) -> int:
+        """
+        Empilha mensagem, reinicia o deadline e retorna o tamanho da pilha.
+        Idempotente por `message_row_id` (a mesma linha de Message não entra duas vezes).
+        """
+        pass
+
+    @abstractmethod
+    async def claim(self, phone: str, owner: str, lease_seconds: float) -> Optional[PendingStack]:
+        """
+        Reivindica a pilha do telefone se o deadline passou e ninguém
+        detém o lease. Retorna None se não há nada para este worker processar.
+        """
+        pass
+
+    @abstractmethod
+    async def complete(self, phone: str, owner: str, stack: PendingStack) -> int:
+        """
+        Remove as mensagens processadas e libera o lease.
+        Retorna quantas mensagens chegaram durante o processamento.
+        """
+        pass
+
+    @abstractmethod
+    async def release(self, phone: str, owner: str) -> None:
+        """Libera o lease sem remover mensagens (falha no processamento)"""
+        pass
+
+    @abstractmethod
+    async def pending_phones(self) -> List[str]:
+        """Telefones com mensagens empilhadas"""
+        pass
+
+
+@dataclass
+class _MemoryStack:
+    entries: List[tuple] = field(default_factory=list)  # (entry_id, text, message_row_id, stacked_at)
+    contact_name: Optional[str] = None
+    conversation_id: Optional[int] = None
+    deadline: float = 0.0
+    owner: Optional[str] = None
+    lease_expires_at: float = 0.0
+
+
+class InMemoryStackingBackend(StackingBackend):
+    """Pilhas em memória do processo (comportamento original, um worker)"""
+
+    shared = False
+
+    def __init__(self):
+        self._stacks: Dict[str, _MemoryStack] = {}
+        self._next_entry_id = 0
+
+    async def push(self, phone, text, contact_name, conversation_id, debounce, message_row_id=None):
+        stack = self._stacks.setdefault(phone, _MemoryStack())
+        already_stacked = message_row_id is not None and any(
+            entry[2] == message_row_id for entry in stack.entries
+        )
+        if not already_stacked:
+            self._next_entry_id += 1
+            stack.entries.append((self._next_entry_id, text, message_row_id, time.time()))
+        stack.contact_name = contact_name
+        stack.conversation_id = conversation_id
+        stack.deadline = time.time() + debounce
+        return len(stack.entries)
+
+    async def claim(self, phone, owner, lease_seconds):
+        stack = self._stacks.get(phone)
+        if stack is None or not stack.entries:
+            return None
+
+        now = time.time()
+        if stack.deadline > now + DEADLINE_TOLERANCE:
+            return None
+        if stack.owner not in (None, owner) and stack.lease_expires_at > now:
+            return None
+
+        stack.owner = owner
+        stack.lease_expires_at = now + lease_seconds
+        return PendingStack(
+            phone=phone,
+            messages=[entry[1] for entry in stack.entries],
+            contact_name=stack.contact_name,
+            conversation_id=stack.conversation_id,
+            last_entry_id=stack.entries[-1][0],
+            message_ids=[entry[2] for entry in stack.entries if entry[2] is not None],
+            first_stacked_at=stack.entries[0][3]
+        )
+
+    async def complete(self, phone, owner, stack):
+        current = self._stacks.get(phone)
+        if current is None:
+            return 0
+
+        current.entries = [e for e in current.entries if e[0] > stack.last_entry_id]
+        if current.owner == owner:
+            current.owner = None
+
+        if not current.entries:
+            del self._stacks[phone]
+            return 0
+        return len(current.entries)
+
+    async def release(self, phone, owner):
+        current = self._stacks.get(phone)
+        if current is not None and current.owner == owner:
+            current.owner = None
+
+    async def pending_phones(self):
+        return [phone for phone, stack in self._stacks.items() if stack.entries]
+
+
+class DatabaseStackingBackend(StackingBackend):
+    """
+    Pilhas compartilhadas no banco (tabelas stacked_messages e stack_leases).
+
+    O lease é adquirido com um UPDATE condicional (compare-and-set), atômico
+    tanto no SQLite quanto no Postgres, então dois workers nunca processam
+    o mesmo telefone ao mesmo tempo.
+    """
+
+    shared = True
+
+    def __init__(self, session_factory=None):
+        if session_factory is None:
+            from database import SessionLocal
+            session_factory = SessionLocal
+        self._session_factory = session_factory
+
+    async def push(self, phone, text, contact_name, conversation_id, debounce, message_row_id=None):
+        return await asyncio.to_thread(
+            self._push, phone, text, contact_name, conversation_id, debounce, message_row_id
+        )
+
+    async def claim(self, phone, owner, lease_seconds):
+        return await asyncio.to_thread(self._claim, phone, owner, lease_seconds)
+
+    async def complete(self, phone, owner, stack):
+        return await asyncio.to_thread(self._complete, phone, owner, stack)
+
+    async def release(self, phone, owner):
+        await asyncio.to_thread(self._release, phone, owner)
+
+    async def pending_phones(self):
+        return await asyncio.to_thread(self._pending_phones)
+
+    def _push(self, phone, text, contact_name, conversation_id, debounce, message_row_id):
+        from sqlalchemy import update, func
+        from sqlalchemy.exc import IntegrityError
+        from models import StackedMessage, StackLease
+
+        now = time.time()
+        db = self._session_factory()
+        try:
+            # Criar a linha de lease na primeira mensagem do telefone
+            if db.get(StackLease, phone) is None:
+                try:
+                    db.add(StackLease(phone=phone, deadline=now + debounce))
+                    db.commit()
+                except IntegrityError:
+                    # Outro worker criou a linha ao mesmo tempo
+                    db.rollback()
+
+            already_stacked = message_row_id is not None and db.query(StackedMessage.id).filter(
+                StackedMessage.message_row_id == message_row_id
+            ).first() is not None
+
+            if not already_stacked:
+                db.add(StackedMessage(
+                    phone=phone,
+                    text=text,
+                    contact_name=contact_name,
+                    conversation_id=conversation_id,
+                    message_row_id=message_row_id,
+                    created_at=now
+                ))
+
+            # Reiniciar deadline
+            db.execute(
+                update(StackLease)
+                .where(StackLease.phone == phone)
+                .values(deadline=now + debounce)
+            )
+            db.commit()
+            return db.query(func.count(StackedMessage.id)).filter(
+                StackedMessage.phone == phone
+            ).scalar()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _claim(self, phone, owner, lease_seconds):
+        from sqlalchemy import update, or_
+        from models import StackedMessage, StackLease
+
+        now = time.time()
+        db = self._session_factory()
+        try:
+            result = db.execute(
+                update(StackLease)
+                .where(
+                    StackLease.phone == phone,
+                    StackLease.deadline <= now + DEADLINE_TOLERANCE,
+                    or_(
+                        StackLease.owner.is_(None),
+                        StackLease.owner == owner,
+                        StackLease.lease_expires_at < now
+                    )
+                )
+                .values(owner=owner, lease_expires_at=now + lease_seconds)
+            )
+            if result.rowcount != 1:
+                db.rollback()
+                return None
+
+            entries = db.query(StackedMessage).filter(
+                StackedMessage.phone == phone
+            ).order_by(StackedMessage.id).all()
+
+            if not entries:
+                db.execute(
+                    update(StackLease)
+                    .where(StackLease.phone == phone, StackLease.owner == owner)
+                    .values(owner=None, lease_expires_at=None)
+                )
+                db.commit()
+                return None
+
+            db.commit()
+            last = entries[-1]
+            return PendingStack(
+                phone=phone,
+                messages=[entry.text for entry in entries],
+                contact_name=last.contact_name,
+                conversation_id=last.conversation_id,
+                last_entry_id=last.id,
+                message_ids=[e.message_row_id for e in entries if e.message_row_id is not None],
+                first_stacked_at=entries[0].created_at
+            )
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _complete(self, phone, owner, stack):
+        from sqlalchemy import update, delete, func
+        from models import StackedMessage, StackLease
+
+        db = self._session_factory()
+        try:
+            db.execute(
+                delete(StackedMessage).where(
+                    StackedMessage.phone == phone,
+                    StackedMessage.id <= stack.last_entry_id
+                )
+            )
+            db.execute(
+                update(StackLease)
+                .where(StackLease.phone == phone, StackLease.owner == owner)
+                .values(owner=None, lease_expires_at=None)
+            )
+            remaining = db.query(func.count(StackedMessage.id)).filter(
+                StackedMessage.phone == phone
+            ).scalar()
+            db.commit()
+            return remaining
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _release(self, phone, owner):
+        from sqlalchemy import update
+        from models import StackLease
+
+        db = self._session_factory()
+        try:
+            db.execute(
+                update(StackLease)
+                .where(StackLease.phone == phone, StackLease.owner == owner)
+                .values(owner=None, lease_expires_at=None)
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _pending_phones(self):
+        from models import StackedMessage
+
+        db = self._session_factory()
+        try:
+            rows = db.query(StackedMessage.phone).distinct().all()
+            return [row[0] for row in rows]
+        finally:
+            db.close()
+
+
+def get_stacking_backend(name: str = None) -> StackingBackend:
+    """Factory para criar o backend de empilhamento configurado"""
+    name = (name or STACKING_BACKEND).lower()
+    if name == "memory":
+        return InMemoryStackingBackend()
+    if name == "database":
+        return DatabaseStackingBackend()
+    raise ValueError(f"STACKING_BACKEND inválido: {name} (use 'memory' ou 'database')")
@@ -0,0 +1,356 @@
+"""
+Métricas do pipeline no formato de texto do Prometheus (GET /metrics)
+
+Sem dependência externa nem coletor: contadores e histogramas ficam em memória
+do processo e são renderizados sob demanda. Os ganchos são baratos o bastante
+para ficar sempre ligados:
+
+- Contador: um dict por combinação de labels e um `+=`
+- Histograma: buckets fixos, `bisect` para achar o bucket, soma e contagem
+- Gauge: callback lido só na hora de renderizar (profundidade de filas etc.)
+
+Cada worker tem suas próprias séries; com vários workers, o Prometheus raspa
+cada um (label de instância) e a soma fica na consulta.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+import threading
+import time
+
+# Buckets em segundos: de consultas ao banco (ms) até execuções longas do agente
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEBOUNCE_BUCKETS = (0.5, 1.0, 2.0, 4.0, 6.0, 8.0, 10.0, 15.0, 20.0, 30.0, 60.0)
+
+GaugeValue = Union[float, Dict[Tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Contador monotônico com labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """Histograma com buckets fixos (em segundos) e labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = _HistogramSeries(len(self.buckets) + 1)
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Mede o bloco com perf_counter (registra mesmo se der erro)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series.count if series else 0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            snapshot = [(labels, list(s.counts), s.sum, s.count) for labels, s in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Gauge lido de um callback na hora de renderizar (sem custo no caminho quente).
+    O callback retorna um número ou {(valores dos labels): número}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Optional[Callable[[], GaugeValue]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        if self.callback is None:
+            return []
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        lines = self.header()
+        for labels, current in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(current)}")
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas renderizadas em /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()) -> Gauge:
+        """Registra (ou substitui) um gauge calculado por callback"""
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Content-Type do formato de texto do Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------------------------------------------------------------------------
+# Métricas do pipeline
+# ---------------------------------------------------------------------------
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Latência das requisições HTTP (inclui o recebimento do webhook)",
+    ("method", "route", "status")
+)
+DEBOUNCE_WAIT_SECONDS = REGISTRY.histogram(
+    "debounce_wait_seconds",
+    "Espera entre a primeira mensagem empilhada e o início do processamento",
+    buckets=DEBOUNCE_BUCKETS
+)
+AGENT_RUN_SECONDS = REGISTRY.histogram(
+    "agent_run_duration_seconds",
+    "Tempo total de uma execução do agente (todos os passos de LLM e ferramentas)"
+)
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    "llm_call_duration_seconds",
+    "Tempo de cada chamada ao LLM (um por passo do agente)",
+    ("model", "outcome")
+)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens",
+    "Tokens do LLM pelo usage_metadata (kind: prompt inclui os em cache, cached, completion)",
+    ("model", "kind")
+)
+TOOL_CALL_SECONDS = REGISTRY.histogram(
+    "tool_call_duration_seconds",
+    "Tempo de execução por ferramenta do agente",
+    ("tool", "outcome")
+)
+GRAPH_API_SECONDS = REGISTRY.histogram(
+    "graph_api_request_duration_seconds",
+    "Latência das requisições à Graph API do Facebook",
+    ("endpoint",)
+)
+GRAPH_API_RESPONSES = REGISTRY.counter(
+    "graph_api_responses",
+    "Respostas da Graph API do Facebook por status HTTP",
+    ("endpoint", "status")
+)
+WHATSAPP_SEND_SECONDS = REGISTRY.histogram(
+    "whatsapp_send_duration_seconds",
+    "Latência de cada tentativa de envio à WhatsApp Cloud API",
+    ("endpoint",)
+)
+WHATSAPP_RESPONSES = REGISTRY.counter(
+    "whatsapp_responses",
+    "Respostas da WhatsApp Cloud API por status HTTP (error = falha de transporte)",
+    ("endpoint", "status")
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_duration_seconds",
+    "Tempo de execução das consultas ao banco",
+    ("operation",)
+)
+
+
+# ---------------------------------------------------------------------------
+# Ganchos
+# ---------------------------------------------------------------------------
+
+_DB_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "BEGIN", "COMMIT"}
+
+
+def _db_operation(statement: str) -> str:
+    head = statement.lstrip()[:7].split(None, 1)
+    operation = head[0].upper() if head else ""
+    return operation if operation in _DB_OPERATIONS else "OTHER"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if starts:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - starts.pop(), _db_operation(statement))
+
+
+def instrument_engine(engine) -> None:
+    """Mede o tempo de cada consulta (engine síncrono ou `async_engine.sync_engine`)"""
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def graph_endpoint(url) -> str:
+    """
+    Nome do endpoint da Graph API sem IDs (mantém poucas séries):
+    /v21.0/act_123/insights -> insights, /v21.0/act_123 -> node
+    """
+    path = urlsplit(str(url)).path.strip("/").split("/")
+    last = path[-1] if len(path) > 1 else ""
+    if not last or last.startswith("act_") or last.isdigit():
+        return "node"
+    return last
+
+
+async def _graph_request_hook(request) -> None:
+    request.extensions["metrics_start"] = time.perf_counter()
+
+
+async def _graph_response_hook(response) -> None:
+    start = response.request.extensions.get("metrics_start")
+    endpoint = graph_endpoint(response.request.url)
+    if start is not None:
+        GRAPH_API_SECONDS.observe(time.perf_counter() - start, endpoint)
+    GRAPH_API_RESPONSES.inc(endpoint, str(response.status_code))
+
+
+# httpx.AsyncClient(event_hooks=GRAPH_EVENT_HOOKS) nas ferramentas da Graph API
+GRAPH_EVENT_HOOKS = {"request": [_graph_request_hook], "response": [_graph_response_hook]}
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mede cada requisição HTTP por rota (o template, ex:
+    /campaigns/{campaign_id}, não o caminho com IDs), método e status
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = ["500"]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status[0]
+            )
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,54 @@
+"""
+Ambiente do Alembic: usa o mesmo engine (e PRAGMAs) do database.py
+"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from database import Base, engine
+import models  # noqa: F401 (registra as tabelas no Base.metadata)
+
+target_metadata = Base.metadata
+
+# Logging do alembic.ini só na linha de comando (no startup o app já tem o seu)
+if context.config.config_file_name and context.config.attributes.get("connection") is None:
+    fileConfig(context.config.config_file_name)
+
+
+def run_migrations_offline():
+    """Gera o SQL sem conectar no banco (alembic upgrade head --sql)"""
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=engine.dialect.name == "sqlite"
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = context.config.attributes.get("connection")
+    if connection is not None:
+        # Chamado por database.run_migrations() com uma conexão já aberta
+        _run(connection)
+        return
+
+    with engine.connect() as connection:
+        _run(connection)
+
+
+def _run(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        render_as_batch=connection.dialect.name == "sqlite"
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
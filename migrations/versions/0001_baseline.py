@@ -0,0 +1,22 @@
+"""Baseline: schema criado pelo init_db (Base.metadata.create_all)
+
+Bancos criados antes do Alembic já têm estas tabelas; a revisão só marca
+o ponto de partida para as migrações seguintes.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2025-12-10
+"""
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
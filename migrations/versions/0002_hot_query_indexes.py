@@ -0,0 +1,44 @@
+"""Índices compostos para as consultas quentes de conversa
+
+- Últimas mensagens da conversa: conversation_id + created_at
+- Última resposta do bot por conversa: conversation_id + direction + created_at
+- Histórico de mensagens recebidas do contato (debounce adaptativo): contact_id + direction + created_at
+- Conversa ativa do contato: contact_id + status
+
+Idempotente: bancos criados do zero já recebem os índices pelo create_all.
+
+Revision ID: 0002_hot_query_indexes
+Revises: 0001_baseline
+Create Date: 2025-12-10
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_hot_query_indexes"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_messages_conversation_created", "messages", ["conversation_id", "created_at"]),
+    ("ix_messages_conversation_direction_created", "messages", ["conversation_id", "direction", "created_at"]),
+    ("ix_messages_contact_direction_created", "messages", ["contact_id", "direction", "created_at"]),
+    ("ix_conversations_contact_status", "conversations", ["contact_id", "status"]),
+]
+
+
+def _existing_indexes(table):
+    inspector = sa.inspect(op.get_bind())
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        if name not in _existing_indexes(table):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        if name in _existing_indexes(table):
+            op.drop_index(name, table_name=table)
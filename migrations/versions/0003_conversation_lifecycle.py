@@ -0,0 +1,48 @@
+"""Ciclo de vida das conversas: last_message_at preenchido e indexado
+
+- Índice status + last_message_at (busca de conversas ativas ociosas)
+- Preenche last_message_at das conversas antigas com a data da última
+  mensagem (antes só era atualizado por onupdate, ou seja, quase nunca)
+
+Idempotente: o índice só é criado se não existir e o preenchimento só
+toca conversas com last_message_at nulo.
+
+Revision ID: 0003_conversation_lifecycle
+Revises: 0002_hot_query_indexes
+Create Date: 2025-12-12
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_conversation_lifecycle"
+down_revision = "0002_hot_query_indexes"
+branch_labels = None
+depends_on = None
+
+INDEX = "ix_conversations_status_last_message"
+
+
+def _existing_indexes(table):
+    inspector = sa.inspect(op.get_bind())
+    return {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade():
+    if INDEX not in _existing_indexes("conversations"):
+        op.create_index(INDEX, "conversations", ["status", "last_message_at"])
+
+    op.execute(
+        """
+        UPDATE conversations
+        SET last_message_at = COALESCE(
+            (SELECT MAX(messages.created_at) FROM messages WHERE messages.conversation_id = conversations.id),
+            started_at
+        )
+        WHERE last_message_at IS NULL
+        """
+    )
+
+
+def downgrade():
+    if INDEX in _existing_indexes("conversations"):
+        op.drop_index(INDEX, table_name="conversations")
@@ -0,0 +1,54 @@
+"""Consumo de tokens do LLM agregado por dia/contato/caminho de ferramentas
+
+Tabela token_usage_daily (rollup gravado pelo token_usage.TokenUsageRecorder),
+lida por GET /metrics/cost e pelo calculate_token_cost.py.
+
+Idempotente: a tabela só é criada se não existir (bancos novos já a recebem
+do create_all).
+
+Revision ID: 0004_token_usage_daily
+Revises: 0003_conversation_lifecycle
+Create Date: 2025-12-15
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_token_usage_daily"
+down_revision = "0003_conversation_lifecycle"
+branch_labels = None
+depends_on = None
+
+TABLE = "token_usage_daily"
+
+
+def _has_table(table):
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if _has_table(TABLE):
+        return
+
+    op.create_table(
+        TABLE,
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("day", sa.String(10), nullable=False),
+        sa.Column("contact_id", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("tool_path", sa.String(255), nullable=False),
+        sa.Column("model", sa.String(50), nullable=False),
+        sa.Column("runs", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("llm_calls", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("prompt_tokens", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cached_tokens", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("completion_tokens", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("cost_usd", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint("day", "contact_id", "tool_path", "model", name="uq_token_usage_daily_key"),
+    )
+    op.create_index("ix_token_usage_daily_id", TABLE, ["id"])
+    op.create_index("ix_token_usage_daily_day", TABLE, ["day"])
+
+
+def downgrade():
+    if _has_table(TABLE):
+        op.drop_table(TABLE)
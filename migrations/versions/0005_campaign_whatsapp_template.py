@@ -0,0 +1,38 @@
+"""Template aprovado do WhatsApp nas campanhas
+
+Coluna campaigns.whatsapp_template ({name, language, components}): a Cloud
+API só aceita template fora da janela de 24h, então campanhas enviadas por
+ela usam o template no lugar do message_template em texto livre.
+
+Idempotente: a coluna só é criada se não existir (bancos novos já a recebem
+do create_all).
+
+Revision ID: 0005_campaign_whatsapp_template
+Revises: 0004_token_usage_daily
+Create Date: 2025-12-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_campaign_whatsapp_template"
+down_revision = "0004_token_usage_daily"
+branch_labels = None
+depends_on = None
+
+TABLE = "campaigns"
+COLUMN = "whatsapp_template"
+
+
+def _has_column(table, column):
+    return column in {c["name"] for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    if not _has_column(TABLE, COLUMN):
+        op.add_column(TABLE, sa.Column(COLUMN, sa.JSON(), nullable=True))
+
+
+def downgrade():
+    if _has_column(TABLE, COLUMN):
+        with op.batch_alter_table(TABLE) as batch:
+            batch.drop_column(COLUMN)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey, Float, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -8,6 +8,12 @@ class Message(Base):
     Modelo para armazenar mensagens recebidas e enviadas
     """
     __tablename__ = "messages"
+    __table_args__ = (
+        # Últimas mensagens da conversa / última resposta do bot (migração 0002)
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+        Index("ix_messages_conversation_direction_created", "conversation_id", "direction", "created_at"),
+        Index("ix_messages_contact_direction_created", "contact_id", "direction", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     instance = Column(String(100))
@@ -36,6 +42,12 @@ class Conversation(Base):
     Modelo para agrupar mensagens em conversações
     """
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Conversa ativa do contato (migração 0002)
+        Index("ix_conversations_contact_status", "contact_id", "status"),
+        # Conversas ativas ociosas (ciclo de vida, migração 0003)
+        Index("ix_conversations_status_last_message", "status", "last_message_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     contact_id = Column(Integer, ForeignKey('contacts.id'), nullable=False)
@@ -43,7 +55,7 @@ class Conversation(Base):
     
     status = Column(String(50), default="active")  # active, closed, archived
     started_at = Column(DateTime(timezone=True), server_default=func.now())
-    last_message_at = Column(DateTime(timezone=True), onupdate=func.now())
+    last_message_at = Column(DateTime(timezone=True), default=func.now())  # atualizado por touch_conversation
     closed_at = Column(DateTime(timezone=True), nullable=True)
     
     # Metadados da conversa
@@ -65,11 +77,28 @@ class Campaign(Base):
     status = Column(String(50), default="draft")  # draft, active, paused, completed
     target_audience = Column(JSON)
     message_template = Column(Text)
+    whatsapp_template = Column(JSON, nullable=True)  # template aprovado: {name, language, components}
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     started_at = Column(DateTime(timezone=True), nullable=True)
     completed_at = Column(DateTime(timezone=True), nullable=True)
 
+class CampaignDelivery(Base):
+    """
+    Envio de uma campanha para um contato (checkpoint do motor de campanhas)
+    """
+    __tablename__ = "campaign_deliveries"
+    __table_args__ = (UniqueConstraint("campaign_id", "contact_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    campaign_id = Column(Integer, ForeignKey('campaigns.id'), index=True, nullable=False)
+    contact_id = Column(Integer, ForeignKey('contacts.id'), nullable=False)
+    phone = Column(String(50), nullable=False)
+    status = Column(String(50), default="pending", index=True)  # pending, sent, failed, unknown
+    message_id = Column(String(255), index=True, nullable=True)  # wamid
+    error_message = Column(Text, nullable=True)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
 class Contact(Base):
     """
     Modelo para contatos
@@ -104,3 +133,51 @@ class AgentLog(Base):
     error_message = Column(Text, nullable=True)
     execution_time = Column(Integer, nullable=True)  # em milissegundos
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class StackedMessage(Base):
+    """
+    Mensagem empilhada aguardando o debounce (backend 'database' do empilhamento)
+    """
+    __tablename__ = "stacked_messages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    phone = Column(String(100), index=True, nullable=False)
+    text = Column(Text)
+    contact_name = Column(String(200))
+    conversation_id = Column(Integer, nullable=True)
+    message_row_id = Column(Integer, unique=True, nullable=True)  # messages.id da mensagem original
+    created_at = Column(Float)  # epoch em segundos
+
+class StackLease(Base):
+    """
+    Deadline do debounce e lease de posse por telefone
+    """
+    __tablename__ = "stack_leases"
+
+    phone = Column(String(100), primary_key=True)
+    deadline = Column(Float, nullable=False)  # epoch em que a pilha pode ser processada
+    owner = Column(String(100), nullable=True)  # worker que está processando
+    lease_expires_at = Column(Float, nullable=True)
+
+class TokenUsageDaily(Base):
+    """
+    Consumo de tokens do LLM agregado por dia, contato, caminho de ferramentas e modelo
+    (alimentado pelo token_usage.TokenUsageRecorder; uma linha por combinação)
+    """
+    __tablename__ = "token_usage_daily"
+    __table_args__ = (
+        UniqueConstraint("day", "contact_id", "tool_path", "model", name="uq_token_usage_daily_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(String(10), nullable=False, index=True)  # YYYY-MM-DD (UTC)
+    contact_id = Column(Integer, nullable=False, default=0)  # 0 = contato desconhecido
+    tool_path = Column(String(255), nullable=False)  # ferramentas na ordem de uso, ex: a>b ("none" = sem ferramentas)
+    model = Column(String(50), nullable=False)
+    runs = Column(Integer, nullable=False, default=0)  # execuções do agente
+    llm_calls = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)  # inclui os tokens em cache
+    cached_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cost_usd = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
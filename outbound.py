@@ -0,0 +1,237 @@
+"""
+Fila de envio de mensagens (outbound)
+
+O agente entrega a resposta inteira (todas as partes) e fica livre na hora.
+O dispatcher cuida do envio:
+
+- Ordem por destinatário: uma única task de envio por telefone
+- Intervalo entre partes da mesma resposta (parecer natural) sem ocupar o agente
+- Limite global de mensagens/segundo (tier de throughput do número business)
+- Fallback para texto quando lista/botões falham
+"""
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from structured_logging import get_logger
+from tracing import tracer
+
+load_dotenv()
+
+logger = get_logger("outbound")
+
+# Throughput padrão da Cloud API por número business (mensagens/segundo)
+WHATSAPP_MESSAGES_PER_SECOND = float(os.getenv("WHATSAPP_MESSAGES_PER_SECOND", "80"))
+PART_DELAY_SECONDS = 1.5  # intervalo entre partes da mesma resposta
+
+
+@dataclass
+class OutboundPart:
+    """Uma mensagem a ser enviada"""
+    kind: str  # text, list, buttons
+    text: str  # texto enviado (ou corpo do interativo) e salvo no banco
+    payload: Optional[Dict[str, Any]] = None  # list_data ou buttons_data
+    fallback: List["OutboundPart"] = field(default_factory=list)  # enviado se o interativo falhar
+
+
+@dataclass
+class OutboundReply:
+    """Resposta completa para um destinatário"""
+    phone: str
+    conversation_id: Optional[int]
+    parts: List[OutboundPart]
+    message_ids: List[int] = field(default_factory=list)  # mensagens recebidas respondidas por esta resposta
+    enqueued_at: float = field(default_factory=time.monotonic)
+    trace: Optional[Any] = None  # tracing.Trace do turno (spans de envio entram nele)
+
+
+def provider_message_id(result: Dict[str, Any]) -> Optional[str]:
+    """Extrai o wamid da resposta de envio do adapter"""
+    body = result.get("data") or result.get("response") or {}
+    messages = body.get("messages") if isinstance(body, dict) else None
+    if messages:
+        return messages[0].get("id")
+    return None
+
+
+@dataclass
+class SentPart:
+    """Resultado do envio de uma parte"""
+    part: OutboundPart
+    result: Dict[str, Any]
+
+    @property
+    def ok(self) -> bool:
+        return self.result.get("status") == "success"
+
+    @property
+    def unknown(self) -> bool:
+        """Erro depois de a requisição sair: a Meta pode ter entregue (não reenviar)"""
+        return self.result.get("status") == "unknown"
+
+    @property
+    def provider_message_id(self) -> Optional[str]:
+        """wamid retornado pela Cloud API (usado para casar os status de entrega)"""
+        return provider_message_id(self.result)
+
+    @property
+    def error(self) -> Optional[str]:
+        if self.ok:
+            return None
+        return str(self.result.get("error", "Unknown error"))
+
+
+class RateLimiter:
+    """Token bucket global (mensagens por segundo)"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class OutboundDispatcher:
+    """Envia respostas por telefone, em ordem, respeitando o limite global"""
+
+    def __init__(
+        self,
+        adapter,
+        persist: Callable[[OutboundReply, List[SentPart]], Awaitable[None]],
+        rate: float = WHATSAPP_MESSAGES_PER_SECOND,
+        part_delay: float = PART_DELAY_SECONDS
+    ):
+        self.adapter = adapter
+        self.persist = persist
+        self.limiter = RateLimiter(rate)
+        self.part_delay = part_delay
+        self._queues: Dict[str, Deque[OutboundReply]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._pending_parts = 0
+        self._sent = 0
+        self._failed = 0
+        self._unknown = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+
+    def enqueue(self, reply: OutboundReply) -> None:
+        """Enfileira a resposta e retorna imediatamente"""
+        if not reply.parts:
+            return
+
+        self._queues.setdefault(reply.phone, deque()).append(reply)
+        self._pending_parts += len(reply.parts)
+
+        task = self._tasks.get(reply.phone)
+        if task is None or task.done():
+            self._tasks[reply.phone] = asyncio.create_task(self._drain(reply.phone))
+
+    async def _drain(self, phone: str) -> None:
+        queue = self._queues[phone]
+        try:
+            while queue:
+                reply = queue.popleft()
+                with tracer.activate(reply.trace), tracer.span("reply_send", parts=len(reply.parts)):
+                    sent = []
+                    for i, part in enumerate(reply.parts):
+                        if i == 0:
+                            self._record_lag(time.monotonic() - reply.enqueued_at)
+                        sent.extend(await self._send(phone, part))
+                        self._pending_parts -= 1
+
+                        # Intervalo entre partes da mesma resposta
+                        if i < len(reply.parts) - 1:
+                            await asyncio.sleep(self.part_delay)
+
+                    try:
+                        await self.persist(reply, sent)
+                    except Exception as e:
+                        logger.error("persist_failed", "❌ Erro ao salvar mensagens enviadas para %s: %s", phone, e, phone=phone)
+        finally:
+            if not queue:
+                self._queues.pop(phone, None)
+            self._tasks.pop(phone, None)
+
+    async def _send(self, phone: str, part: OutboundPart) -> List[SentPart]:
+        await self.limiter.acquire()
+        try:
+            if part.kind == "list":
+                result = await self.adapter.send_list(phone, part.payload)
+            elif part.kind == "buttons":
+                result = await self.adapter.send_buttons(phone, part.text, part.payload)
+            else:
+                result = await self.adapter.send_message(phone, part.text)
+        except Exception as e:
+            result = {"status": "error", "error": str(e)}
+
+        if result.get("status") == "success":
+            self._sent += 1
+            return [SentPart(part, result)]
+
+        if result.get("status") == "unknown":
+            # Sem fallback: a parte pode ter chegado e o texto viria duplicado
+            self._unknown += 1
+            logger.warning(
+                "send_unknown", "⚠️ Envio de %s para %s sem confirmação: %s", part.kind, phone, result.get("error"),
+                phone=phone, kind=part.kind
+            )
+            return [SentPart(part, result)]
+
+        self._failed += 1
+        logger.warning(
+            "send_failed", "⚠️ Erro ao enviar %s para %s: %s", part.kind, phone, result.get("error", "Unknown error"),
+            phone=phone, kind=part.kind
+        )
+
+        if part.fallback:
+            logger.info("send_fallback", "↩️ Enviando %s como texto", part.kind, phone=phone)
+            sent = []
+            for i, fallback_part in enumerate(part.fallback):
+                sent.extend(await self._send(phone, fallback_part))
+                if i < len(part.fallback) - 1:
+                    await asyncio.sleep(self.part_delay)
+            return sent
+
+        return [SentPart(part, result)]
+
+    def _record_lag(self, lag: float) -> None:
+        self._last_lag = lag
+        self._max_lag = max(self._max_lag, lag)
+
+    async def drain(self, timeout: float = 10.0) -> None:
+        """Aguarda o envio do que está na fila (usado no shutdown)"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas: profundidade da fila e atraso de envio"""
+        return {
+            "queue_depth": self._pending_parts,
+            "recipients_pending": len(self._queues),
+            "sent_total": self._sent,
+            "failed_total": self._failed,
+            "unknown_total": self._unknown,
+            "rate_limit_per_second": self.limiter.rate,
+            "last_send_lag_ms": round(self._last_lag * 1000, 1),
+            "max_send_lag_ms": round(self._max_lag * 1000, 1),
+        }
@@ -0,0 +1,446 @@
+"""
+Retenção e arquivamento de dados antigos
+
+`messages.raw_data` guardava o payload completo de todo webhook para sempre e
+as tabelas cresciam sem limite. Este job roda em background, com políticas
+por tabela/coluna:
+
+- clear_column: apaga (NULL) uma coluna depois de N dias (ex: messages.raw_data)
+- archive_conversations: conversas encerradas há mais de N dias vão, com suas
+  mensagens e logs, para arquivos JSONL comprimidos com zstd e saem do banco
+- archive: linhas de uma tabela com mais de N dias vão para JSONL + zstd e
+  saem do banco (ex: agent_logs)
+
+Depois das políticas, no SQLite, roda `PRAGMA incremental_vacuum` em passos
+pequenos para devolver as páginas livres ao disco.
+
+Para não segurar o lock de escrita do SQLite por muito tempo, cada lote é uma
+transação curta (RETENTION_BATCH_SIZE linhas), com pausa entre lotes, e o job
+só roda dentro da janela RETENTION_WINDOW (fora do horário comercial). Se a
+janela termina no meio, o job para e continua na próxima.
+
+Execução manual (ignora a janela):
+
+    python retention.py            # aplica as políticas agora
+    python retention.py --vacuum   # VACUUM completo (habilita o incremental em bancos antigos)
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import time
+
+import zstandard
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, null, select, update
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("retention")
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+RETENTION_WINDOW = os.getenv("RETENTION_WINDOW", "01:00-06:00")  # horário local; vazio = qualquer hora
+RETENTION_RAW_DATA_DAYS = int(os.getenv("RETENTION_RAW_DATA_DAYS", "30"))  # 0 desliga
+RETENTION_ARCHIVE_DAYS = int(os.getenv("RETENTION_ARCHIVE_DAYS", "180"))
+RETENTION_AGENT_LOG_DAYS = int(os.getenv("RETENTION_AGENT_LOG_DAYS", "90"))
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "./archive")
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE_MS = int(os.getenv("RETENTION_BATCH_PAUSE_MS", "200"))
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "2000"))  # páginas por passo
+RETENTION_CHECK_SECONDS = 300  # de quanto em quanto tempo verifica a janela
+CONVERSATIONS_PER_ARCHIVE_BATCH = 50  # conversas por arquivo/transação
+ZSTD_LEVEL = 10
+
+ARCHIVED_STATUSES = ("closed", "archived")
+
+
+@dataclass
+class RetentionPolicy:
+    """Política de retenção de uma tabela (e coluna, no caso de clear_column)"""
+    table: str
+    action: str  # clear_column, archive, archive_conversations
+    days: int
+    column: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.table}.{self.column}" if self.column else self.table
+
+
+def default_policies() -> List[RetentionPolicy]:
+    """Políticas configuradas pelo .env (dias = 0 desliga a política)"""
+    policies = [
+        RetentionPolicy("messages", "clear_column", RETENTION_RAW_DATA_DAYS, column="raw_data"),
+        RetentionPolicy("conversations", "archive_conversations", RETENTION_ARCHIVE_DAYS),
+        RetentionPolicy("agent_logs", "archive", RETENTION_AGENT_LOG_DAYS),
+    ]
+    return [policy for policy in policies if policy.days > 0]
+
+
+def parse_window(window: str) -> Optional[Tuple[dt_time, dt_time]]:
+    """'01:00-06:00' -> (01:00, 06:00); vazio -> None (sem restrição)"""
+    if not window or not window.strip():
+        return None
+    start, end = (dt_time.fromisoformat(part.strip()) for part in window.split("-", 1))
+    return start, end
+
+
+def in_window(window: Optional[Tuple[dt_time, dt_time]], now: Optional[datetime] = None) -> bool:
+    """True se `now` (horário local) está na janela; aceita janelas que viram a meia-noite"""
+    if window is None:
+        return True
+    current = (now or datetime.now()).time()
+    start, end = window
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def write_archive(path: str, records: List[Dict[str, Any]]) -> int:
+    """
+    Grava os registros como JSONL comprimido com zstd (arquivo temporário +
+    rename, então um arquivo final nunca fica pela metade). Retorna os bytes gravados.
+    Leitura: `zstd -dc arquivo.jsonl.zst` ou zstandard.ZstdDecompressor().stream_reader.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    with open(tmp_path, "wb") as fh:
+        with compressor.stream_writer(fh, closefd=False) as writer:
+            for record in records:
+                line = json.dumps(record, default=_json_default, ensure_ascii=False) + "\n"
+                writer.write(line.encode("utf-8"))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+class RetentionManager:
+    """Aplica as políticas de retenção em background, em lotes curtos"""
+
+    def __init__(
+        self,
+        session_factory=None,
+        policies: Optional[List[RetentionPolicy]] = None,
+        archive_dir: str = RETENTION_ARCHIVE_DIR,
+        window: str = RETENTION_WINDOW,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        pause_ms: int = RETENTION_BATCH_PAUSE_MS,
+        vacuum_pages: int = RETENTION_VACUUM_PAGES,
+        enabled: bool = RETENTION_ENABLED,
+        engine=None
+    ):
+        if session_factory is None:
+            from database import SessionLocal
+            session_factory = SessionLocal
+        if engine is None:
+            from database import engine
+        self._session_factory = session_factory
+        self._engine = engine  # usado pelo vacuum incremental
+        self.policies = default_policies() if policies is None else policies
+        self.archive_dir = archive_dir
+        self.window = parse_window(window)
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000
+        self.vacuum_pages = vacuum_pages
+        self.enabled = enabled
+        self._task: Optional[asyncio.Task] = None
+        self._completed_on: Optional[date] = None
+        self._running = False
+        self._last_run: Dict[str, Any] = {}
+        self._totals: Dict[str, int] = {}
+
+    # ---- controle ----
+
+    def start(self) -> None:
+        """Inicia o job no event loop atual"""
+        if self.enabled and self.policies and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self) -> None:
+        """Uma execução completa por dia, dentro da janela"""
+        while True:
+            if in_window(self.window) and self._completed_on != date.today():
+                try:
+                    if await self.run_once():
+                        self._completed_on = date.today()
+                except Exception as e:
+                    logger.exception("retention_failed", "❌ Erro na retenção de dados: %s", e)
+            await asyncio.sleep(RETENTION_CHECK_SECONDS)
+
+    async def run_once(self, respect_window: bool = True) -> bool:
+        """
+        Aplica todas as políticas e o vacuum incremental.
+        Retorna False se parou antes do fim (janela terminou).
+        """
+        self._running = True
+        started = time.perf_counter()
+        summary: Dict[str, Any] = {"started_at": datetime.now().isoformat(timespec="seconds"), "policies": {}}
+        finished = True
+        try:
+            for policy in self.policies:
+                affected, complete = await self._apply(policy, respect_window)
+                summary["policies"][policy.name] = affected
+                self._totals[policy.name] = self._totals.get(policy.name, 0) + affected
+                if affected:
+                    logger.info(
+                        "retention_applied", "🧹 Retenção %s (%s, %d dias): %d linha(s)",
+                        policy.name, policy.action, policy.days, affected
+                    )
+                if not complete:
+                    finished = False
+                    break
+
+            if finished:
+                freed, finished = await self._incremental_vacuum(respect_window)
+                summary["vacuum_pages_freed"] = freed
+        finally:
+            self._running = False
+            summary["complete"] = finished
+            summary["duration_seconds"] = round(time.perf_counter() - started, 1)
+            self._last_run = summary
+        return finished
+
+    def _should_continue(self, respect_window: bool) -> bool:
+        return not respect_window or in_window(self.window)
+
+    async def _apply(self, policy: RetentionPolicy, respect_window: bool) -> Tuple[int, bool]:
+        """Roda a política em lotes; cada lote é uma transação curta em thread"""
+        step = {
+            "clear_column": self._clear_column_batch,
+            "archive": self._archive_batch,
+            "archive_conversations": self._archive_conversations_batch,
+        }[policy.action]
+        cutoff = datetime.utcnow() - timedelta(days=policy.days)
+
+        total = 0
+        after_id = 0
+        while True:
+            if not self._should_continue(respect_window):
+                return total, False
+            affected, after_id = await asyncio.to_thread(step, policy, cutoff, after_id)
+            if after_id is None:
+                return total + affected, True
+            total += affected
+            await asyncio.sleep(self.pause)
+
+    # ---- lotes (rodam em thread, sessão síncrona) ----
+
+    def _table(self, name: str):
+        import models  # noqa: F401 (registra as tabelas no Base.metadata)
+        from database import Base
+        return Base.metadata.tables[name]
+
+    def _clear_column_batch(self, policy: RetentionPolicy, cutoff: datetime, after_id: int):
+        """Zera a coluna de um lote de linhas antigas (paginado por id)"""
+        table = self._table(policy.table)
+        column = table.c[policy.column]
+
+        db = self._session_factory()
+        try:
+            ids = db.execute(
+                select(table.c.id)
+                .where(table.c.id > after_id, table.c.created_at < cutoff, column.isnot(None))
+                .order_by(table.c.id)
+                .limit(self.batch_size)
+            ).scalars().all()
+            if not ids:
+                return 0, None
+
+            # null(): em colunas JSON, None viraria o texto 'null' em vez de NULL
+            db.execute(update(table).where(table.c.id.in_(ids)).values({policy.column: null()}))
+            db.commit()
+            return len(ids), ids[-1]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _archive_batch(self, policy: RetentionPolicy, cutoff: datetime, after_id: int):
+        """Arquiva e apaga um lote de linhas antigas da tabela"""
+        table = self._table(policy.table)
+
+        db = self._session_factory()
+        try:
+            rows = db.execute(
+                select(table)
+                .where(table.c.id > after_id, table.c.created_at < cutoff)
+                .order_by(table.c.id)
+                .limit(self.batch_size)
+            ).mappings().all()
+            if not rows:
+                return 0, None
+
+            ids = [row["id"] for row in rows]
+            self._write(policy.table, ids, [dict(row) for row in rows])
+            db.execute(delete(table).where(table.c.id.in_(ids)))
+            db.commit()
+            return len(ids), ids[-1]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _archive_conversations_batch(self, policy: RetentionPolicy, cutoff: datetime, after_id: int):
+        """
+        Arquiva conversas encerradas antes do corte (uma linha JSON por conversa,
+        com mensagens e logs) e apaga conversa, mensagens e logs do banco
+        """
+        conversations = self._table("conversations")
+        messages = self._table("messages")
+        agent_logs = self._table("agent_logs")
+
+        ended_at = func.coalesce(conversations.c.closed_at, conversations.c.last_message_at, conversations.c.started_at)
+
+        db = self._session_factory()
+        try:
+            rows = db.execute(
+                select(conversations)
+                .where(
+                    conversations.c.id > after_id,
+                    conversations.c.status.in_(ARCHIVED_STATUSES),
+                    ended_at < cutoff
+                )
+                .order_by(conversations.c.id)
+                .limit(CONVERSATIONS_PER_ARCHIVE_BATCH)
+            ).mappings().all()
+            if not rows:
+                return 0, None
+
+            ids = [row["id"] for row in rows]
+            records = {row["id"]: {**dict(row), "messages": [], "agent_logs": []} for row in rows}
+            for message in db.execute(
+                select(messages).where(messages.c.conversation_id.in_(ids)).order_by(messages.c.id)
+            ).mappings():
+                records[message["conversation_id"]]["messages"].append(dict(message))
+            for log in db.execute(
+                select(agent_logs).where(agent_logs.c.conversation_id.in_(ids)).order_by(agent_logs.c.id)
+            ).mappings():
+                records[log["conversation_id"]]["agent_logs"].append(dict(log))
+
+            self._write("conversations", ids, list(records.values()))
+
+            db.execute(delete(agent_logs).where(agent_logs.c.conversation_id.in_(ids)))
+            db.execute(delete(messages).where(messages.c.conversation_id.in_(ids)))
+            db.execute(delete(conversations).where(conversations.c.id.in_(ids)))
+            db.commit()
+            return len(ids), ids[-1]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write(self, prefix: str, ids: List[int], records: List[Dict[str, Any]]) -> None:
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(self.archive_dir, prefix, f"{prefix}-{stamp}-{ids[0]}-{ids[-1]}.jsonl.zst")
+        write_archive(path, records)
+
+    # ---- vacuum ----
+
+    async def _incremental_vacuum(self, respect_window: bool) -> Tuple[int, bool]:
+        """Libera as páginas livres do SQLite em passos pequenos (no-op em outros bancos)"""
+        if self._engine.dialect.name != "sqlite":
+            return 0, True  # Postgres: autovacuum
+
+        def pragma(sql: str):
+            with self._engine.connect() as connection:
+                return connection.exec_driver_sql(sql).scalar()
+
+        if await asyncio.to_thread(pragma, "PRAGMA auto_vacuum") != 2:
+            logger.warning(
+                "vacuum_disabled", "⚠️ SQLite sem auto_vacuum=INCREMENTAL: rode 'python retention.py --vacuum' uma vez para habilitar"
+            )
+            return 0, True
+
+        freed = 0
+        while True:
+            free_pages = await asyncio.to_thread(pragma, "PRAGMA freelist_count")
+            if not free_pages:
+                return freed, True
+            if not self._should_continue(respect_window):
+                return freed, False
+            step = min(free_pages, self.vacuum_pages)
+            await asyncio.to_thread(self._vacuum_step, step)
+            freed += step
+            await asyncio.sleep(self.pause)
+
+    def _vacuum_step(self, pages: int) -> None:
+        raw = self._engine.raw_connection()
+        try:
+            # executescript roda o pragma até o fim (execute libera só uma página por chamada)
+            raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        finally:
+            raw.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "window": RETENTION_WINDOW or None,
+            "in_window": in_window(self.window),
+            "running": self._running,
+            "policies": [
+                {"name": policy.name, "action": policy.action, "days": policy.days}
+                for policy in self.policies
+            ],
+            "completed_on": self._completed_on.isoformat() if self._completed_on else None,
+            "last_run": self._last_run,
+            "totals": self._totals,
+        }
+
+
+def full_vacuum() -> None:
+    """
+    VACUUM completo com auto_vacuum=INCREMENTAL (uma vez, em janela de manutenção).
+    Necessário em bancos criados antes do vacuum incremental; bloqueia o banco enquanto roda.
+    """
+    from database import IS_SQLITE, engine
+
+    if not IS_SQLITE:
+        print("ℹ️ VACUUM completo só se aplica ao SQLite")
+        return
+
+    raw = engine.raw_connection()
+    try:
+        raw.driver_connection.isolation_level = None  # VACUUM não roda dentro de transação
+        cursor = raw.cursor()
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("VACUUM")
+        print(f"✅ VACUUM concluído (auto_vacuum={cursor.execute('PRAGMA auto_vacuum').fetchone()[0]})")
+    finally:
+        raw.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import init_db
+
+    init_db()
+    if "--vacuum" in sys.argv:
+        full_vacuum()
+    else:
+        manager = RetentionManager(enabled=True)
+        asyncio.run(manager.run_once(respect_window=False))
+        print(json.dumps(manager.stats()["last_run"], ensure_ascii=False, indent=2))
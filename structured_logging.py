@@ -0,0 +1,225 @@
+"""
+Logging estruturado com níveis, amostragem e gravação fora do caminho da requisição
+
+Substitui os `print` do caminho quente (webhook, agente, envio, ferramentas),
+que escreviam payloads inteiros no stdout a cada requisição:
+
+- Níveis via LOG_LEVEL (padrão INFO); payloads completos só em DEBUG
+- Formatação preguiçosa: argumentos no estilo `%s` só viram texto se o nível
+  estiver habilitado, e a formatação roda na thread do listener, não no event loop
+- Handler com fila (QueueHandler -> QueueListener): quem loga só enfileira;
+  fila cheia descarta o registro (contado em stats) em vez de bloquear
+- Amostragem por evento para os de alto volume (LOG_SAMPLE_RATES), nunca para
+  WARNING/ERROR
+- LOG_FORMAT=json para uma linha JSON por evento; `text` (padrão) para leitura humana
+
+Uso:
+    logger = get_logger(__name__)
+    logger.info("webhook_received", "📱 Mensagem de %s", phone, phone=phone)
+    logger.debug("webhook_payload", "Payload: %s", data)
+"""
+from typing import Any, Dict, Optional
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Ex: "webhook_received=0.1,llm_response=0.25" (fração dos eventos mantida)
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# Bibliotecas que logam cada requisição em INFO (ficam em WARNING, salvo LOG_LEVEL=DEBUG)
+NOISY_LOGGERS = ("httpx", "httpcore", "openai", "sqlalchemy.engine")
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """'evento=0.1,outro=0.5' -> {'evento': 0.1, 'outro': 0.5}"""
+    rates = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        event, rate = item.split("=", 1)
+        try:
+            rates[event.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+class Sampler:
+    """Decide quais eventos de alto volume são mantidos (fração por evento)"""
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        self.rates = rates or {}
+        self.skipped: Dict[str, int] = {}
+
+    def keep(self, event: str) -> bool:
+        rate = self.rates.get(event)
+        if rate is None or rate >= 1.0 or random.random() < rate:
+            return True
+        self.skipped[event] = self.skipped.get(event, 0) + 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro: ts, level, logger, event, msg e os campos extras"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Linha legível: horário, nível, mensagem e `chave=valor` dos campos"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            extras = " ".join(f"{key}={value}" for key, value in fields.items())
+            first, newline, rest = line.partition("\n")
+            line = f"{first} [{extras}]{newline}{rest}"
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Só enfileira o registro: a mensagem é formatada no listener (os argumentos
+    não devem ser alterados depois da chamada) e fila cheia descarta sem bloquear.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class EventLogger:
+    """
+    Logger com nome de evento e campos estruturados. O nível é checado antes de
+    qualquer trabalho; eventos com taxa em LOG_SAMPLE_RATES são amostrados.
+    """
+
+    __slots__ = ("_logger",)
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def is_enabled(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, event: str, message: str, args: tuple, fields: Dict[str, Any], exc_info=None):
+        if not self._logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING and not _sampler.keep(event):
+            return
+        self._logger.log(
+            level, message, *args,
+            exc_info=exc_info,
+            extra={"event": event, "fields": fields},
+            stacklevel=3
+        )
+
+    def debug(self, event: str, message: str, *args: Any, **fields: Any) -> None:
+        self._log(logging.DEBUG, event, message, args, fields)
+
+    def info(self, event: str, message: str, *args: Any, **fields: Any) -> None:
+        self._log(logging.INFO, event, message, args, fields)
+
+    def warning(self, event: str, message: str, *args: Any, **fields: Any) -> None:
+        self._log(logging.WARNING, event, message, args, fields)
+
+    def error(self, event: str, message: str, *args: Any, **fields: Any) -> None:
+        self._log(logging.ERROR, event, message, args, fields)
+
+    def exception(self, event: str, message: str, *args: Any, **fields: Any) -> None:
+        """ERROR com o traceback da exceção em tratamento"""
+        self._log(logging.ERROR, event, message, args, fields, exc_info=True)
+
+
+_sampler = Sampler(parse_sample_rates(LOG_SAMPLE_RATES))
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """
+    Liga o handler com fila no logger raiz (idempotente). Chamado por
+    get_logger, então importar um módulo que loga já deixa tudo configurado.
+    """
+    global _handler, _listener
+    with _configure_lock:
+        if _handler is not None:
+            return
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+        log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _handler = NonBlockingQueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(getattr(logging, level, logging.INFO))
+        if root.level > logging.DEBUG:
+            for name in NOISY_LOGGERS:
+                logging.getLogger(name).setLevel(max(root.level, logging.WARNING))
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Escreve o que ainda está na fila e para o listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> EventLogger:
+    configure_logging()
+    return EventLogger(logging.getLogger(name))
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "level": logging.getLevelName(logging.getLogger().level),
+        "format": LOG_FORMAT,
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+        "sample_rates": _sampler.rates,
+        "sampled_out": dict(_sampler.skipped),
+    }
@@ -0,0 +1,95 @@
+"""
+Teste da janela de debounce adaptativa: cresce com rajadas, fica entre os
+limites e volta à janela padrão sem perfil
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from adaptive_debounce import (
+    DEBOUNCE_MAX_SECONDS,
+    DEBOUNCE_MIN_SECONDS,
+    INTERACTIVE_DEBOUNCE_SECONDS,
+    MIN_SAMPLES,
+    QUESTION_DEBOUNCE_SECONDS,
+    AdaptiveDebounce,
+)
+
+DEFAULT = 5.0
+PHONE = "5511999990000"
+
+
+def typed(debounce, gaps, phone=PHONE, start=1000.0):
+    """Mensagens do contato separadas pelos intervalos dados (segundos)"""
+    at = start
+    debounce.observe(phone, at)
+    for gap in gaps:
+        at += gap
+        debounce.observe(phone, at)
+
+
+def test_without_history_uses_default():
+    debounce = AdaptiveDebounce(default=DEFAULT)
+    assert debounce.window(PHONE, "oi") == DEFAULT
+    # Poucos intervalos ainda não formam perfil
+    typed(debounce, [1.0] * (MIN_SAMPLES - 1))
+    assert debounce.window(PHONE, "oi") == DEFAULT
+
+
+def test_window_grows_with_bursts():
+    debounce = AdaptiveDebounce(default=DEFAULT)
+    typed(debounce, [1.0] * 10, phone="rapido")
+    typed(debounce, [6.0] * 10, phone="pausado")
+    fast = debounce.window("rapido", "oi")
+    slow = debounce.window("pausado", "oi")
+    assert fast == pytest.approx(max(1.0 * 1.25 + 0.5, DEBOUNCE_MIN_SECONDS))
+    assert slow == pytest.approx(6.0 * 1.25 + 0.5)
+    assert slow > fast
+
+
+@pytest.mark.parametrize("gap", [0.01, 0.5, 3.0, 8.0, 20.0, 29.9])
+def test_window_stays_within_bounds(gap):
+    debounce = AdaptiveDebounce(default=DEFAULT)
+    typed(debounce, [gap] * 20)
+    assert DEBOUNCE_MIN_SECONDS <= debounce.window(PHONE, "oi") <= DEBOUNCE_MAX_SECONDS
+
+
+def test_single_messages_get_the_short_window():
+    debounce = AdaptiveDebounce(default=DEFAULT)
+    # Intervalos acima de BURST_GAP_SECONDS são turnos separados
+    typed(debounce, [600.0] * 10)
+    assert debounce.window(PHONE, "oi") == DEBOUNCE_MIN_SECONDS
+
+
+def test_interactive_and_questions_skip_the_profile():
+    debounce = AdaptiveDebounce(default=DEFAULT)
+    typed(debounce, [10.0] * 10)
+    assert debounce.window(PHONE, "1", is_interactive=True) == INTERACTIVE_DEBOUNCE_SECONDS
+    assert debounce.window(PHONE, "quanto gastei hoje? ") == QUESTION_DEBOUNCE_SECONDS
+
+
+def test_load_history_replaces_profile():
+    debounce = AdaptiveDebounce(default=DEFAULT)
+    typed(debounce, [10.0] * 10)
+    assert debounce.window(PHONE, "oi") > DEFAULT
+    assert not debounce.needs_history(PHONE)
+
+    # Histórico do banco sem rajadas: a janela volta ao mínimo
+    base = datetime(2025, 12, 1, 12, 0)
+    debounce.load_history(PHONE, [base + timedelta(hours=i) for i in range(10)] + [None])
+    assert debounce.window(PHONE, "oi") == DEBOUNCE_MIN_SECONDS
+
+
+def test_evicted_contact_resets_to_default():
+    debounce = AdaptiveDebounce(default=DEFAULT, max_contacts=2)
+    typed(debounce, [10.0] * 10)
+    assert debounce.window(PHONE, "oi") > DEFAULT
+
+    typed(debounce, [1.0], phone="outro")
+    typed(debounce, [1.0], phone="mais um")
+    assert debounce.needs_history(PHONE)
+    assert debounce.window(PHONE, "oi") == DEFAULT
+
+    stats = debounce.stats()
+    assert stats["profiles"] == 2
+    assert stats["reasons"] == {"burst": 1, "default": 1}
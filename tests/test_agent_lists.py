@@ -17,7 +17,9 @@ async def test_agent():
     )
     
     print("\n📤 RESPOSTA DO AGENTE:")
-    print(response)
+    print(response.text)
+    print(f"🔘 Botões: {response.buttons}")
+    print(f"📋 Lista: {response.list_data}")
     
     print("\n" + "=" * 60)
     print("TESTE 2: Cumprimento (deve mostrar LISTA - menu)")
@@ -31,7 +33,9 @@ async def test_agent():
     )
     
     print("\n📤 RESPOSTA DO AGENTE:")
-    print(response2)
+    print(response2.text)
+    print(f"🔘 Botões: {response2.buttons}")
+    print(f"📋 Lista: {response2.list_data}")
     
     print("\n" + "=" * 60)
     print("TESTE 3: Comparação (deve mostrar BOTÕES)")
@@ -45,7 +49,9 @@ async def test_agent():
     )
     
     print("\n📤 RESPOSTA DO AGENTE:")
-    print(response3)
+    print(response3.text)
+    print(f"🔘 Botões: {response3.buttons}")
+    print(f"📋 Lista: {response3.list_data}")
 
 if __name__ == "__main__":
     asyncio.run(test_agent())
@@ -0,0 +1,72 @@
+"""
+Teste da gravação em lote dos AgentLog (registro inválido não trava o lote)
+"""
+import asyncio
+import os
+import tempfile
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from agent_log_writer import AgentLogWriter
+from database import Base
+from models import AgentLog, Contact, Conversation
+
+
+async def make_session_factory():
+    """SQLite temporário com foreign_keys=ON para rejeitar conversation_id inexistente"""
+    path = os.path.join(tempfile.mkdtemp(), "agent_logs.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def enable_foreign_keys(connection, _):
+        connection.execute("PRAGMA foreign_keys=ON")
+
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with factory() as db:
+        contact = Contact(phone="5511999990000")
+        db.add(contact)
+        await db.flush()
+        conversation = Conversation(contact_id=contact.id)
+        db.add(conversation)
+        await db.commit()
+        conversation_id = conversation.id
+    return engine, factory, conversation_id
+
+
+async def count_logs(factory) -> int:
+    async with factory() as db:
+        return await db.scalar(select(func.count()).select_from(AgentLog))
+
+
+def test_invalid_row_does_not_block_batch():
+    async def scenario():
+        engine, factory, conversation_id = await make_session_factory()
+        try:
+            writer = AgentLogWriter(session_factory=factory, max_attempts=2)
+            writer.record("send_message", 999)
+            writer.record("send_message", conversation_id)
+            writer.record("agent_run", conversation_id)
+
+            assert await writer.flush() == 2
+            assert await count_logs(factory) == 2
+            # O inválido volta para mais uma tentativa e então é descartado
+            assert writer.stats()["buffered"] == 1
+            assert await writer.flush() == 0
+            stats = writer.stats()
+            assert stats["buffered"] == 0 and stats["discarded"] == 1
+
+            writer.record("agent_run", conversation_id)
+            assert await writer.flush() == 1
+            assert await count_logs(factory) == 3
+        finally:
+            await engine.dispose()
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_invalid_row_does_not_block_batch()
+    print("✅ AgentLogWriter OK")
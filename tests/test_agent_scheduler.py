@@ -0,0 +1,98 @@
+"""
+Teste do agendador de execuções: uma execução por conversa, reexecução que
+junta o que chegou no meio e drain no shutdown
+"""
+import asyncio
+
+from agent_scheduler import ConversationScheduler
+
+
+def test_one_run_in_flight_per_key():
+    async def scenario():
+        running = {}
+        max_running = {}
+        overall = []
+
+        async def handler(key):
+            running[key] = running.get(key, 0) + 1
+            max_running[key] = max(max_running.get(key, 0), running[key])
+            overall.append(sum(running.values()))
+            await asyncio.sleep(0.02)
+            running[key] -= 1
+
+        scheduler = ConversationScheduler(handler, max_workers=4)
+        scheduler.start()
+        for _ in range(5):
+            for key in ("a", "b", "c"):
+                scheduler.submit(key)
+            await asyncio.sleep(0.005)
+        assert await scheduler.drain(timeout=2.0)
+
+        assert max_running == {"a": 1, "b": 1, "c": 1}
+        # Conversas diferentes rodam em paralelo
+        assert max(overall) > 1
+
+    asyncio.run(scenario())
+
+
+def test_submit_during_run_merges_into_one_rerun():
+    async def scenario():
+        calls = []
+        release = asyncio.Event()
+
+        async def handler(key):
+            calls.append(key)
+            if len(calls) == 1:
+                await release.wait()
+
+        scheduler = ConversationScheduler(handler, max_workers=2)
+        scheduler.start()
+        scheduler.submit("a")
+        await asyncio.sleep(0.01)
+        assert scheduler.is_running("a")
+
+        # Três mensagens no meio da execução viram uma única nova rodada
+        for _ in range(3):
+            scheduler.submit("a")
+        assert scheduler.stats()["rerun_pending"] == 1
+
+        release.set()
+        assert await scheduler.drain(timeout=2.0)
+        assert calls == ["a", "a"]
+        assert scheduler.stats()["completed_total"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_drain_waits_for_queue_and_times_out():
+    async def scenario():
+        done = []
+
+        async def handler(key):
+            await asyncio.sleep(0.05 if key != "slow" else 10)
+            done.append(key)
+
+        scheduler = ConversationScheduler(handler, max_workers=1)
+        scheduler.start()
+        for key in ("a", "b"):
+            scheduler.submit(key)
+        assert await scheduler.drain(timeout=2.0)
+        assert done == ["a", "b"]
+
+        # Execução que não termina a tempo é cancelada
+        scheduler.start()
+        scheduler.submit("slow")
+        await asyncio.sleep(0.01)
+        assert await scheduler.drain(timeout=0.1) is False
+        await asyncio.sleep(0)
+        assert not scheduler.is_running("slow")
+        assert done == ["a", "b"]
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_one_run_in_flight_per_key()
+    test_submit_during_run_merges_into_one_rerun()
+    test_drain_waits_for_queue_and_times_out()
+    print("✅ Agendador OK")
@@ -0,0 +1,229 @@
+"""
+Teste do motor de campanhas: validação e renderização do template, envio de
+template aprovado na Cloud API e pausa com envios em andamento
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import campaign_engine
+from campaign_engine import CampaignEngine, render_content, render_template, validate_campaign, validate_template
+from database import Base, _set_sqlite_pragmas
+from models import Campaign, CampaignDelivery, Contact
+
+CONTACT = SimpleNamespace(name="Maria Silva", phone="5511999990000@s.whatsapp.net", contact_metadata={"plano": "ouro"})
+
+
+class FakeAdapter:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, phone, message):
+        self.sent.append((phone, message))
+        return {"status": "success", "data": {"messages": [{"id": f"wamid.{len(self.sent)}"}]}}
+
+
+class CloudAdapter(FakeAdapter):
+    """Como o WhatsAppBusinessAdapter: fora da janela de 24h só aceita template"""
+    requires_template = True
+
+    async def send_message(self, phone, message):
+        raise AssertionError("campanha não pode mandar texto livre pela Cloud API")
+
+    async def send_template(self, phone, name, language, components=None):
+        self.sent.append((phone, {"name": name, "language": language, "components": components}))
+        return {"status": "success", "response": {"messages": [{"id": f"wamid.{len(self.sent)}"}]}}
+
+
+PROMO = {
+    "name": "promo_natal",
+    "language": "pt_BR",
+    "components": [{"type": "body", "parameters": [{"type": "text", "text": "{first_name}"}, {"type": "text", "text": "10%"}]}],
+}
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'campaigns.db'}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def add_campaign(session_factory, template, contacts=3, whatsapp_template=None):
+    db = session_factory()
+    try:
+        for i in range(contacts):
+            db.add(Contact(phone=f"55119{i:08d}", name=f"Contato {i}"))
+        campaign = Campaign(
+            name="teste", message_template=template, whatsapp_template=whatsapp_template,
+            target_audience={}, status="draft"
+        )
+        db.add(campaign)
+        db.commit()
+        return campaign.id
+    finally:
+        db.close()
+
+
+def run_campaign(session_factory, adapter, campaign_id):
+    async def scenario():
+        engine = CampaignEngine(adapter, session_factory=session_factory, rate=1000, workers=2)
+        engine.start(campaign_id)
+        await asyncio.wait_for(engine._runs[campaign_id], timeout=5)
+
+    asyncio.run(scenario())
+    db = session_factory()
+    try:
+        status = db.get(Campaign, campaign_id).status
+        deliveries = sorted(row.status for row in db.query(CampaignDelivery).all())
+        return status, deliveries
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("template", ["Olá {first_name}!", "{name}, seu plano {plano} venceu", "Sem variáveis", "{{literal}}"])
+def test_valid_templates(template):
+    assert validate_template(template) is None
+
+
+@pytest.mark.parametrize("template", ["Olá {x.y}", "{name.upper}", "{tags[0]}", "Olá {}", "{0}", "{name:{width}}", "Olá {name"])
+def test_invalid_templates(template):
+    assert validate_template(template)
+
+
+def test_render_template():
+    assert render_template("Olá {first_name} ({plano}) {phone} {ausente}!", CONTACT) == "Olá Maria (ouro) 5511999990000 !"
+
+
+@pytest.mark.parametrize("template", ["Olá {x.y}", "{name.upper}", "Olá {name:d}", "Olá {name"])
+def test_render_falls_back_to_raw_template(template):
+    # Nunca levanta exceção nem envia repr de objeto: manda o template como está
+    assert render_template(template, CONTACT) == template
+
+
+def test_invalid_template_is_not_started(session_factory):
+    adapter = FakeAdapter()
+    campaign_id = add_campaign(session_factory, "Olá {name.upper}")
+    status, deliveries = run_campaign(session_factory, adapter, campaign_id)
+    assert status == "draft" and deliveries == [] and adapter.sent == []
+
+
+def test_render_error_does_not_stall_campaign(session_factory):
+    # {name:d} passa na validação mas falha ao formatar: a campanha termina mesmo assim
+    adapter = FakeAdapter()
+    campaign_id = add_campaign(session_factory, "Olá {name:d}")
+    status, deliveries = run_campaign(session_factory, adapter, campaign_id)
+    assert status == "completed"
+    assert deliveries == ["sent"] * 3
+    assert [text for _, text in adapter.sent] == ["Olá {name:d}"] * 3
+
+
+def test_validate_campaign():
+    assert validate_campaign(None, PROMO, requires_template=True) is None
+    assert validate_campaign("Olá {first_name}", None, requires_template=False) is None
+    assert "24h" in validate_campaign("Olá {first_name}", None, requires_template=True)
+    assert validate_campaign(None, None, requires_template=False)
+    assert validate_campaign(None, {"language": "pt_BR"}, requires_template=True)
+    bad = {"name": "promo", "components": [{"type": "body", "parameters": [{"type": "text", "text": "{name.upper}"}]}]}
+    assert validate_campaign(None, bad, requires_template=True)
+
+
+def test_render_whatsapp_template():
+    rendered = render_content({"name": "promo_natal", "components": PROMO["components"]}, CONTACT)
+    assert rendered == {
+        "name": "promo_natal",
+        "language": "pt_BR",
+        "components": [{"type": "body", "parameters": [{"type": "text", "text": "Maria"}, {"type": "text", "text": "10%"}]}],
+    }
+    assert PROMO["components"][0]["parameters"][0]["text"] == "{first_name}"
+
+
+def test_cloud_campaign_without_template_is_not_started(session_factory):
+    adapter = CloudAdapter()
+    campaign_id = add_campaign(session_factory, "Olá {first_name}")
+    status, deliveries = run_campaign(session_factory, adapter, campaign_id)
+    assert status == "draft" and deliveries == [] and adapter.sent == []
+
+
+def test_cloud_campaign_sends_approved_template(session_factory):
+    adapter = CloudAdapter()
+    campaign_id = add_campaign(session_factory, None, contacts=2, whatsapp_template=PROMO)
+    status, deliveries = run_campaign(session_factory, adapter, campaign_id)
+    assert status == "completed" and deliveries == ["sent", "sent"]
+    names = sorted(message["components"][0]["parameters"][0]["text"] for _, message in adapter.sent)
+    assert names == ["Contato", "Contato"]
+    assert {message["name"] for _, message in adapter.sent} == {"promo_natal"}
+
+
+class SlowAdapter(FakeAdapter):
+    """Envio demorado; com hang=True a resposta nunca chega"""
+
+    def __init__(self, delay=0.2, hang=False):
+        super().__init__()
+        self.delay = delay
+        self.hang = hang
+        self.started = []
+
+    async def send_message(self, phone, message):
+        self.started.append(phone)
+        await asyncio.sleep(3600 if self.hang else self.delay)
+        return await super().send_message(phone, message)
+
+
+def pause_while_sending(session_factory, adapter, campaign_id):
+    async def scenario():
+        engine = CampaignEngine(adapter, session_factory=session_factory, rate=1000, workers=2)
+        engine.start(campaign_id)
+        while len(adapter.started) < 2:
+            await asyncio.sleep(0.01)
+        assert await engine.pause(campaign_id)
+
+    asyncio.run(scenario())
+
+
+def delivery_statuses(session_factory):
+    db = session_factory()
+    try:
+        return {row.phone: row.status for row in db.query(CampaignDelivery).all()}
+    finally:
+        db.close()
+
+
+def test_pause_waits_for_sends_in_flight(session_factory):
+    adapter = SlowAdapter()
+    campaign_id = add_campaign(session_factory, "Olá {first_name}", contacts=6)
+    pause_while_sending(session_factory, adapter, campaign_id)
+
+    # Os envios em andamento terminaram e foram gravados antes de a pausa voltar
+    in_flight = adapter.started[:2]
+    statuses = delivery_statuses(session_factory)
+    assert all(statuses[phone] == "sent" for phone in in_flight)
+    assert len(adapter.sent) == len(adapter.started)
+
+    adapter.delay = 0
+    status, deliveries = run_campaign(session_factory, adapter, campaign_id)
+    assert status == "completed" and deliveries == ["sent"] * 6
+    phones = [phone for phone, _ in adapter.sent]
+    assert sorted(phones) == sorted(set(phones))
+
+
+def test_pause_marks_stuck_send_unknown(session_factory, monkeypatch):
+    monkeypatch.setattr(campaign_engine, "SEND_DRAIN_TIMEOUT", 0.1)
+    adapter = SlowAdapter(hang=True)
+    campaign_id = add_campaign(session_factory, "Olá {first_name}", contacts=4)
+    pause_while_sending(session_factory, adapter, campaign_id)
+
+    stuck = adapter.started[:2]
+    statuses = delivery_statuses(session_factory)
+    assert [statuses[phone] for phone in stuck] == ["unknown", "unknown"]
+
+    # Ao retomar, as entregas 'unknown' não são reenviadas
+    adapter = SlowAdapter(delay=0)
+    status, deliveries = run_campaign(session_factory, adapter, campaign_id)
+    assert status == "completed" and sorted(deliveries) == ["sent", "sent", "unknown", "unknown"]
+    assert not set(stuck) & {phone for phone, _ in adapter.sent}
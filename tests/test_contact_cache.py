@@ -0,0 +1,76 @@
+"""
+Teste do cache de contato/conversa: TTL, LRU e invalidação
+"""
+import pytest
+
+import contact_cache
+from contact_cache import ContactCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(contact_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hit_and_ttl_expiry(clock):
+    cache = ContactCache(max_size=10, ttl=60)
+    cache.put("5511", contact_id=1, conversation_id=10, name="Ana")
+    assert cache.get("5511").conversation_id == 10
+
+    clock[0] += 60
+    assert cache.get("5511") is not None
+    clock[0] += 0.1
+    assert cache.get("5511") is None
+    # Expirada sai do índice por conversa também
+    assert cache.stats()["size"] == 0 and not cache._by_conversation
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_lru_eviction_at_capacity(clock):
+    cache = ContactCache(max_size=2, ttl=60)
+    cache.put("a", 1, 10, None)
+    cache.put("b", 2, 20, None)
+    assert cache.get("a")  # "a" vira o mais recente
+    cache.put("c", 3, 30, None)
+
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.stats()["size"] == 2
+    assert set(cache._by_conversation) == {10, 30}
+
+
+def test_put_refreshes_ttl(clock):
+    cache = ContactCache(max_size=10, ttl=60)
+    cache.put("5511", 1, 10, "Ana")
+    clock[0] += 50
+    cache.put("5511", 1, 10, "Ana")
+    clock[0] += 50
+    assert cache.get("5511") is not None
+
+
+def test_contact_update_replaces_entry(clock):
+    cache = ContactCache(max_size=10, ttl=60)
+    cache.put("5511", 1, 10, None)
+    cache.update_name("5511", "Ana")
+    assert cache.get("5511").name == "Ana"
+    cache.update_name("outro", "Bia")
+    assert cache.get("outro") is None
+
+    # Conversa nova para o mesmo contato: a antiga não invalida mais a entrada
+    cache.put("5511", 1, 11, "Ana")
+    cache.invalidate_conversation(10)
+    assert cache.get("5511").conversation_id == 11
+
+    cache.invalidate_conversation(11)
+    assert cache.get("5511") is None
+
+
+def test_invalidate_phone(clock):
+    cache = ContactCache(max_size=10, ttl=60)
+    cache.put("5511", 1, 10, "Ana")
+    cache.invalidate("5511")
+    assert cache.get("5511") is None
+    assert 10 not in cache._by_conversation
+    cache.invalidate("5511")  # idempotente
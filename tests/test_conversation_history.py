@@ -0,0 +1,72 @@
+"""
+Teste do histórico recente por conversa (ring buffer do contexto do agente)
+"""
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from conversation_history import ConversationHistory
+
+
+def rows(*texts):
+    """Mensagens do banco alternando recebida/enviada"""
+    return [
+        SimpleNamespace(direction="incoming" if i % 2 == 0 else "outgoing", text=text)
+        for i, text in enumerate(texts)
+    ]
+
+
+def texts(messages):
+    return [message.content for message in messages]
+
+
+def test_ring_buffer_keeps_last_n():
+    history = ConversationHistory(turns=3)
+    assert history.get(1) is None
+
+    loaded = history.load(1, rows("m1", "m2", "m3", "m4", "m5"), history.begin_load())
+    assert texts(loaded) == ["m1", "m2", "m3", "m4", "m5"]
+    assert texts(history.get(1)) == ["m3", "m4", "m5"]
+
+    history.append(1, "outgoing", "m6")
+    history.append(1, "incoming", "m7")
+    messages = history.get(1)
+    assert texts(messages) == ["m5", "m6", "m7"]
+    assert isinstance(messages[-1], HumanMessage) and isinstance(messages[-2], AIMessage)
+
+
+def test_get_returns_copy():
+    history = ConversationHistory(turns=3)
+    history.load(1, rows("m1"), history.begin_load())
+    history.get(1).append("intruso")
+    assert texts(history.get(1)) == ["m1"]
+
+
+def test_write_during_load_is_not_cached():
+    history = ConversationHistory(turns=5)
+    marker = history.begin_load()
+    # Mensagem gravada enquanto a consulta rodava: o resultado pode estar velho
+    history.append(1, "incoming", "nova")
+    assert texts(history.load(1, rows("m1"), marker)) == ["m1"]
+    assert history.get(1) is None
+
+
+def test_lru_and_invalidate():
+    history = ConversationHistory(turns=5, max_conversations=2)
+    for conversation_id in (1, 2):
+        history.load(conversation_id, rows(f"c{conversation_id}"), history.begin_load())
+    assert history.get(1)  # 1 vira a mais recente
+    history.load(3, rows("c3"), history.begin_load())
+    assert history.get(2) is None
+    assert history.get(1) and history.get(3)
+
+    history.invalidate(1)
+    assert history.get(1) is None
+    assert history.stats()["conversations"] == 1
+
+
+def test_disabled_never_caches():
+    history = ConversationHistory(enabled=False)
+    assert texts(history.load(1, rows("m1"), history.begin_load())) == ["m1"]
+    history.append(1, "incoming", "m2")
+    assert history.get(1) is None
@@ -0,0 +1,105 @@
+"""
+Teste do encerramento de conversas ociosas: resumo via LLM limitado por
+varredura, histórico antigo sem LLM e tokens do resumo no TokenUsageRecorder
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from langchain_core.messages import AIMessage
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from conversation_lifecycle import SUMMARY_TOOL_PATH, ConversationLifecycle
+from database import Base, _set_sqlite_pragmas
+from models import Contact, Conversation, Message
+
+NOW = datetime.utcnow()
+IDLE_MINUTES = 60
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        return AIMessage(
+            content="Resumo do LLM",
+            usage_metadata={"input_tokens": 300, "output_tokens": 40, "total_tokens": 340},
+            response_metadata={"model_name": "gpt-4.1-mini"},
+        )
+
+
+class FakeRecorder:
+    def __init__(self):
+        self.records = []
+
+    def record(self, usage, conversation_id, contact_id=None):
+        self.records.append((usage, conversation_id))
+
+
+def run_sweep(tmp_path, idle_minutes_ago, **kwargs):
+    """Cria uma conversa ativa por idade (minutos sem mensagem) e roda uma varredura"""
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'lifecycle.db'}")
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+            ids = {}
+            async with session_factory() as db:
+                for i, minutes in enumerate(idle_minutes_ago):
+                    contact = Contact(phone=f"55119{i:08d}")
+                    db.add(contact)
+                    await db.flush()
+                    last = NOW - timedelta(minutes=minutes)
+                    conversation = Conversation(contact_id=contact.id, status="active", started_at=last, last_message_at=last)
+                    db.add(conversation)
+                    await db.flush()
+                    db.add(Message(conversation_id=conversation.id, contact_id=contact.id, direction="incoming", text="oi", created_at=last))
+                    ids[conversation.id] = minutes
+                await db.commit()
+
+            lifecycle = ConversationLifecycle(session_factory=session_factory, idle_minutes=IDLE_MINUTES, **kwargs)
+            lifecycle._llm = FakeLLM()
+            closed = await lifecycle.sweep()
+
+            async with session_factory() as db:
+                summaries = dict((await db.execute(select(Conversation.id, Conversation.summary))).all())
+            return lifecycle, ids, closed, summaries
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(scenario())
+
+
+def test_simple_mode_never_calls_llm(tmp_path):
+    lifecycle, ids, closed, summaries = run_sweep(tmp_path, [90, 90, 30], summary_mode="simple")
+    assert len(closed) == 2
+    assert lifecycle._llm.calls == 0
+    assert all(summaries[cid] and summaries[cid] != "Resumo do LLM" for cid in closed)
+
+
+def test_llm_summaries_skip_backlog_and_are_capped(tmp_path):
+    recorder = FakeRecorder()
+    # 3 ociosas há pouco mais de uma janela, 3 do histórico de antes do job, 1 ainda ativa
+    lifecycle, ids, closed, summaries = run_sweep(
+        tmp_path, [70, 80, 90, 60 * 24 * 10, 60 * 24 * 30, 60 * 3, 10],
+        summary_mode="llm", usage_recorder=recorder, llm_max_per_sweep=2
+    )
+    assert len(closed) == 6
+    assert lifecycle._llm.calls == 2
+    stats = lifecycle.stats()["summaries"]
+    assert stats["llm"] == 2 and stats["backlog"] == 3 and stats["capped"] == 1
+
+    with_llm = {cid for cid, summary in summaries.items() if summary == "Resumo do LLM"}
+    assert all(ids[cid] < 2 * IDLE_MINUTES for cid in with_llm)
+    assert all(summaries[cid] for cid in closed)
+
+    # Tokens do resumo registrados com o caminho próprio e a conversa
+    assert {conversation_id for _, conversation_id in recorder.records} == with_llm
+    usage = recorder.records[0][0]
+    assert usage.tool_path == SUMMARY_TOOL_PATH
+    assert usage.totals()["prompt_tokens"] == 300
@@ -0,0 +1,91 @@
+"""
+Teste do divisor de mensagens (propriedades com Hypothesis)
+"""
+import re
+
+from hypothesis import given, settings, strategies as st
+
+from message_splitter import MESSAGE_LIMITS, split_interactive_body, split_message
+
+BOLD = re.compile(r"\*[^*\n]+\*")
+
+# Texto com parágrafos, listas, frases, negrito, palavras enormes (URLs, JSON) e unicode qualquer
+WORDS = st.sampled_from(["campanha", "CTR", "R$ 5,38", "*negrito*", "*CPC médio alto*", "1,54%", "ok.", "fim!", "pergunta?"])
+SEPARATORS = st.sampled_from(["\n\n", "\n- ", "\n", "\t", "  "])
+LONG_WORDS = st.integers(min_value=50, max_value=1500).map(lambda n: "https://example.com/" + "x" * n)
+BOLD_SPANS = st.text(st.characters(blacklist_characters="*\n"), min_size=1, max_size=60).map(lambda t: f"*{t}*")
+TEXTS = st.lists(
+    st.one_of(WORDS, WORDS, SEPARATORS, LONG_WORDS, BOLD_SPANS, st.text(max_size=20)),
+    max_size=300
+).map(" ".join)
+MAX_CHARS = st.sampled_from([50, 200, 800, 1024, 4096]) | st.integers(min_value=20, max_value=5000)
+
+
+def check_parts(text: str, parts: list, max_chars: int, window: int = None) -> None:
+    assert all(parts), "parte vazia"
+    assert all(len(part) <= max_chars for part in parts), "parte acima do limite"
+    assert all(part == part.strip() for part in parts), "espaço nas pontas"
+
+    # Nada se perde nem muda de ordem (só espaços entre partes)
+    squash = lambda s: re.sub(r"\s+", "", s)
+    assert squash("".join(parts)) == squash(text), "conteúdo alterado"
+
+    # Negrito que cabe em meia janela tem sempre um corte fora dele: nunca é partido
+    for match in BOLD.finditer(text):
+        if len(match.group()) <= (window or max_chars) // 2:
+            assert any(match.group() in part for part in parts), f"negrito cortado: {match.group()}"
+
+
+@settings(max_examples=300, deadline=None)
+@given(TEXTS, MAX_CHARS)
+def test_split_properties(text, max_chars):
+    check_parts(text, split_message(text, max_chars), max_chars)
+
+
+def test_split_boundaries():
+    assert split_message("") == []
+    assert split_message("  curto  ") == ["curto"]
+
+    # Prefere parágrafo, depois linha, depois frase
+    paragraphs = "a" * 60 + "\n\n" + "b" * 60
+    assert split_message(paragraphs, 100) == ["a" * 60, "b" * 60]
+    sentences = "Frase um termina aqui. " * 10
+    assert all(part.endswith(".") for part in split_message(sentences, 100))
+
+    # Negrito maior que a janela é cortado seco sem desalinhar os pares de `*` seguintes
+    assert split_message("campanha *00000000000* campanha *negrito*", 20)[-1] == "*negrito*"
+
+    # Limite da Cloud API vale mesmo pedindo mais
+    assert max(map(len, split_message("palavra " * 2000, 10_000))) <= MESSAGE_LIMITS["text"]
+
+
+@settings(max_examples=200, deadline=None)
+@given(TEXTS.filter(str.strip), st.sampled_from([None, 200, 800]))
+def test_interactive_body_properties(text, text_chars):
+    leading, body = split_interactive_body(text, text_chars)
+    text_limit = text_chars or MESSAGE_LIMITS["text"]
+    assert body and len(body) <= MESSAGE_LIMITS["interactive_body"]
+    assert all(len(part) <= text_limit for part in leading)
+    # O corpo sai de uma divisão em janelas de interactive_body; o restante, de text_limit
+    check_parts(
+        text, leading + [body], max(text_limit, MESSAGE_LIMITS["interactive_body"]),
+        window=min(text_limit, MESSAGE_LIMITS["interactive_body"])
+    )
+
+
+def test_interactive_body():
+    text = "Análise detalhada. " * 100 + "Quer ver o histórico?"
+    leading, body = split_interactive_body(text, 800)
+    assert len(body) <= MESSAGE_LIMITS["interactive_body"]
+    assert body.endswith("Quer ver o histórico?")
+    check_parts(text, leading + [body], MESSAGE_LIMITS["interactive_body"])
+
+    assert split_interactive_body("curto") == ([], "curto")
+
+
+if __name__ == "__main__":
+    test_split_properties()
+    test_split_boundaries()
+    test_interactive_body()
+    test_interactive_body_properties()
+    print("✅ Divisor OK")
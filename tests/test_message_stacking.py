@@ -0,0 +1,122 @@
+"""
+Teste dos backends de empilhamento (memory e database): push idempotente,
+claim com compare-and-set, lease expirado e mensagens que chegam durante o processamento
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+import pytest
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from message_stacking import DatabaseStackingBackend, InMemoryStackingBackend
+from models import StackedMessage, StackLease
+
+PHONE = "5511999990000@s.whatsapp.net"
+
+
+@pytest.fixture(scope="module")
+def database_sessions():
+    path = os.path.join(tempfile.mkdtemp(), "stacking.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 10})
+    Base.metadata.create_all(bind=engine, tables=[StackedMessage.__table__, StackLease.__table__])
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture(params=["memory", "database"])
+def backend(request):
+    if request.param == "memory":
+        return InMemoryStackingBackend()
+    session_factory = request.getfixturevalue("database_sessions")
+    with session_factory() as db:
+        db.execute(delete(StackedMessage))
+        db.execute(delete(StackLease))
+        db.commit()
+    return DatabaseStackingBackend(session_factory)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_duplicate_push_is_ignored(backend):
+    async def scenario():
+        assert await backend.push(PHONE, "oi", "Ana", 1, 0, message_row_id=10) == 1
+        assert await backend.push(PHONE, "oi", "Ana", 1, 0, message_row_id=10) == 1
+        assert await backend.push(PHONE, "tudo bem?", "Ana", 1, 0, message_row_id=11) == 2
+        stack = await backend.claim(PHONE, "a", 60)
+        assert stack.messages == ["oi", "tudo bem?"]
+        assert stack.message_ids == [10, 11]
+    run(scenario())
+
+
+def test_claim_waits_for_deadline(backend):
+    async def scenario():
+        await backend.push(PHONE, "oi", None, 1, 30)
+        assert await backend.claim(PHONE, "a", 60) is None
+        assert await backend.claim("5511000000000@s.whatsapp.net", "a", 60) is None
+    run(scenario())
+
+
+def test_concurrent_claim_has_single_winner(backend):
+    async def scenario():
+        await backend.push(PHONE, "oi", None, 1, 0, message_row_id=1)
+        results = await asyncio.gather(*(backend.claim(PHONE, f"worker-{i}", 60) for i in range(8)))
+        winners = [result for result in results if result is not None]
+        assert len(winners) == 1
+        # Enquanto o lease vale, outro worker não pega a pilha
+        assert await backend.claim(PHONE, "late-worker", 60) is None
+    run(scenario())
+
+
+def test_expired_lease_is_taken_over(backend):
+    async def scenario():
+        await backend.push(PHONE, "oi", None, 1, 0, message_row_id=1)
+        assert await backend.claim(PHONE, "dead-worker", 0.05) is not None
+        assert await backend.claim(PHONE, "b", 60) is None
+        time.sleep(0.1)
+
+        stack = await backend.claim(PHONE, "b", 60)
+        assert stack is not None and stack.messages == ["oi"]
+        # O dono antigo não libera o lease de quem assumiu
+        await backend.release(PHONE, "dead-worker")
+        assert await backend.claim(PHONE, "c", 60) is None
+
+        assert await backend.complete(PHONE, "b", stack) == 0
+        assert await backend.pending_phones() == []
+    run(scenario())
+
+
+def test_complete_keeps_late_arrivals(backend):
+    async def scenario():
+        await backend.push(PHONE, "oi", None, 1, 0, message_row_id=1)
+        stack = await backend.claim(PHONE, "a", 60)
+        # Chega durante o processamento: fica para a próxima rodada
+        await backend.push(PHONE, "mais uma coisa", None, 1, 0, message_row_id=2)
+
+        assert await backend.complete(PHONE, "a", stack) == 1
+        assert await backend.pending_phones() == [PHONE]
+
+        next_stack = await backend.claim(PHONE, "a", 60)
+        assert next_stack.messages == ["mais uma coisa"]
+        assert next_stack.message_ids == [2]
+        assert await backend.complete(PHONE, "a", next_stack) == 0
+    run(scenario())
+
+
+def test_release_keeps_messages(backend):
+    async def scenario():
+        await backend.push(PHONE, "oi", None, 1, 0, message_row_id=1)
+        assert await backend.claim(PHONE, "a", 60) is not None
+        await backend.release(PHONE, "a")
+        stack = await backend.claim(PHONE, "b", 60)
+        assert stack is not None and stack.messages == ["oi"]
+    run(scenario())
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,39 @@
+"""
+Teste das métricas (formato de texto do Prometheus)
+"""
+from metrics import Registry, graph_endpoint
+
+
+def test_histogram_and_counter_render():
+    registry = Registry()
+    latency = registry.histogram("demo_seconds", "Latência", ("route",), buckets=(0.1, 1.0))
+    responses = registry.counter("demo_responses", "Respostas", ("status",))
+    registry.gauge("demo_queue", "Fila", lambda: 3)
+
+    latency.observe(0.05, "/webhook")
+    latency.observe(0.5, "/webhook")
+    latency.observe(5.0, "/webhook")
+    responses.inc("200")
+    responses.inc("200")
+
+    text = registry.render()
+    assert '# TYPE demo_seconds histogram' in text
+    assert 'demo_seconds_bucket{route="/webhook",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{route="/webhook",le="1.0"} 2' in text
+    assert 'demo_seconds_bucket{route="/webhook",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{route="/webhook"} 3' in text
+    assert 'demo_responses_total{status="200"} 2' in text
+    assert 'demo_queue 3' in text
+
+
+def test_graph_endpoint_without_ids():
+    assert graph_endpoint("https://graph.facebook.com/v21.0/act_123/insights") == "insights"
+    assert graph_endpoint("https://graph.facebook.com/v21.0/act_123") == "node"
+    assert graph_endpoint("https://graph.facebook.com/v21.0/987654") == "node"
+    assert graph_endpoint("https://graph.facebook.com/v21.0/120/activities?limit=50") == "activities"
+
+
+if __name__ == "__main__":
+    test_histogram_and_counter_render()
+    test_graph_endpoint_without_ids()
+    print("✅ Métricas OK")
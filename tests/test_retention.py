@@ -0,0 +1,198 @@
+"""
+Teste da retenção: corte por idade, arquivo JSONL + zstd antes de apagar,
+janela de execução e vacuum incremental do SQLite
+"""
+import asyncio
+import io
+import json
+import os
+from datetime import datetime, time as dt_time, timedelta
+
+import pytest
+import zstandard
+from sqlalchemy import create_engine, event, func, select, text
+from sqlalchemy.orm import sessionmaker
+
+import retention
+from database import Base, _set_sqlite_pragmas
+from models import AgentLog, Contact, Conversation, Message
+from retention import RetentionManager, RetentionPolicy, in_window, parse_window
+
+NOW = datetime.utcnow()
+
+
+@pytest.fixture
+def db_env(tmp_path):
+    """SQLite novo com os mesmos PRAGMAs da aplicação (inclui auto_vacuum=INCREMENTAL)"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'retention.db'}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    Base.metadata.create_all(bind=engine)
+    yield engine, sessionmaker(bind=engine), tmp_path / "archive"
+    engine.dispose()
+
+
+def make_manager(db_env, policies, window=""):
+    engine, session_factory, archive_dir = db_env
+    return RetentionManager(
+        session_factory=session_factory, policies=policies, archive_dir=str(archive_dir),
+        window=window, batch_size=2, pause_ms=0, enabled=True, engine=engine
+    )
+
+
+def read_archives(directory):
+    records = []
+    for name in sorted(os.listdir(directory)):
+        assert name.endswith(".jsonl.zst")
+        with open(directory / name, "rb") as fh:
+            reader = zstandard.ZstdDecompressor().stream_reader(fh)
+            records += [json.loads(line) for line in io.TextIOWrapper(reader, encoding="utf-8")]
+    return records
+
+
+def add_conversation(db, status, ended_days_ago, messages=2):
+    contact = Contact(phone=f"55119{db.query(Contact).count():08d}")
+    db.add(contact)
+    db.flush()
+    ended = NOW - timedelta(days=ended_days_ago)
+    conversation = Conversation(
+        contact_id=contact.id, status=status, started_at=ended, last_message_at=ended,
+        closed_at=ended if status == "closed" else None
+    )
+    db.add(conversation)
+    db.flush()
+    for i in range(messages):
+        db.add(Message(
+            conversation_id=conversation.id, contact_id=contact.id, direction="incoming",
+            text=f"mensagem {i} ção", created_at=ended, raw_data={"i": i}
+        ))
+    db.add(AgentLog(conversation_id=conversation.id, action="agent_run", status="success", created_at=ended))
+    db.commit()
+    return conversation.id
+
+
+def test_window():
+    window = parse_window("22:00-06:00")
+    assert in_window(window, datetime(2025, 1, 1, 23, 30))
+    assert in_window(window, datetime(2025, 1, 1, 5, 59))
+    assert not in_window(window, datetime(2025, 1, 1, 12, 0))
+    assert parse_window("01:00-06:00") == (dt_time(1, 0), dt_time(6, 0))
+    assert parse_window("") is None and in_window(None)
+
+
+def test_clear_column_respects_cutoff(db_env):
+    _, session_factory, _ = db_env
+    with session_factory() as db:
+        for days in (40, 31, 29, 1):
+            db.add(Message(direction="incoming", text=str(days), created_at=NOW - timedelta(days=days), raw_data={"d": days}))
+        db.commit()
+
+    manager = make_manager(db_env, [RetentionPolicy("messages", "clear_column", 30, column="raw_data")])
+    assert asyncio.run(manager.run_once(respect_window=False))
+
+    with session_factory() as db:
+        # NULL de verdade (não o texto 'null' do JSON)
+        cleared = db.execute(text("SELECT text FROM messages WHERE raw_data IS NULL ORDER BY id")).scalars().all()
+        kept = db.execute(text("SELECT text FROM messages WHERE raw_data IS NOT NULL ORDER BY id")).scalars().all()
+    assert cleared == ["40", "31"]
+    assert kept == ["29", "1"]
+
+
+def test_archive_conversations_round_trip(db_env):
+    _, session_factory, archive_dir = db_env
+    with session_factory() as db:
+        old_closed = [add_conversation(db, "closed", 200) for _ in range(3)]
+        recent_closed = add_conversation(db, "closed", 10)
+        old_active = add_conversation(db, "active", 200)
+
+    manager = make_manager(db_env, [RetentionPolicy("conversations", "archive_conversations", 180)])
+    assert asyncio.run(manager.run_once(respect_window=False))
+    assert manager.stats()["last_run"]["policies"]["conversations"] == 3
+
+    records = read_archives(archive_dir / "conversations")
+    assert sorted(record["id"] for record in records) == old_closed
+    for record in records:
+        assert [m["text"] for m in record["messages"]] == ["mensagem 0 ção", "mensagem 1 ção"]
+        assert record["messages"][0]["raw_data"] == {"i": 0}
+        assert [log["action"] for log in record["agent_logs"]] == ["agent_run"]
+
+    with session_factory() as db:
+        remaining = sorted(db.scalars(select(Conversation.id)))
+        assert remaining == sorted([recent_closed, old_active])
+        assert db.scalar(select(func.count()).select_from(Message).where(Message.conversation_id.in_(old_closed))) == 0
+        assert db.scalar(select(func.count()).select_from(AgentLog).where(AgentLog.conversation_id.in_(old_closed))) == 0
+
+
+def test_archive_table_respects_cutoff(db_env):
+    _, session_factory, archive_dir = db_env
+    with session_factory() as db:
+        for days in (120, 95, 91, 89, 3):
+            db.add(AgentLog(action=f"log-{days}", status="success", created_at=NOW - timedelta(days=days)))
+        db.commit()
+
+    manager = make_manager(db_env, [RetentionPolicy("agent_logs", "archive", 90)])
+    assert asyncio.run(manager.run_once(respect_window=False))
+
+    assert [record["action"] for record in read_archives(archive_dir / "agent_logs")] == ["log-120", "log-95", "log-91"]
+    with session_factory() as db:
+        assert sorted(db.scalars(select(AgentLog.action))) == ["log-3", "log-89"]
+
+
+def test_nothing_deleted_when_archive_fails(db_env, monkeypatch):
+    _, session_factory, archive_dir = db_env
+    with session_factory() as db:
+        conversation_id = add_conversation(db, "closed", 200)
+        db.add(AgentLog(action="antigo", status="success", created_at=NOW - timedelta(days=120)))
+        db.commit()
+
+    def failing_write(path, records):
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr(retention, "write_archive", failing_write)
+    for policy in (
+        RetentionPolicy("conversations", "archive_conversations", 180),
+        RetentionPolicy("agent_logs", "archive", 90),
+    ):
+        with pytest.raises(OSError):
+            asyncio.run(make_manager(db_env, [policy]).run_once(respect_window=False))
+
+    with session_factory() as db:
+        assert db.get(Conversation, conversation_id) is not None
+        assert db.scalar(select(func.count()).select_from(Message)) == 2
+        assert db.scalar(select(func.count()).select_from(AgentLog)) == 2
+    assert not archive_dir.exists() or not any(archive_dir.rglob("*.zst"))
+
+
+def test_outside_window_stops_without_changes(db_env):
+    _, session_factory, archive_dir = db_env
+    with session_factory() as db:
+        add_conversation(db, "closed", 200)
+
+    hour = datetime.now().hour
+    closed_window = f"{(hour + 2) % 24:02d}:00-{(hour + 3) % 24:02d}:00"
+    manager = make_manager(db_env, [RetentionPolicy("conversations", "archive_conversations", 180)], window=closed_window)
+    assert asyncio.run(manager.run_once()) is False
+    with session_factory() as db:
+        assert db.scalar(select(func.count()).select_from(Conversation)) == 1
+
+
+def test_incremental_vacuum_frees_pages(db_env):
+    engine, session_factory, _ = db_env
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2  # INCREMENTAL
+
+    with session_factory() as db:
+        for i in range(200):
+            db.add(AgentLog(action="grande", status="success", input_data={"x": "a" * 4000}, created_at=NOW - timedelta(days=120)))
+        db.commit()
+
+    manager = make_manager(db_env, [RetentionPolicy("agent_logs", "archive", 90)])
+    manager.batch_size = 100
+    assert asyncio.run(manager.run_once(respect_window=False))
+
+    assert manager.stats()["last_run"]["vacuum_pages_freed"] > 0
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA freelist_count").scalar() == 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-q"]))
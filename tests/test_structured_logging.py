@@ -0,0 +1,40 @@
+"""
+Teste do logging estruturado (amostragem e formato JSON)
+"""
+import json
+import logging
+from structured_logging import JsonFormatter, Sampler, parse_sample_rates
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("") == {}
+    assert parse_sample_rates("webhook_received=0.1, llm_response=2,ruim=x,sem_taxa") == {
+        "webhook_received": 0.1,
+        "llm_response": 1.0,
+    }
+
+
+def test_sampler():
+    sampler = Sampler({"alto_volume": 0.0, "metade": 0.5})
+    assert all(sampler.keep("outro") for _ in range(100))
+    assert not any(sampler.keep("alto_volume") for _ in range(100))
+    assert sampler.skipped["alto_volume"] == 100
+    kept = sum(sampler.keep("metade") for _ in range(2000))
+    assert 800 < kept < 1200
+
+
+def test_json_formatter():
+    record = logging.LogRecord("main", logging.INFO, __file__, 1, "📦 %d mensagem(ns) de %s", (2, "5511"), None)
+    record.event = "stack_processing"
+    record.fields = {"phone": "5511", "messages": 2}
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["event"] == "stack_processing"
+    assert entry["msg"] == "📦 2 mensagem(ns) de 5511"
+    assert entry["phone"] == "5511" and entry["messages"] == 2
+
+
+if __name__ == "__main__":
+    test_parse_sample_rates()
+    test_sampler()
+    test_json_formatter()
+    print("✅ Logging OK")
@@ -0,0 +1,46 @@
+"""
+Teste da timer wheel usada nos deadlines de debounce
+"""
+import time
+from timer_wheel import TimerWheel
+
+
+def test_timer_wheel():
+    fired = []
+    wheel = TimerWheel(fired.append, tick=0.25, slots=8)
+    t0 = time.monotonic()
+
+    wheel.schedule("a", 1.0)
+    wheel.schedule("b", 0.3)
+    wheel.advance(t0 + 0.6)
+    assert fired == ["b"]
+
+    # Reagendar adia o disparo (debounce)
+    wheel.schedule("a", 3.0)
+    wheel.advance(t0 + 1.5)
+    assert fired == ["b"]
+    wheel.advance(t0 + 3.3)
+    assert fired == ["b", "a"]
+
+    # Deadline além de uma volta da roda
+    wheel.schedule("c", 100)
+    wheel.advance(t0 + 50)
+    assert "c" in wheel
+    wheel.advance(t0 + 101)
+    assert fired[-1] == "c"
+
+    # Cancelamento
+    wheel.schedule("d", 1)
+    wheel.cancel("d")
+    wheel.advance(t0 + 200)
+    assert "d" not in fired
+
+    stats = wheel.stats()
+    print(f"📊 Stats: {stats}")
+    assert stats["pending"] == 0
+    assert stats["fired_total"] == 3
+
+
+if __name__ == "__main__":
+    test_timer_wheel()
+    print("✅ Timer wheel OK")
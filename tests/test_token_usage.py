@@ -0,0 +1,57 @@
+"""
+Teste do consumo de tokens (usage_metadata -> custo e rollup)
+"""
+from langchain_core.messages import AIMessage, HumanMessage
+
+from token_usage import NO_TOOLS, cost_usd, rollup, usage_from_messages
+
+
+def ai_message(prompt, cached, completion, tools=(), model="gpt-4.1-mini-2025-04-14"):
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": name, "args": {}, "id": f"call_{name}"} for name in tools],
+        usage_metadata={
+            "input_tokens": prompt,
+            "output_tokens": completion,
+            "total_tokens": prompt + completion,
+            "input_token_details": {"cache_read": cached},
+        },
+        response_metadata={"model_name": model},
+    )
+
+
+def test_usage_from_messages():
+    usage = usage_from_messages([
+        HumanMessage(content="como estão as campanhas?"),
+        ai_message(3000, 2048, 40, tools=["facebook_campaign_insights"]),
+        ai_message(4200, 2048, 35, tools=["compare_periods", "facebook_campaign_insights"]),
+        ai_message(5000, 4096, 220),
+    ], "gpt-4.1-mini")
+
+    assert len(usage.calls) == 3
+    assert usage.tool_path == "facebook_campaign_insights>compare_periods"
+    totals = usage.totals()
+    assert totals["prompt_tokens"] == 12200 and totals["cached_tokens"] == 8192
+    # Preço pelo prefixo do nome com data; tokens em cache custam menos
+    assert abs(cost_usd("gpt-4.1-mini-2025-04-14", 1_000_000, 0, 0) - 0.40) < 1e-9
+    assert abs(cost_usd("gpt-4.1-mini", 1_000_000, 1_000_000, 1_000_000) - 1.70) < 1e-9
+    assert abs(totals["cost_usd"] - sum(call.cost_usd for call in usage.calls)) < 1e-12
+
+
+def test_rollup_by_day_contact_and_path():
+    simple = usage_from_messages([ai_message(2000, 0, 100)], "gpt-4.1-mini")
+    tools = usage_from_messages([ai_message(2000, 0, 20, tools=["get_balance"]), ai_message(2600, 0, 80)], "gpt-4.1-mini")
+    assert simple.tool_path == NO_TOOLS
+
+    rows = rollup([("2025-12-15", 7, simple), ("2025-12-15", 7, simple), ("2025-12-15", 7, tools)])
+    model = "gpt-4.1-mini-2025-04-14"
+    assert rows[("2025-12-15", 7, NO_TOOLS, model)]["runs"] == 2
+    assert rows[("2025-12-15", 7, NO_TOOLS, model)]["prompt_tokens"] == 4000
+    assert rows[("2025-12-15", 7, "get_balance", model)]["runs"] == 1
+    assert rows[("2025-12-15", 7, "get_balance", model)]["llm_calls"] == 2
+
+
+if __name__ == "__main__":
+    test_usage_from_messages()
+    test_rollup_by_day_contact_and_path()
+    print("✅ Consumo de tokens OK")
@@ -0,0 +1,67 @@
+"""
+Teste do tracing por turno (spans aninhados, buffer e payload OTLP)
+"""
+import asyncio
+
+from tracing import OTLPExporter, Tracer
+
+
+def test_nested_spans_and_turns():
+    tracer = Tracer(max_traces=10)
+    trace = tracer.turn("5511", phone="5511")
+    assert tracer.turn("5511") is trace  # mesma janela de debounce, mesmo trace
+
+    assert tracer.take_turn("5511", messages=2) is trace
+    with tracer.activate(trace):
+        with tracer.span("agent_run") as run:
+            with tracer.span("tools"):
+                tracer.add_span("graph_api", 1.0, 2.0, endpoint="insights")
+    with tracer.span("fora_do_turno") as outside:
+        assert outside is None
+
+    spans = {span.name: span for span in trace.spans}
+    assert spans["agent_run"].parent_id is None
+    assert spans["tools"].parent_id == run.span_id
+    assert spans["graph_api"].parent_id == spans["tools"].span_id
+    assert trace.attributes == {"phone": "5511", "messages": 2}
+    assert tracer.take_turn("5511") is not trace  # turno já processado
+
+
+def test_ring_buffer_and_span_limit():
+    tracer = Tracer(max_traces=3, max_spans=2)
+    traces = [tracer.start_trace("turn") for _ in range(5)]
+    assert tracer.get(traces[0].trace_id) is None
+    assert tracer.get(traces[-1].trace_id) is traces[-1]
+
+    for _ in range(3):
+        tracer.add_span("whatsapp_send", 1.0, 2.0, trace=traces[-1])
+    assert len(traces[-1].spans) == 2
+    assert traces[-1].dropped_spans == 1
+
+
+def test_otlp_payload():
+    exporter = OTLPExporter("http://collector:4318", service_name="teste")
+    tracer = Tracer(exporter=exporter)
+    trace = tracer.start_trace("turn")
+    with tracer.activate(trace):
+        try:
+            with tracer.span("agent", step=1):
+                raise ValueError("falhou")
+        except ValueError:
+            pass
+
+    payload = exporter.payload(exporter._pending)
+    span = payload["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert exporter.url == "http://collector:4318/v1/traces"
+    assert span["traceId"] == trace.trace_id and len(span["spanId"]) == 16
+    assert span["attributes"] == [{"key": "step", "value": {"intValue": "1"}}]
+    assert span["status"] == {"code": 2, "message": "ValueError: falhou"}
+    asyncio.run(exporter.stop())  # sem collector: falha contada, não propaga
+    assert exporter.stats()["failures"] == 1
+
+
+if __name__ == "__main__":
+    test_nested_spans_and_turns()
+    test_ring_buffer_and_span_limit()
+    test_otlp_payload()
+    print("✅ Tracing OK")
@@ -0,0 +1,57 @@
+"""
+Teste do formatador de WhatsApp (conversões e idempotência)
+"""
+import random
+from whatsapp_formatter import format_for_whatsapp, is_formatted
+
+
+CASES = [
+    ("## Resumo da conta", "*Resumo da conta*"),
+    ("O CTR está **alto** hoje", "O CTR está *alto* hoje"),
+    ("Use `get_insights` para ver", "Use get_insights para ver"),
+    ("Veja [o painel](https://example.com)", "Veja o painel (https://example.com)"),
+    ("## **Título**\ntexto", "*Título*\ntexto"),
+    ("linha 1   \n\n\n\nlinha 2", "linha 1\n\nlinha 2"),
+    (
+        'Escolha uma opção:\nsend_whatsapp_buttons(body_text="x", buttons=[{"id": "1"}])\nObrigado!',
+        "Escolha uma opção:\nObrigado!"
+    ),
+    ("Texto\n{\n  id: 1,\n  title: \"x\"\n}\nFim", "Texto\nFim"),
+    ("Contas: [Vorp Scale] e [Loja]", "Contas: [Vorp Scale] e [Loja]"),
+    ("#promo sem espaço continua", "#promo sem espaço continua"),
+    # Prosa com "id:"/"title:" não é código e fica intacta
+    ("Seu id: 123 confirmado", "Seu id: 123 confirmado"),
+    ("id: 123 confirmado", "id: 123 confirmado"),
+    ("Campaign id: 120200000000\nAd title: Promo\nPaid: sim\nValid: até sexta", "Campaign id: 120200000000\nAd title: Promo\nPaid: sim\nValid: até sexta"),
+    ("Seu id:\nid: 123", "Seu id:\nid: 123"),
+    ('Ok\n[\n  {"id": "1", "title": "Sim"},\n  "id": "2",\n]\nFim', "Ok\nFim"),
+]
+
+
+def test_conversions():
+    for text, expected in CASES:
+        assert format_for_whatsapp(text) == expected, text
+
+
+def test_idempotent():
+    rng = random.Random(42)
+    alphabet = ["*", "**", "`", "[", "]", "(", ")", "#", "## ", "\n", "\n\n\n", " ", "  \n", "id:", "{", "texto", "x"]
+
+    samples = [text for text, _ in CASES]
+    samples += ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 40))) for _ in range(2000)]
+
+    for text in samples:
+        once = format_for_whatsapp(text)
+        assert format_for_whatsapp(once) == once, repr(text)
+        # O caminho rápido só pula texto que a formatação não mudaria
+        if is_formatted(text):
+            assert once == text, repr(text)
+
+    # Texto já formatado é reconhecido (sem reprocessar)
+    assert is_formatted(format_for_whatsapp("## Título\n\n**a** e `b`"))
+
+
+if __name__ == "__main__":
+    test_conversions()
+    test_idempotent()
+    print("✅ Formatador OK")
@@ -0,0 +1,73 @@
+"""
+Teste das retentativas do adaptador da Cloud API (sem reenviar mensagem que pode ter saído)
+"""
+import asyncio
+
+import httpx
+
+import whatsapp_adapters
+from whatsapp_adapters import WhatsAppBusinessAdapter
+from whatsapp_config import WhatsAppBusinessConfig
+
+
+def make_adapter(handler):
+    adapter = WhatsAppBusinessAdapter(WhatsAppBusinessConfig(
+        access_token="token", phone_number_id="123", business_account_id="",
+        webhook_verify_token="", app_secret=None
+    ))
+    adapter._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://cloud-api")
+    adapter._client_loop = asyncio.get_running_loop()
+    return adapter
+
+
+def run(handler, send):
+    async def scenario():
+        adapter = make_adapter(handler)
+        try:
+            return await send(adapter)
+        finally:
+            await adapter.aclose()
+    return asyncio.run(scenario())
+
+
+def failing_then_ok(error):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise error("falha", request=request)
+        return httpx.Response(200, json={"messages": [{"id": "wamid.1"}]})
+    return handler, calls
+
+
+def test_connect_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(whatsapp_adapters, "RETRY_BASE_DELAY", 0.0)
+    for error in (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+        handler, calls = failing_then_ok(error)
+        result = run(handler, lambda adapter: adapter.send_message("5511999990000", "oi"))
+        assert result["status"] == "success", error
+        assert len(calls) == 2
+
+
+def test_read_side_errors_are_not_resent(monkeypatch):
+    monkeypatch.setattr(whatsapp_adapters, "RETRY_BASE_DELAY", 0.0)
+    for error in (httpx.ReadTimeout, httpx.RemoteProtocolError, httpx.ReadError):
+        handler, calls = failing_then_ok(error)
+        result = run(handler, lambda adapter: adapter.send_message("5511999990000", "oi"))
+        assert result["status"] == "unknown", error
+        assert len(calls) == 1
+
+        handler, calls = failing_then_ok(error)
+        result = run(handler, lambda adapter: adapter.send_buttons("5511999990000", "Escolha", {"type": "button"}))
+        assert result["status"] == "unknown" and len(calls) == 1
+
+    # Marcar como lida é idempotente: repete
+    handler, calls = failing_then_ok(httpx.ReadTimeout)
+    result = run(handler, lambda adapter: adapter.mark_as_read("5511999990000", "wamid.x"))
+    assert result["status"] == "success" and len(calls) == 2
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,137 @@
+"""
+Hashed timer wheel para os deadlines de debounce
+
+Um único loop (tick de ~250ms) é dono de todos os deadlines por telefone,
+em vez de um `loop.call_later` + task por mensagem. Reagendar é O(1):
+só atualiza o deadline no dicionário; a entrada é re-hasheada para o slot
+certo quando o slot antigo é visitado.
+"""
+from typing import Callable, Dict, List, Optional, Set
+import asyncio
+import time
+
+from structured_logging import get_logger
+
+logger = get_logger("timer_wheel")
+
+
+class TimerWheel:
+    """Roda de timers com slots por tick"""
+
+    __slots__ = (
+        "_callback", "_tick", "_slots", "_deadlines", "_start", "_cursor",
+        "_fired", "_last_lag", "_max_lag", "_avg_lag", "_task"
+    )
+
+    def __init__(self, callback: Callable[[str], None], tick: float = 0.25, slots: int = 512):
+        self._callback = callback
+        self._tick = tick
+        self._slots: List[Set[str]] = [set() for _ in range(slots)]
+        self._deadlines: Dict[str, float] = {}  # chave -> deadline (time.monotonic)
+        self._start = time.monotonic()
+        self._cursor = 0  # último tick processado
+        self._fired = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._avg_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def _slot_for(self, deadline: float) -> Set[str]:
+        tick_index = int((deadline - self._start) / self._tick) + 1
+        # Deadline já passou: entra no próximo tick
+        tick_index = max(tick_index, self._cursor + 1)
+        return self._slots[tick_index % len(self._slots)]
+
+    def schedule(self, key: str, delay: float) -> None:
+        """Agenda (ou reagenda) o disparo da chave daqui a `delay` segundos"""
+        deadline = time.monotonic() + delay
+        previous = self._deadlines.get(key)
+        self._deadlines[key] = deadline
+
+        # Deadline adiado: a entrada antiga é re-hasheada quando o slot dela chegar
+        if previous is None or deadline < previous:
+            self._slot_for(deadline).add(key)
+
+    def cancel(self, key: str) -> None:
+        """Cancela o timer da chave (a entrada no slot é descartada no tick)"""
+        self._deadlines.pop(key, None)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._deadlines
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def advance(self, now: float = None) -> int:
+        """Processa todos os ticks até `now`. Retorna quantos timers dispararam."""
+        now = time.monotonic() if now is None else now
+        target = int((now - self._start) / self._tick)
+        if target <= self._cursor:
+            return 0
+
+        # Após uma pausa longa basta uma volta completa na roda
+        first = max(self._cursor + 1, target - len(self._slots) + 1)
+        fired = 0
+
+        for tick_index in range(first, target + 1):
+            slot = self._slots[tick_index % len(self._slots)]
+            if not slot:
+                continue
+
+            keys = list(slot)
+            slot.clear()
+            for key in keys:
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    continue  # Cancelado
+                if deadline > now:
+                    # Deadline foi adiado: re-hash para o slot correto
+                    self._slot_for(deadline).add(key)
+                    continue
+
+                del self._deadlines[key]
+                self._record_lag(now - deadline)
+                fired += 1
+                try:
+                    self._callback(key)
+                except Exception as e:
+                    logger.exception("timer_callback_failed", "❌ Erro no callback do timer %s: %s", key, e)
+
+        self._cursor = target
+        return fired
+
+    def _record_lag(self, lag: float) -> None:
+        self._fired += 1
+        self._last_lag = lag
+        self._max_lag = max(self._max_lag, lag)
+        # Média móvel exponencial
+        self._avg_lag = lag if self._fired == 1 else self._avg_lag * 0.9 + lag * 0.1
+
+    async def run(self) -> None:
+        """Loop de ticks (rodar como task em background)"""
+        while True:
+            await asyncio.sleep(self._tick)
+            self.advance()
+
+    def start(self) -> asyncio.Task:
+        """Inicia o loop de ticks no event loop atual"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        """Métricas: timers pendentes e atraso dos disparos em relação ao deadline"""
+        return {
+            "pending": len(self._deadlines),
+            "tick_seconds": self._tick,
+            "slots": len(self._slots),
+            "fired_total": self._fired,
+            "last_lag_ms": round(self._last_lag * 1000, 1),
+            "avg_lag_ms": round(self._avg_lag * 1000, 1),
+            "max_lag_ms": round(self._max_lag * 1000, 1),
+        }
@@ -0,0 +1,373 @@
+"""
+Consumo real de tokens do LLM (usage_metadata) e custo agregado
+
+O calculate_token_cost.py estimava o custo com `len(texto) // 3` e um system
+prompt fixo de 2000 tokens. Aqui o custo vem do que a API devolve em cada
+chamada ao LLM (`AIMessage.usage_metadata`):
+
+- prompt_tokens (inclui os em cache), cached_tokens e completion_tokens por chamada
+- Cada chamada vira um AgentLog `llm_call` com conversation_id e contact_id
+- Por execução do agente, os totais entram no rollup `token_usage_daily`
+  (dia UTC, contato, caminho de ferramentas, modelo): poucas linhas, consulta barata
+
+Como o AgentLogWriter, nada acessa o banco no caminho da requisição: as
+execuções ficam num buffer e uma task grava o rollup a cada TOKEN_USAGE_FLUSH_MS
+(um UPDATE/INSERT por combinação, não por chamada). O contact_id que faltar é
+resolvido pela conversa na hora de gravar.
+
+Relatórios: GET /metrics/cost e `python calculate_token_cost.py [dias]`.
+"""
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import func, insert, select, update
+
+from metrics import LLM_TOKENS
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("token_usage")
+
+TOKEN_USAGE_FLUSH_MS = int(os.getenv("TOKEN_USAGE_FLUSH_MS", "2000"))
+TOKEN_USAGE_MAX_BUFFER = 10000  # com o banco fora do ar, descarta os mais antigos
+USD_TO_BRL = float(os.getenv("USD_TO_BRL", "6.10"))
+
+# Preço em USD por 1M de tokens: (entrada, entrada em cache, saída)
+# Fonte: https://openai.com/api/pricing/
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+NO_TOOLS = "none"  # tool_path das execuções que não chamaram ferramentas
+TOOL_PATH_MAX = 255
+
+
+def model_prices(model: str) -> Tuple[float, float, float]:
+    """Preços do modelo; nomes com data (gpt-4.1-mini-2025-04-14) usam o prefixo mais longo"""
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    matches = [name for name in MODEL_PRICES if model.startswith(name + "-")]
+    return MODEL_PRICES[max(matches, key=len)] if matches else (0.0, 0.0, 0.0)
+
+
+def cost_usd(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    """Custo de uma chamada; modelo sem preço conhecido custa 0 (tokens continuam contados)"""
+    input_price, cached_price, output_price = model_prices(model)
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+@dataclass
+class LLMCall:
+    """Tokens de uma chamada ao LLM"""
+    model: str
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    tool_calls: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_message(cls, message: Any, default_model: str) -> Optional["LLMCall"]:
+        """Lê o usage_metadata de um AIMessage (None se a API não informou)"""
+        usage = getattr(message, "usage_metadata", None)
+        if not usage:
+            return None
+        details = usage.get("input_token_details") or {}
+        metadata = getattr(message, "response_metadata", None) or {}
+        return cls(
+            model=metadata.get("model_name") or default_model,
+            prompt_tokens=usage.get("input_tokens", 0),
+            cached_tokens=details.get("cache_read", 0) or 0,
+            completion_tokens=usage.get("output_tokens", 0),
+            tool_calls=[call["name"] for call in (getattr(message, "tool_calls", None) or [])],
+        )
+
+    @property
+    def cost_usd(self) -> float:
+        return cost_usd(self.model, self.prompt_tokens, self.cached_tokens, self.completion_tokens)
+
+
+@dataclass
+class RunUsage:
+    """Chamadas ao LLM de uma execução do agente"""
+    calls: List[LLMCall] = field(default_factory=list)
+    path: Optional[str] = None  # caminho fixo para chamadas fora do agente (ex.: conversation_summary)
+
+    @property
+    def tool_path(self) -> str:
+        """Ferramentas na ordem em que foram usadas (sem repetir), ex: insights>compare_periods"""
+        if self.path:
+            return self.path
+        seen: List[str] = []
+        for call in self.calls:
+            for name in call.tool_calls:
+                if name not in seen:
+                    seen.append(name)
+        return ">".join(seen)[:TOOL_PATH_MAX] if seen else NO_TOOLS
+
+    def totals(self) -> Dict[str, Any]:
+        return {
+            "llm_calls": len(self.calls),
+            "prompt_tokens": sum(call.prompt_tokens for call in self.calls),
+            "cached_tokens": sum(call.cached_tokens for call in self.calls),
+            "completion_tokens": sum(call.completion_tokens for call in self.calls),
+            "cost_usd": sum(call.cost_usd for call in self.calls),
+        }
+
+
+def usage_from_messages(messages: Iterable[Any], default_model: str) -> RunUsage:
+    """Uso das mensagens geradas numa execução (AIMessages com usage_metadata)"""
+    calls = []
+    for message in messages:
+        call = LLMCall.from_message(message, default_model)
+        if call is not None:
+            calls.append(call)
+    return RunUsage(calls)
+
+
+_COUNTERS = ("runs", "llm_calls", "prompt_tokens", "cached_tokens", "completion_tokens", "cost_usd")
+
+
+def rollup(entries: Iterable[Tuple[str, int, RunUsage]]) -> Dict[Tuple[str, int, str, str], Dict[str, float]]:
+    """
+    Agrega (dia, contact_id, uso) por (dia, contato, caminho de ferramentas, modelo).
+    Uma execução que usou mais de um modelo conta como execução em cada um.
+    """
+    rows: Dict[Tuple[str, int, str, str], Dict[str, float]] = {}
+    for day, contact_id, usage in entries:
+        path = usage.tool_path
+        models_seen = set()
+        for call in usage.calls:
+            row = rows.setdefault((day, contact_id, path, call.model), dict.fromkeys(_COUNTERS, 0))
+            if call.model not in models_seen:
+                models_seen.add(call.model)
+                row["runs"] += 1
+            row["llm_calls"] += 1
+            row["prompt_tokens"] += call.prompt_tokens
+            row["cached_tokens"] += call.cached_tokens
+            row["completion_tokens"] += call.completion_tokens
+            row["cost_usd"] += call.cost_usd
+    return rows
+
+
+class TokenUsageRecorder:
+    """Buffer de uso por execução, gravado no rollup token_usage_daily em background"""
+
+    def __init__(self, session_factory=None, log_writer=None, flush_ms: int = TOKEN_USAGE_FLUSH_MS,
+                 max_buffer: int = TOKEN_USAGE_MAX_BUFFER):
+        if session_factory is None:
+            from database import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+        self._session_factory = session_factory
+        self.log_writer = log_writer
+        self.flush_interval = flush_ms / 1000
+        # (dia, conversation_id, contact_id, uso)
+        self._buffer: Deque[Tuple[str, Optional[int], Optional[int], RunUsage]] = deque(maxlen=max_buffer)
+        self._task: Optional[asyncio.Task] = None
+        self._recorded_runs = 0
+        self._written_rows = 0
+        self._failures = 0
+        self._dropped = 0
+        self._tokens = dict.fromkeys(("prompt_tokens", "cached_tokens", "completion_tokens"), 0)
+        self._cost_usd = 0.0
+
+    def record(self, usage: Optional[RunUsage], conversation_id: Optional[int], contact_id: Optional[int] = None) -> None:
+        """Registra o uso de uma execução (não bloqueia, não acessa o banco)"""
+        if usage is None or not usage.calls:
+            return
+
+        for step, call in enumerate(usage.calls, 1):
+            LLM_TOKENS.inc(call.model, "prompt", amount=call.prompt_tokens)
+            LLM_TOKENS.inc(call.model, "cached", amount=call.cached_tokens)
+            LLM_TOKENS.inc(call.model, "completion", amount=call.completion_tokens)
+            self._tokens["prompt_tokens"] += call.prompt_tokens
+            self._tokens["cached_tokens"] += call.cached_tokens
+            self._tokens["completion_tokens"] += call.completion_tokens
+            self._cost_usd += call.cost_usd
+            if self.log_writer is not None:
+                self.log_writer.record(
+                    "llm_call",
+                    conversation_id,
+                    input_data={"contact_id": contact_id, "model": call.model, "step": step, "tool_calls": call.tool_calls},
+                    output_data={
+                        "prompt_tokens": call.prompt_tokens,
+                        "cached_tokens": call.cached_tokens,
+                        "completion_tokens": call.completion_tokens,
+                        "cost_usd": round(call.cost_usd, 6),
+                    }
+                )
+
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+        self._buffer.append((datetime.utcnow().strftime("%Y-%m-%d"), conversation_id, contact_id, usage))
+        self._recorded_runs += 1
+
+    async def _resolve_contacts(self, db, conversation_ids: set) -> Dict[int, int]:
+        from models import Conversation
+
+        if not conversation_ids:
+            return {}
+        result = await db.execute(
+            select(Conversation.id, Conversation.contact_id).where(Conversation.id.in_(conversation_ids))
+        )
+        return dict(result.all())
+
+    async def flush(self) -> int:
+        """Soma o buffer no rollup (um UPDATE, ou INSERT se a linha não existir, por combinação)"""
+        if not self._buffer:
+            return 0
+
+        from models import TokenUsageDaily
+
+        entries = list(self._buffer)
+        self._buffer.clear()
+        try:
+            async with self._session_factory() as db:
+                missing = {conversation_id for _, conversation_id, contact_id, _ in entries
+                           if contact_id is None and conversation_id is not None}
+                contacts = await self._resolve_contacts(db, missing)
+                rows = rollup(
+                    (day, contact_id or contacts.get(conversation_id) or 0, usage)
+                    for day, conversation_id, contact_id, usage in entries
+                )
+
+                table = TokenUsageDaily
+                for (day, contact_id, tool_path, model), values in rows.items():
+                    key = (
+                        (table.day == day) & (table.contact_id == contact_id)
+                        & (table.tool_path == tool_path) & (table.model == model)
+                    )
+                    result = await db.execute(
+                        update(table).where(key).values(
+                            {name: getattr(table, name) + values[name] for name in _COUNTERS}
+                        )
+                    )
+                    if result.rowcount == 0:
+                        await db.execute(insert(table).values(
+                            day=day, contact_id=contact_id, tool_path=tool_path, model=model, **values
+                        ))
+                await db.commit()
+        except Exception as e:
+            self._failures += 1
+            # Devolve ao buffer para a próxima tentativa (limitado por max_buffer)
+            self._buffer.extendleft(reversed(entries))
+            logger.error("token_usage_flush_failed", "❌ Erro ao gravar consumo de tokens: %s", e)
+            return 0
+
+        self._written_rows += len(rows)
+        return len(rows)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """Inicia a task de gravação no event loop atual"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Para a task e grava o que sobrou (shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered_runs": len(self._buffer),
+            "recorded_runs": self._recorded_runs,
+            "rollup_rows_written": self._written_rows,
+            "failures": self._failures,
+            "dropped": self._dropped,
+            "tokens_since_start": dict(self._tokens),
+            "cost_usd_since_start": round(self._cost_usd, 6),
+        }
+
+
+# ---------------------------------------------------------------------------
+# Relatório (GET /metrics/cost e calculate_token_cost.py)
+# ---------------------------------------------------------------------------
+
+def _totals(row) -> Dict[str, Any]:
+    prompt = int(row.prompt_tokens or 0)
+    cached = int(row.cached_tokens or 0)
+    cost = float(row.cost_usd or 0.0)
+    return {
+        "runs": int(row.runs or 0),
+        "llm_calls": int(row.llm_calls or 0),
+        "prompt_tokens": prompt,
+        "cached_tokens": cached,
+        "completion_tokens": int(row.completion_tokens or 0),
+        "cache_hit_rate": round(cached / prompt, 3) if prompt else 0.0,
+        "cost_usd": round(cost, 4),
+        "cost_brl": round(cost * USD_TO_BRL, 4),
+    }
+
+
+def cost_report(session, days: int = 30, top: int = 20) -> Dict[str, Any]:
+    """
+    Consumo dos últimos `days` dias (incluindo hoje, UTC) por dia, contato e
+    caminho de ferramentas. Recebe uma Session síncrona (no endpoint async,
+    via `AsyncSession.run_sync`).
+    """
+    from models import Contact, TokenUsageDaily as T
+
+    since = (datetime.utcnow() - timedelta(days=max(1, days) - 1)).strftime("%Y-%m-%d")
+    sums = [
+        func.sum(T.runs).label("runs"),
+        func.sum(T.llm_calls).label("llm_calls"),
+        func.sum(T.prompt_tokens).label("prompt_tokens"),
+        func.sum(T.cached_tokens).label("cached_tokens"),
+        func.sum(T.completion_tokens).label("completion_tokens"),
+        func.sum(T.cost_usd).label("cost_usd"),
+    ]
+    in_period = T.day >= since
+
+    total = session.execute(select(*sums).where(in_period)).one()
+    by_day = session.execute(select(T.day, *sums).where(in_period).group_by(T.day).order_by(T.day)).all()
+    by_model = session.execute(select(T.model, *sums).where(in_period).group_by(T.model)).all()
+    by_contact = session.execute(
+        select(T.contact_id, Contact.phone, Contact.name, *sums)
+        .outerjoin(Contact, Contact.id == T.contact_id)
+        .where(in_period)
+        .group_by(T.contact_id, Contact.phone, Contact.name)
+        .order_by(func.sum(T.cost_usd).desc())
+        .limit(top)
+    ).all()
+    by_tool_path = session.execute(
+        select(T.tool_path, *sums).where(in_period)
+        .group_by(T.tool_path).order_by(func.sum(T.cost_usd).desc()).limit(top)
+    ).all()
+
+    summary = _totals(total)
+    runs = summary["runs"]
+    summary["cost_brl_per_run"] = round(summary["cost_brl"] / runs, 5) if runs else 0.0
+    summary["tokens_per_run"] = round((summary["prompt_tokens"] + summary["completion_tokens"]) / runs) if runs else 0
+
+    return {
+        "since": since,
+        "days": days,
+        "usd_to_brl": USD_TO_BRL,
+        "total": summary,
+        "by_day": [{"day": row.day, **_totals(row)} for row in by_day],
+        "by_model": [{"model": row.model, **_totals(row)} for row in by_model],
+        "by_contact": [
+            {"contact_id": row.contact_id or None, "phone": row.phone, "name": row.name, **_totals(row)}
+            for row in by_contact
+        ],
+        "by_tool_path": [{"tool_path": row.tool_path, **_totals(row)} for row in by_tool_path],
+    }
@@ -7,10 +7,15 @@ import asyncio
 from datetime import datetime, timedelta
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from metrics import GRAPH_EVENT_HOOKS
+from structured_logging import get_logger
 
 load_dotenv()
 
+logger = get_logger("tools.compare_periods")
+
 FACEBOOK_ACCESS_TOKEN = os.getenv("FACEBOOK_ACCESS_TOKEN")
+FACEBOOK_GRAPH_URL = os.getenv("FACEBOOK_GRAPH_URL", "https://graph.facebook.com/v21.0").rstrip("/")
 
 
 @tool
@@ -113,8 +118,7 @@ async def compare_campaign_periods(
         p2_start = period2_start.strftime('%Y-%m-%d')
         p2_end = period2_end.strftime('%Y-%m-%d')
         
-        print(f"📅 Período 1: {p1_start} até {p1_end}")
-        print(f"📅 Período 2: {p2_start} até {p2_end}")
+        logger.debug("compare_periods", "📅 Período 1: %s até %s | Período 2: %s até %s", p1_start, p1_end, p2_start, p2_end)
         
         # Construir campos para API
         # Sempre incluir campos base necessários para cálculos
@@ -139,10 +143,8 @@ async def compare_campaign_periods(
         
         fields_str = ','.join(fields)
         
-        print(f"🔧 Fields solicitados: {fields_str}")
-        
         # Buscar dados do período 1
-        url1 = f"https://graph.facebook.com/v21.0/{ad_account_id}/insights"
+        url1 = f"{FACEBOOK_GRAPH_URL}/{ad_account_id}/insights"
         params1 = {
             'access_token': FACEBOOK_ACCESS_TOKEN,
             'level': level,
@@ -151,11 +153,8 @@ async def compare_campaign_periods(
             'limit': 1000
         }
         
-        print(f"🌐 URL: {url1}")
-        print(f"📋 Params: level={level}, time_range={params1['time_range']}, fields={fields_str}")
-        
         # Buscar dados do período 2
-        url2 = f"https://graph.facebook.com/v21.0/{ad_account_id}/insights"
+        url2 = f"{FACEBOOK_GRAPH_URL}/{ad_account_id}/insights"
         params2 = {
             'access_token': FACEBOOK_ACCESS_TOKEN,
             'level': level,
@@ -164,7 +163,7 @@ async def compare_campaign_periods(
             'limit': 1000
         }
         
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(event_hooks=GRAPH_EVENT_HOOKS) as client:
             # Fazer requisições em paralelo
             response1, response2 = await asyncio.gather(
                 client.get(url1, params=params1, timeout=30.0),
@@ -180,8 +179,10 @@ async def compare_campaign_periods(
             data1 = response1.json()
             data2 = response2.json()
         
-        print(f"📦 Período 1: {len(data1.get('data', []))} campanhas encontradas")
-        print(f"📦 Período 2: {len(data2.get('data', []))} campanhas encontradas")
+        logger.debug(
+            "compare_periods_rows", "📦 %d e %d linhas encontradas (level=%s, fields=%s)",
+            len(data1.get("data", [])), len(data2.get("data", [])), level, fields_str
+        )
         
         # Agregar métricas de todos os campaigns/adsets/ads
         def aggregate_metrics(data):
@@ -234,8 +235,7 @@ async def compare_campaign_periods(
         metrics1 = aggregate_metrics(data1)
         metrics2 = aggregate_metrics(data2)
         
-        print(f"📊 Métricas Período 1: {metrics1}")
-        print(f"📊 Métricas Período 2: {metrics2}")
+        logger.debug("compare_periods_metrics", "📊 Métricas: %s vs %s", metrics1, metrics2)
         
         # Verificar se há dados
         if metrics1['spend'] == 0 and metrics2['spend'] == 0:
@@ -304,6 +304,5 @@ async def compare_campaign_periods(
         return "\n".join(response_lines)
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("tool_error", "❌ Erro ao comparar períodos: %s", e, tool="compare_campaign_periods")
         return f"❌ Erro ao comparar períodos: {str(e)}"
@@ -6,10 +6,15 @@ import os
 from datetime import datetime, timedelta
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from metrics import GRAPH_EVENT_HOOKS
+from structured_logging import get_logger
 
 load_dotenv()
 
+logger = get_logger("tools.activity_history")
+
 FACEBOOK_ACCESS_TOKEN = os.getenv("FACEBOOK_ACCESS_TOKEN")
+FACEBOOK_GRAPH_URL = os.getenv("FACEBOOK_GRAPH_URL", "https://graph.facebook.com/v21.0").rstrip("/")
 
 
 @tool
@@ -61,15 +66,15 @@ async def get_activity_history(
         # Determinar qual endpoint usar
         if level == "account":
             # Activity log da conta
-            url = f"https://graph.facebook.com/v21.0/{ad_account_id}/activities"
+            url = f"{FACEBOOK_GRAPH_URL}/{ad_account_id}/activities"
         elif level == "campaign":
             if not entity_id:
                 return "❌ Para level='campaign', você deve fornecer entity_id (ID da campanha)"
-            url = f"https://graph.facebook.com/v21.0/{entity_id}/activities"
+            url = f"{FACEBOOK_GRAPH_URL}/{entity_id}/activities"
         elif level == "adset":
             if not entity_id:
                 return "❌ Para level='adset', você deve fornecer entity_id (ID do conjunto de anúncios)"
-            url = f"https://graph.facebook.com/v21.0/{entity_id}/activities"
+            url = f"{FACEBOOK_GRAPH_URL}/{entity_id}/activities"
         else:
             return f"❌ Level inválido: {level}. Use: account, campaign ou adset"
         
@@ -81,10 +86,9 @@ async def get_activity_history(
             'limit': 100
         }
         
-        print(f"🔍 Buscando atividades: {url}")
-        print(f"📅 Período: {start_date.strftime('%d/%m/%Y')} - {end_date.strftime('%d/%m/%Y')}")
+        logger.debug("activity_history", "🔍 Buscando atividades: %s (%s - %s)", url, start_date, end_date)
         
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(event_hooks=GRAPH_EVENT_HOOKS) as client:
             response = await client.get(url, params=params, timeout=30.0)
             data = response.json()
         
@@ -259,8 +263,7 @@ async def get_activity_history(
         return "\n".join(response_lines)
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("tool_error", "❌ Erro ao buscar histórico: %s", e, tool="get_activity_history")
         return f"❌ Erro ao buscar histórico: {str(e)}"
 
 
@@ -270,14 +273,14 @@ async def _get_activity_via_insights(ad_account_id: str, level: str, entity_id:
     """
     try:
         # Buscar campanhas com seus status e última atualização
-        url = f"https://graph.facebook.com/v21.0/{ad_account_id}/campaigns"
+        url = f"{FACEBOOK_GRAPH_URL}/{ad_account_id}/campaigns"
         params = {
             'access_token': FACEBOOK_ACCESS_TOKEN,
             'fields': 'name,status,updated_time,created_time,daily_budget,lifetime_budget',
             'limit': 100
         }
         
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(event_hooks=GRAPH_EVENT_HOOKS) as client:
             response = await client.get(url, params=params, timeout=30.0)
             data = response.json()
         
@@ -337,6 +340,5 @@ async def _get_activity_via_insights(ad_account_id: str, level: str, entity_id:
         return "\n".join(response_lines)
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("tool_error", "❌ Erro ao buscar atualizações: %s", e, tool="get_activity_history")
         return f"❌ Erro ao buscar atualizações: {str(e)}"
@@ -5,11 +5,16 @@ import httpx
 import os
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from metrics import GRAPH_EVENT_HOOKS
+from structured_logging import get_logger
 from default_accounts import DEFAULT_AD_ACCOUNTS, DEFAULT_ACCOUNT_IDS, get_account_name
 
 load_dotenv()
 
+logger = get_logger("tools.ad_accounts")
+
 FACEBOOK_ACCESS_TOKEN = os.getenv("FACEBOOK_ACCESS_TOKEN")
+FACEBOOK_GRAPH_URL = os.getenv("FACEBOOK_GRAPH_URL", "https://graph.facebook.com/v21.0").rstrip("/")
 
 
 @tool
@@ -39,11 +44,11 @@ async def get_facebook_ad_accounts(business_id: str = None) -> str:
     accounts = []
     
     # Buscar dados reais de cada conta na API do Facebook
-    async with httpx.AsyncClient(timeout=30.0) as client:
+    async with httpx.AsyncClient(timeout=30.0, event_hooks=GRAPH_EVENT_HOOKS) as client:
         for acc_id, info in DEFAULT_AD_ACCOUNTS.items():
             try:
                 # Buscar dados da conta na API
-                url = f"https://graph.facebook.com/v21.0/{info['act_id']}"
+                url = f"{FACEBOOK_GRAPH_URL}/{info['act_id']}"
                 params = {
                     "fields": "name,account_status,currency,balance,amount_spent,spend_cap",
                     "access_token": FACEBOOK_ACCESS_TOKEN
@@ -62,7 +67,10 @@ async def get_facebook_ad_accounts(business_id: str = None) -> str:
                         "spend_cap": int(data.get("spend_cap", 0)) if data.get("spend_cap") else None
                     })
                 else:
-                    print(f"⚠️ Erro ao buscar {info['act_id']}: {response.status_code}")
+                    logger.warning(
+                        "ad_account_failed", "⚠️ Erro ao buscar %s: %s", info["act_id"], response.status_code,
+                        account=info["act_id"], status=response.status_code
+                    )
                     # Fallback para dados básicos
                     accounts.append({
                         "id": info["act_id"],
@@ -74,7 +82,7 @@ async def get_facebook_ad_accounts(business_id: str = None) -> str:
                         "spend_cap": None
                     })
             except Exception as e:
-                print(f"⚠️ Erro ao buscar {info['act_id']}: {e}")
+                logger.warning("ad_account_failed", "⚠️ Erro ao buscar %s: %s", info["act_id"], e, account=info["act_id"])
                 accounts.append({
                     "id": info["act_id"],
                     "name": info["name"],
@@ -6,11 +6,16 @@ import os
 from datetime import datetime, timedelta
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from metrics import GRAPH_EVENT_HOOKS
+from structured_logging import get_logger
 from default_accounts import DEFAULT_ACCOUNT_IDS, DEFAULT_AD_ACCOUNTS, get_account_name
 
 load_dotenv()
 
+logger = get_logger("tools.all_accounts_insights")
+
 FACEBOOK_ACCESS_TOKEN = os.getenv("FACEBOOK_ACCESS_TOKEN")
+FACEBOOK_GRAPH_URL = os.getenv("FACEBOOK_GRAPH_URL", "https://graph.facebook.com/v21.0").rstrip("/")
 
 
 @tool
@@ -40,11 +45,12 @@ async def get_all_accounts_insights(
             seven_days_ago = datetime.now() - timedelta(days=7)
             start_date = seven_days_ago.strftime('%Y-%m-%d')
         
-        print(f"📅 Período de consulta: {start_date} até {end_date}")
-        print(f"📅 Hoje: {datetime.now().strftime('%Y-%m-%d')}")
+        logger.debug(
+            "all_accounts_insights", "📅 Período de consulta: %s até %s (%d contas padrão)",
+            start_date, end_date, len(DEFAULT_ACCOUNT_IDS)
+        )
         
         # 1. SEMPRE usar contas padrão (não buscar da API do Facebook)
-        print(f"📊 Usando contas padrão configuradas ({len(DEFAULT_ACCOUNT_IDS)} contas)")
         accounts = [
             {
                 "id": f"act_{acc_id}",
@@ -71,13 +77,13 @@ async def get_all_accounts_insights(
         total_results_all = 0
         
         # 2. Buscar insights de cada conta
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(event_hooks=GRAPH_EVENT_HOOKS) as client:
             for account in accounts:
                 acc_id = account['id']
                 acc_name = account['name']
                 
                 # Buscar insights
-                url = f"https://graph.facebook.com/v21.0/{acc_id}/insights"
+                url = f"{FACEBOOK_GRAPH_URL}/{acc_id}/insights"
                 params = {
                     "access_token": FACEBOOK_ACCESS_TOKEN,
                     "level": "account",
@@ -89,13 +95,11 @@ async def get_all_accounts_insights(
                     response = await client.get(url, params=params, timeout=30.0)
                     insights_data = response.json()
                     
-                    print(f"📊 Consultando {acc_name} ({acc_id})")
                     if "error" in insights_data:
-                        print(f"   ❌ Erro: {insights_data['error'].get('message', 'Unknown')}")
-                    elif not insights_data.get("data"):
-                        print(f"   ⚠️ Sem dados no período")
-                    else:
-                        print(f"   ✅ Dados encontrados")
+                        logger.warning(
+                            "account_insights_failed", "❌ Erro ao consultar %s (%s): %s",
+                            acc_name, acc_id, insights_data["error"].get("message", "Unknown"), account=acc_id
+                        )
                     
                     if "error" not in insights_data and insights_data.get("data"):
                         # Conta com dados
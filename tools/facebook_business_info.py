@@ -5,10 +5,12 @@ import httpx
 import os
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from metrics import GRAPH_EVENT_HOOKS
 
 load_dotenv()
 
 FACEBOOK_ACCESS_TOKEN = os.getenv("FACEBOOK_ACCESS_TOKEN")
+FACEBOOK_GRAPH_URL = os.getenv("FACEBOOK_GRAPH_URL", "https://graph.facebook.com/v21.0").rstrip("/")
 
 
 @tool
@@ -23,14 +25,14 @@ async def get_facebook_business_info(business_id: str) -> str:
         String com informações do Business Manager
     """
     try:
-        url = f"https://graph.facebook.com/v21.0/{business_id}"
+        url = f"{FACEBOOK_GRAPH_URL}/{business_id}"
         
         params = {
             "access_token": FACEBOOK_ACCESS_TOKEN,
             "fields": "id,name,created_time,link,verification_status"
         }
         
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(event_hooks=GRAPH_EVENT_HOOKS) as client:
             response = await client.get(url, params=params)
             data = response.json()
         
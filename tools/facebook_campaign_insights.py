@@ -6,10 +6,12 @@ import os
 from datetime import datetime, timedelta
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from metrics import GRAPH_EVENT_HOOKS
 
 load_dotenv()
 
 FACEBOOK_ACCESS_TOKEN = os.getenv("FACEBOOK_ACCESS_TOKEN")
+FACEBOOK_GRAPH_URL = os.getenv("FACEBOOK_GRAPH_URL", "https://graph.facebook.com/v21.0").rstrip("/")
 
 
 @tool
@@ -101,7 +103,7 @@ async def get_campaign_insights(
         if additional_metrics:
             base_fields += "," + ",".join(additional_metrics)
         
-        url = f"https://graph.facebook.com/v21.0/{ad_account_id}/insights"
+        url = f"{FACEBOOK_GRAPH_URL}/{ad_account_id}/insights"
         
         params = {
             "access_token": FACEBOOK_ACCESS_TOKEN,
@@ -111,7 +113,7 @@ async def get_campaign_insights(
             "limit": 100
         }
         
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(event_hooks=GRAPH_EVENT_HOOKS) as client:
             response = await client.get(url, params=params, timeout=30.0)
             data = response.json()
         
@@ -0,0 +1,46 @@
+"""
+Contexto de interação por execução do agente
+
+As tools de botões/lista guardam o payload interativo aqui, num objeto
+criado por execução do agente e acessado via contextvar. Assim, várias
+conversas podem rodar em paralelo sem uma pegar os botões da outra.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional
+
+
+@dataclass
+class InteractionContext:
+    """Payloads interativos preparados durante uma execução do agente"""
+    buttons: Optional[Dict[str, Any]] = None
+    list_data: Optional[Dict[str, Any]] = None
+
+
+_current_interaction: ContextVar[Optional[InteractionContext]] = ContextVar(
+    "current_interaction", default=None
+)
+
+
+@contextmanager
+def interaction_scope() -> Iterator[InteractionContext]:
+    """Cria o contexto de interação de uma execução do agente"""
+    context = InteractionContext()
+    token = _current_interaction.set(context)
+    try:
+        yield context
+    finally:
+        _current_interaction.reset(token)
+
+
+def get_interaction_context() -> InteractionContext:
+    """
+    Contexto da execução atual. Fora de uma execução (ex: tool chamada
+    diretamente em teste) cria um contexto avulso.
+    """
+    context = _current_interaction.get()
+    if context is None:
+        context = InteractionContext()
+        _current_interaction.set(context)
+    return context
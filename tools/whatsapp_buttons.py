@@ -4,8 +4,11 @@ Tool para enviar botões interativos no WhatsApp (máximo 3 botões)
 from langchain_core.tools import tool
 from typing import List, Dict
 
-# Variável global para armazenar os botões pendentes
-pending_buttons = None
+from tools.interaction_context import get_interaction_context
+from structured_logging import get_logger
+
+logger = get_logger("tools.whatsapp_buttons")
+
 
 @tool
 async def send_whatsapp_buttons(
@@ -43,8 +46,6 @@ async def send_whatsapp_buttons(
     Returns:
         Confirmação de que os botões foram preparados
     """
-    global pending_buttons
-    
     # Validações
     if not buttons or len(buttons) > 3:
         return "❌ Erro: Você deve fornecer de 1 a 3 botões (máximo 3)"
@@ -60,13 +61,12 @@ async def send_whatsapp_buttons(
         if len(btn["title"]) > 20:
             return f"❌ Erro: Botão '{btn['title']}' tem mais de 20 caracteres (máx: 20)"
     
-    print(f"🔘 FERRAMENTA send_whatsapp_buttons CHAMADA!")
-    print(f"   body_text: {body_text}")
-    print(f"   buttons: {buttons}")
-    if footer_text:
-        print(f"   footer_text: {footer_text}")
+    logger.debug(
+        "tool_buttons", "🔘 send_whatsapp_buttons: body_text=%r buttons=%r footer_text=%r",
+        body_text, buttons, footer_text
+    )
     
-    # Armazenar na variável global
+    # Armazenar no contexto da execução atual
     pending_buttons = {
         "type": "button",
         "body": {"text": body_text},
@@ -87,5 +87,7 @@ async def send_whatsapp_buttons(
     if footer_text:
         pending_buttons["footer"] = {"text": footer_text}
     
+    get_interaction_context().buttons = pending_buttons
+    
     num_buttons = len(buttons)
     return f"✅ {num_buttons} botão(ões) preparado(s) para envio. Os botões serão anexados à mensagem."
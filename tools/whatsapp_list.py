@@ -4,10 +4,10 @@ Tool para enviar listas interativas no WhatsApp
 from typing import List, Dict
 from langchain_core.tools import tool
 from whatsapp_tools import create_simple_list, format_list_as_text
+from tools.interaction_context import get_interaction_context
+from structured_logging import get_logger
 
-
-# Armazenar lista pendente globalmente
-pending_list = {"phone": None, "list_data": None}
+logger = get_logger("tools.whatsapp_list")
 
 
 @tool
@@ -40,10 +40,10 @@ async def send_whatsapp_list(
             ]
         )
     """
-    print(f"🔧 FERRAMENTA send_whatsapp_list CHAMADA!")
-    print(f"   body_text: {body_text}")
-    print(f"   button_text: {button_text}")
-    print(f"   options: {options}")
+    logger.debug(
+        "tool_list", "🔧 send_whatsapp_list: body_text=%r button_text=%r options=%r",
+        body_text, button_text, options
+    )
     
     try:
         # Validar número de opções
@@ -63,9 +63,8 @@ async def send_whatsapp_list(
         # Criar lista
         list_data = create_simple_list(body_text, button_text, options)
         
-        # Armazenar para envio posterior (será enviada pelo main.py)
-        global pending_list
-        pending_list["list_data"] = list_data
+        # Armazenar no contexto da execução (será enviada pelo main.py)
+        get_interaction_context().list_data = list_data
         
         # Retornar versão em texto como fallback
         text_version = format_list_as_text(list_data)
@@ -74,11 +73,3 @@ async def send_whatsapp_list(
         
     except Exception as e:
         return f"❌ Erro ao criar lista: {str(e)}"
-
-
-def get_pending_list() -> Dict:
-    """Retorna e limpa lista pendente"""
-    global pending_list
-    data = pending_list.copy()
-    pending_list = {"phone": None, "list_data": None}
-    return data
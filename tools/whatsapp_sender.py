@@ -3,9 +3,9 @@ Tool para enviar mensagens via WhatsApp usando Evolution API
 """
 import httpx
 import os
-import re
 from langchain_core.tools import tool
 from dotenv import load_dotenv
+from whatsapp_formatter import format_for_whatsapp
 
 load_dotenv()
 
@@ -14,25 +14,6 @@ EVOLUTION_API_KEY = os.getenv("EVOLUTION_API_KEY")
 EVOLUTION_INSTANCE = os.getenv("EVOLUTION_INSTANCE")
 
 
-def format_message_for_whatsapp(content: str) -> str:
-    """
-    Formata mensagem removendo Markdown e convertendo para formatação WhatsApp.
-    """
-    # Converter Markdown headers ## -> negrito
-    content = re.sub(r'###?\s+(.*?)(?:\n|$)', r'*\1*\n', content)
-    
-    # Markdown bold ** -> WhatsApp bold *
-    content = re.sub(r'\*\*(.*?)\*\*', r'*\1*', content)
-    
-    # Markdown code ` -> remover
-    content = re.sub(r'`(.*?)`', r'\1', content)
-    
-    # Remover links markdown [texto](url) -> texto (url)
-    content = re.sub(r'\[(.*?)\]\((.*?)\)', r'\1 (\2)', content)
-    
-    return content.strip()
-
-
 @tool
 async def send_whatsapp_message(phone: str, message: str) -> str:
     """
@@ -48,7 +29,7 @@ async def send_whatsapp_message(phone: str, message: str) -> str:
     """
     try:
         # OBRIGATÓRIO: Formatar mensagem para WhatsApp
-        formatted_message = format_message_for_whatsapp(message)
+        formatted_message = format_for_whatsapp(message)
         
         base_url = EVOLUTION_API_URL.replace('/manager', '')
         url = f"{base_url}/message/sendText/{EVOLUTION_INSTANCE}"
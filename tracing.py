@@ -0,0 +1,412 @@
+"""
+Tracing por turno do usuário (webhook -> debounce -> agente -> envio)
+
+Cada turno ganha um trace_id no recebimento do webhook; mensagens que chegam
+durante o debounce entram no mesmo trace, que segue para o processamento da
+pilha e para o envio da resposta. Spans registrados:
+
+- `webhook` (uma por mensagem recebida) e `debounce_wait`
+- `context_load` (histórico da conversa: memória ou banco)
+- `agent_run` com um span por nó do LangGraph (`agent`, `tools`, `format_whatsapp`)
+- `graph_api` por requisição à Graph API (dentro do nó `tools`)
+- `reply_send` e `whatsapp_send` por tentativa de envio à Cloud API
+
+Os traces ficam num ring buffer em memória (TRACE_BUFFER_SIZE, padrão 500) e
+podem ser vistos em GET /debug/traces/{trace_id}. Com OTEL_EXPORTER_OTLP_ENDPOINT
+configurado, os spans também são enviados em lote no formato OTLP/HTTP JSON
+(Jaeger, Tempo, collector do OpenTelemetry...), sem depender do SDK.
+
+O trace atual fica num ContextVar: sem trace ativo, `span()` não faz nada.
+Com backend de empilhamento compartilhado, se outro worker processar a pilha
+ele abre um trace novo para o processamento.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import functools
+import os
+import random
+import time
+import uuid
+
+import httpx
+from dotenv import load_dotenv
+
+from metrics import graph_endpoint
+from structured_logging import get_logger
+
+load_dotenv()
+
+logger = get_logger("tracing")
+
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "200"))  # por trace (loops de ferramentas)
+# Turno aberto (aguardando o debounce) esquecido depois de TRACE_TURN_TTL_SECONDS
+TRACE_TURN_TTL_SECONDS = float(os.getenv("TRACE_TURN_TTL_SECONDS", "600"))
+
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "").rstrip("/")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "agente-campanhas")
+TRACE_EXPORT_INTERVAL_MS = int(os.getenv("TRACE_EXPORT_INTERVAL_MS", "2000"))
+TRACE_EXPORT_MAX_QUEUE = 10000
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start: float  # epoch em segundos
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end is None else round((self.end - self.start) * 1000, 1)
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "offset_ms": round((self.start - origin) * 1000, 1),
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    name: str
+    started_at: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    spans: List[Span] = field(default_factory=list)
+    dropped_spans: int = 0
+
+    @property
+    def ended_at(self) -> float:
+        ends = [span.end for span in self.spans if span.end is not None]
+        return max(ends) if ends else self.started_at
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "duration_ms": round((self.ended_at - self.started_at) * 1000, 1),
+            "spans": len(self.spans),
+            "attributes": self.attributes,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        spans = sorted(self.spans, key=lambda span: span.start)
+        return {
+            **self.summary(),
+            "dropped_spans": self.dropped_spans,
+            "span_list": [span.to_dict(self.started_at) for span in spans],
+        }
+
+
+def _new_span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+# (trace, id do span pai) da execução atual
+_current: ContextVar[Optional[Tuple[Trace, Optional[str]]]] = ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    """Cria traces/spans e guarda os últimos TRACE_BUFFER_SIZE traces"""
+
+    def __init__(self, max_traces: int = TRACE_BUFFER_SIZE, max_spans: int = TRACE_MAX_SPANS, exporter=None):
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self.exporter = exporter
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._turns: Dict[str, Tuple[Trace, float]] = {}  # chave do turno (telefone) -> trace aberto
+        self._started = 0
+
+    # Traces ---------------------------------------------------------------
+
+    def start_trace(self, name: str, **attributes: Any) -> Trace:
+        trace = Trace(uuid.uuid4().hex, name, time.time(), attributes)
+        self._traces[trace.trace_id] = trace
+        self._started += 1
+        while len(self._traces) > self.max_traces:
+            self._traces.popitem(last=False)
+        return trace
+
+    def turn(self, key: str, **attributes: Any) -> Trace:
+        """Trace do turno aberto para a chave (telefone) ou um novo"""
+        entry = self._turns.get(key)
+        now = time.monotonic()
+        if entry is not None and now - entry[1] < TRACE_TURN_TTL_SECONDS:
+            trace = entry[0]
+        else:
+            trace = self.start_trace("turn", **attributes)
+        self._turns[key] = (trace, now)
+        if len(self._turns) > self.max_traces:
+            # Turnos que nunca foram processados (ex: pilha tratada por outro worker)
+            self._turns = {k: v for k, v in self._turns.items() if now - v[1] < TRACE_TURN_TTL_SECONDS}
+        return trace
+
+    def take_turn(self, key: str, **attributes: Any) -> Trace:
+        """Fecha o turno da chave para processamento (abre um trace se não houver)"""
+        entry = self._turns.pop(key, None)
+        if entry is not None and time.monotonic() - entry[1] < TRACE_TURN_TTL_SECONDS:
+            entry[0].attributes.update(attributes)
+            return entry[0]
+        return self.start_trace("turn", **attributes)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        return self._traces.get(trace_id)
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        traces = list(self._traces.values())[-limit:]
+        return [trace.summary() for trace in reversed(traces)]
+
+    # Contexto -------------------------------------------------------------
+
+    @staticmethod
+    def current() -> Optional[Trace]:
+        current = _current.get()
+        return current[0] if current else None
+
+    def attach(self, trace: Optional[Trace]):
+        """Torna o trace atual (retorna o token para detach)"""
+        return _current.set((trace, None) if trace is not None else None)
+
+    def detach(self, token) -> None:
+        _current.reset(token)
+
+    @contextmanager
+    def activate(self, trace: Optional[Trace]) -> Iterator[None]:
+        token = self.attach(trace)
+        try:
+            yield
+        finally:
+            self.detach(token)
+
+    # Spans ----------------------------------------------------------------
+
+    def _add(self, trace: Trace, span: Span) -> bool:
+        if len(trace.spans) >= self.max_spans:
+            trace.dropped_spans += 1
+            return False
+        trace.spans.append(span)
+        if span.start < trace.started_at:
+            # Spans medidos antes de o trace existir (ex: o webhook que o abriu)
+            trace.started_at = span.start
+        return True
+
+    def _finish(self, span: Span) -> None:
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        """Span filho do span atual (não faz nada sem trace ativo)"""
+        current = _current.get()
+        if current is None:
+            yield None
+            return
+
+        trace, parent_id = current
+        span = Span(trace.trace_id, _new_span_id(), parent_id, name, time.time(), attributes=attributes)
+        recorded = self._add(trace, span)
+        token = _current.set((trace, span.span_id))
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            span.end = time.time()
+            if recorded:
+                self._finish(span)
+
+    def add_span(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        trace: Optional[Trace] = None,
+        error: Optional[str] = None,
+        **attributes: Any
+    ) -> Optional[Span]:
+        """Registra um span já medido (epoch em segundos) no trace informado ou no atual"""
+        parent_id = None
+        if trace is None:
+            current = _current.get()
+            if current is None:
+                return None
+            trace, parent_id = current
+
+        span = Span(trace.trace_id, _new_span_id(), parent_id, name, start, end, attributes, error)
+        if self._add(trace, span):
+            self._finish(span)
+        return span
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "traces": len(self._traces),
+            "max_traces": self.max_traces,
+            "started_total": self._started,
+            "open_turns": len(self._turns),
+            "exporter": self.exporter.stats() if self.exporter else None,
+        }
+
+
+def traced_node(name: str, func):
+    """Envolve um nó do LangGraph (síncrono ou assíncrono) num span com o nome do nó"""
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_node(state):
+            with tracer.span(name):
+                return await func(state)
+        return async_node
+
+    @functools.wraps(func)
+    def node(state):
+        with tracer.span(name):
+            return func(state)
+    return node
+
+
+# ---------------------------------------------------------------------------
+# Exportador OTLP/HTTP (JSON)
+# ---------------------------------------------------------------------------
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span: Span) -> Dict[str, Any]:
+    return {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id or "",
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(int(span.start * 1e9)),
+        "endTimeUnixNano": str(int((span.end or span.start) * 1e9)),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+
+
+class OTLPExporter:
+    """Envia spans finalizados em lote para {endpoint}/v1/traces (OTLP/HTTP JSON)"""
+
+    def __init__(self, endpoint: str, service_name: str = OTEL_SERVICE_NAME, interval_ms: int = TRACE_EXPORT_INTERVAL_MS):
+        self.url = f"{endpoint}/v1/traces"
+        self.service_name = service_name
+        self.interval = interval_ms / 1000
+        self._pending: List[Span] = []
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._exported = 0
+        self._failures = 0
+        self._dropped = 0
+
+    def export(self, span: Span) -> None:
+        if len(self._pending) >= TRACE_EXPORT_MAX_QUEUE:
+            self._dropped += 1
+            return
+        self._pending.append(span)
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": self.service_name}, "spans": [_otlp_span(s) for s in spans]}],
+            }]
+        }
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        spans, self._pending = self._pending, []
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10.0)
+        try:
+            response = await self._client.post(self.url, json=self.payload(spans))
+            response.raise_for_status()
+        except Exception as e:
+            self._failures += 1
+            logger.warning("trace_export_failed", "⚠️ Falha ao exportar %d span(s): %s", len(spans), e)
+            return 0
+        self._exported += len(spans)
+        return len(spans)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.url,
+            "pending": len(self._pending),
+            "exported_total": self._exported,
+            "failures": self._failures,
+            "dropped": self._dropped,
+        }
+
+
+tracer = Tracer(exporter=OTLPExporter(OTEL_EXPORTER_OTLP_ENDPOINT) if OTEL_EXPORTER_OTLP_ENDPOINT else None)
+
+
+# Ganchos do httpx para a Graph API (spans `graph_api` dentro do nó `tools`)
+
+async def _graph_request_hook(request) -> None:
+    if _current.get() is not None:
+        request.extensions["trace_start"] = time.time()
+
+
+async def _graph_response_hook(response) -> None:
+    start = response.request.extensions.get("trace_start")
+    if start is None:
+        return
+    tracer.add_span(
+        "graph_api", start, time.time(),
+        endpoint=graph_endpoint(response.request.url),
+        status=response.status_code
+    )
+
+
+def instrument_graph_hooks(hooks: Dict[str, list]) -> None:
+    """Acrescenta os ganchos de tracing aos event hooks das ferramentas da Graph API"""
+    if _graph_request_hook not in hooks["request"]:
+        hooks["request"].append(_graph_request_hook)
+        hooks["response"].append(_graph_response_hook)
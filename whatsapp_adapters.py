@@ -2,14 +2,97 @@
 Adaptador para WhatsApp Business API (Oficial)
 """
 from abc import ABC, abstractmethod
+from email.utils import parsedate_to_datetime
 from typing import Dict, Any, Optional
+import asyncio
+import os
+import random
+import time
 import httpx
 from whatsapp_config import WhatsAppBusinessConfig
+from metrics import WHATSAPP_RESPONSES, WHATSAPP_SEND_SECONDS
+from structured_logging import get_logger
+from tracing import tracer
+
+logger = get_logger("whatsapp")
+
+# Retentativas para falhas transitórias da Cloud API
+WHATSAPP_MAX_RETRIES = int(os.getenv("WHATSAPP_MAX_RETRIES", "3"))
+# Base da Cloud API (WHATSAPP_API_URL troca pelo simulador local nos benchmarks)
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL", "https://graph.facebook.com/v21.0").rstrip("/")
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Falhas antes de a requisição sair (seguro reenviar). Timeout de leitura ou conexão
+# caída no meio podem acontecer depois de a Meta aceitar a mensagem: reenviar duplicaria.
+RETRY_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRY_BASE_DELAY = 0.5  # segundos
+RETRY_MAX_DELAY = 30.0  # teto para backoff e Retry-After
+
+
+class EndpointStats:
+    """Contadores de latência e falhas por endpoint"""
+    
+    __slots__ = ("requests", "failures", "retries", "status_codes", "latency_ms_total", "latency_ms_max")
+    
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.status_codes: Dict[str, int] = {}
+        self.latency_ms_total = 0.0
+        self.latency_ms_max = 0.0
+    
+    def record(self, status_code: Optional[int], latency_ms: float):
+        self.requests += 1
+        key = str(status_code) if status_code is not None else "transport_error"
+        self.status_codes[key] = self.status_codes.get(key, 0) + 1
+        self.latency_ms_total += latency_ms
+        self.latency_ms_max = max(self.latency_ms_max, latency_ms)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        avg = self.latency_ms_total / self.requests if self.requests else 0.0
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "status_codes": dict(self.status_codes),
+            "latency_ms_avg": round(avg, 1),
+            "latency_ms_max": round(self.latency_ms_max, 1),
+        }
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """Lê o header Retry-After (segundos ou data HTTP)"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def send_error_result(error: Exception) -> Dict[str, Any]:
+    """
+    Resultado de um envio que levantou exceção. Erro de transporte depois de a
+    requisição sair vira status "unknown": a Meta pode ter entregue, então quem
+    chama não deve reenviar nem cair no fallback.
+    """
+    if isinstance(error, httpx.TransportError) and not isinstance(error, RETRY_TRANSPORT_ERRORS):
+        return {"status": "unknown", "error": f"{type(error).__name__}: {error}"}
+    return {"status": "error", "error": str(error)}
 
 
 class WhatsAppAdapter(ABC):
     """Interface base para adaptador WhatsApp"""
     
+    # Texto livre só é entregue dentro da janela de 24h do atendimento: campanhas
+    # precisam de template aprovado (send_template)
+    requires_template = False
+    
     @abstractmethod
     async def send_message(self, phone: str, message: str) -> Dict[str, Any]:
         """Envia mensagem de texto"""
@@ -34,24 +117,119 @@ class WhatsAppAdapter(ABC):
     def parse_webhook(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Parse webhook data para formato padronizado"""
         pass
+    
+    async def aclose(self) -> None:
+        """Libera conexões abertas pelo adaptador"""
+        pass
 
 
 class WhatsAppBusinessAdapter(WhatsAppAdapter):
     """Adaptador para WhatsApp Business API"""
     
+    requires_template = True
+    
     def __init__(self, config: WhatsAppBusinessConfig):
         self.config = config
-        self.base_url = "https://graph.facebook.com/v21.0"
+        self.base_url = WHATSAPP_API_URL
+        self.max_retries = WHATSAPP_MAX_RETRIES
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+        self._stats: Dict[str, EndpointStats] = {}
     
-    async def send_message(self, phone: str, message: str) -> Dict[str, Any]:
-        url = f"{self.base_url}/{self.config.phone_number_id}/messages"
+    def _get_client(self) -> httpx.AsyncClient:
+        """Cliente HTTP de longa duração (pool de conexões keep-alive)"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.config.access_token}"
+                },
+                timeout=30.0,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0)
+            )
+            self._client_loop = loop
+        return self._client
+    
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    async def _post(
+        self, endpoint: str, payload: Dict[str, Any], timeout: float = 30.0, idempotent: bool = False
+    ) -> httpx.Response:
+        """
+        POST em /{phone_number_id}/messages com retentativa para 429/5xx e erros
+        de transporte (backoff exponencial com jitter, respeitando Retry-After).
+
+        Envio de mensagem não é idempotente: só erros de conexão (RETRY_TRANSPORT_ERRORS)
+        são repetidos; os demais sobem na hora. `idempotent=True` (marcar como lida)
+        repete qualquer erro de transporte.
+        """
+        stats = self._stats.setdefault(endpoint, EndpointStats())
+        path = f"/{self.config.phone_number_id}/messages"
+        attempt = 0
         
+        while True:
+            start = time.perf_counter()
+            started_at = time.time()
+            try:
+                response = await self._get_client().post(path, json=payload, timeout=timeout)
+            except httpx.TransportError as e:
+                self._observe(stats, endpoint, None, start, started_at, attempt, error=type(e).__name__)
+                retryable = idempotent or isinstance(e, RETRY_TRANSPORT_ERRORS)
+                if not retryable or attempt >= self.max_retries:
+                    stats.failures += 1
+                    raise
+                delay = None
+            else:
+                self._observe(stats, endpoint, response.status_code, start, started_at, attempt)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    if response.status_code not in (200, 201):
+                        stats.failures += 1
+                    return response
+                delay = retry_after_seconds(response)
+            
+            # Backoff exponencial com jitter ("full jitter")
+            backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+            delay = min(max(delay or 0.0, backoff), RETRY_MAX_DELAY)
+            attempt += 1
+            stats.retries += 1
+            await asyncio.sleep(delay)
+    
+    @staticmethod
+    def _observe(
+        stats: EndpointStats,
+        endpoint: str,
+        status_code: Optional[int],
+        start: float,
+        started_at: float,
+        attempt: int,
+        error: Optional[str] = None
+    ) -> None:
+        """Registra uma tentativa em /debug/whatsapp, /metrics e no trace do turno"""
+        elapsed = time.perf_counter() - start
+        stats.record(status_code, elapsed * 1000)
+        WHATSAPP_SEND_SECONDS.observe(elapsed, endpoint)
+        WHATSAPP_RESPONSES.inc(endpoint, str(status_code) if status_code is not None else "error")
+        tracer.add_span(
+            "whatsapp_send", started_at, started_at + elapsed,
+            error=error, endpoint=endpoint, attempt=attempt, status=status_code or 0
+        )
+    
+    def stats(self) -> Dict[str, Any]:
+        """Latência e falhas por endpoint"""
+        return {endpoint: stats.to_dict() for endpoint, stats in self._stats.items()}
+    
+    async def send_message(self, phone: str, message: str) -> Dict[str, Any]:
         # Limpar número (remover @s.whatsapp.net se vier)
         clean_phone = phone.replace("@s.whatsapp.net", "")
         
         # Validar mensagem não vazia
         if not message or not message.strip():
-            print(f"⚠️ Tentativa de enviar mensagem vazia para {clean_phone}")
+            logger.warning("empty_message", "⚠️ Tentativa de enviar mensagem vazia para %s", clean_phone, phone=clean_phone)
             return {
                 "status": "error",
                 "error": "Message body is empty"
@@ -69,33 +247,32 @@ class WhatsAppBusinessAdapter(WhatsAppAdapter):
             }
         }
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.config.access_token}"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
+        try:
+            response = await self._post("messages.text", payload)
             result = response.json()
-            
-            # Log de erro detalhado
-            if response.status_code != 200:
-                print(f"❌ Erro ao enviar mensagem: Status {response.status_code}")
-                print(f"❌ Resposta: {result}")
-                return {
-                    "status": "error",
-                    "error": result
-                }
-            
+        except Exception as e:
+            logger.error("send_failed", "❌ Erro ao enviar mensagem: %s", e, phone=clean_phone)
+            return send_error_result(e)
+        
+        # Log de erro detalhado
+        if response.status_code != 200:
+            logger.error(
+                "send_failed", "❌ Erro ao enviar mensagem: status %s", response.status_code,
+                phone=clean_phone, status=response.status_code
+            )
+            logger.debug("send_failed_response", "❌ Resposta: %s", result)
             return {
-                "status": "success",
-                "data": result
+                "status": "error",
+                "error": result
             }
+        
+        return {
+            "status": "success",
+            "data": result
+        }
     
     async def send_list(self, phone: str, list_data: Dict[str, Any]) -> Dict[str, Any]:
         """Envia lista interativa via WhatsApp Business API"""
-        url = f"{self.base_url}/{self.config.phone_number_id}/messages"
-        
         clean_phone = phone.replace("@s.whatsapp.net", "")
         
         # Converter formato para WhatsApp Business API
@@ -130,25 +307,17 @@ class WhatsAppBusinessAdapter(WhatsAppAdapter):
                 "text": list_data["footer"]
             }
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.config.access_token}"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-                if response.status_code in [200, 201]:
-                    return {"status": "success", "response": response.json()}
-                else:
-                    return {"status": "error", "error": response.json()}
-            except Exception as e:
-                return {"status": "error", "error": str(e)}
+        try:
+            response = await self._post("messages.list", payload)
+            if response.status_code in [200, 201]:
+                return {"status": "success", "response": response.json()}
+            else:
+                return {"status": "error", "error": response.json()}
+        except Exception as e:
+            return send_error_result(e)
     
     async def send_buttons(self, phone: str, body_text: str, buttons_data: Dict[str, Any]) -> Dict[str, Any]:
         """Envia botões interativos via WhatsApp Business API"""
-        url = f"{self.base_url}/{self.config.phone_number_id}/messages"
-        
         clean_phone = phone.replace("@s.whatsapp.net", "")
         
         # Formato WhatsApp Business API para botões
@@ -165,21 +334,48 @@ class WhatsAppBusinessAdapter(WhatsAppAdapter):
         if "body" not in payload["interactive"]:
             payload["interactive"]["body"] = {"text": body_text}
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.config.access_token}"
+        try:
+            response = await self._post("messages.buttons", payload)
+            if response.status_code in [200, 201]:
+                return {"status": "success", "response": response.json()}
+            else:
+                return {"status": "error", "error": response.json()}
+        except Exception as e:
+            return send_error_result(e)
+
+    async def send_template(
+        self, phone: str, name: str, language: str, components: Optional[list] = None
+    ) -> Dict[str, Any]:
+        """
+        Envia um template aprovado (única mensagem aceita fora da janela de 24h)
+        https://developers.facebook.com/docs/whatsapp/cloud-api/guides/send-message-templates
+        """
+        clean_phone = phone.replace("@s.whatsapp.net", "")
+
+        template: Dict[str, Any] = {"name": name, "language": {"code": language}}
+        if components:
+            template["components"] = components
+        payload = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": clean_phone,
+            "type": "template",
+            "template": template
         }
-        
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-                if response.status_code in [200, 201]:
-                    return {"status": "success", "response": response.json()}
-                else:
-                    return {"status": "error", "error": response.json()}
-            except Exception as e:
-                return {"status": "error", "error": str(e)}
-    
+
+        try:
+            response = await self._post("messages.template", payload)
+            if response.status_code in [200, 201]:
+                return {"status": "success", "response": response.json()}
+            else:
+                logger.error(
+                    "send_failed", "❌ Erro ao enviar template %s: status %s", name, response.status_code,
+                    phone=clean_phone, status=response.status_code
+                )
+                return {"status": "error", "error": response.json()}
+        except Exception as e:
+            return send_error_result(e)
+
     async def send_presence(self, phone: str, presence: str) -> Dict[str, Any]:
         """
         WhatsApp Business API não suporta envio de presence diretamente
@@ -188,53 +384,45 @@ class WhatsAppBusinessAdapter(WhatsAppAdapter):
         return {"status": "not_supported", "message": "WhatsApp Business API doesn't support presence"}
     
     async def mark_as_read(self, phone: str, message_id: str) -> Dict[str, Any]:
-        url = f"{self.base_url}/{self.config.phone_number_id}/messages"
-        
         payload = {
             "messaging_product": "whatsapp",
             "status": "read",
             "message_id": message_id
         }
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.config.access_token}"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=10.0)
-            return response.json()
+        try:
+            response = await self._post("messages.read", payload, timeout=10.0, idempotent=True)
+            if response.status_code in [200, 201]:
+                return {"status": "success", "data": response.json()}
+            return {"status": "error", "error": response.json()}
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
     
     def parse_webhook(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Parse WhatsApp Business API webhook"""
         # Webhook format: https://developers.facebook.com/docs/whatsapp/cloud-api/webhooks/components
         
-        print(f"🔍 WhatsApp Business parse_webhook - data: {data}")
-        
         # Verificar se é um evento válido do WhatsApp Business
         if data.get("object") != "whatsapp_business_account":
-            print(f"❌ Object não é whatsapp_business_account: {data.get('object')}")
+            logger.debug("webhook_unknown_object", "Object não é whatsapp_business_account: %s", data.get("object"))
             return None
         
         entries = data.get("entry", [])
         if not entries:
-            print("❌ Sem entries no webhook")
+            logger.debug("webhook_no_entries", "Sem entries no webhook")
             return None
             
         entry = entries[0]
         changes = entry.get("changes", [])
         if not changes:
-            print("❌ Sem changes no webhook")
+            logger.debug("webhook_no_changes", "Sem changes no webhook")
             return None
             
         change = changes[0]
         value = change.get("value", {})
         
-        print(f"🔍 value: {value}")
-        
         # Mensagens recebidas
         messages = value.get("messages", [])
-        print(f"🔍 messages: {messages}")
         
         if messages:
             msg = messages[0]
@@ -275,14 +463,18 @@ class WhatsAppBusinessAdapter(WhatsAppAdapter):
         # Status updates (delivered, read, etc)
         statuses = value.get("statuses", [])
         if statuses:
-            status = statuses[0]
-            return {
-                "type": "status",
-                "message_id": status.get("id"),
-                "status": status.get("status"),  # sent, delivered, read, failed
-                "phone": f"{status.get('recipient_id')}@s.whatsapp.net",
-                "timestamp": status.get("timestamp")
-            }
+            parsed_statuses = [
+                {
+                    "message_id": status.get("id"),
+                    "status": status.get("status"),  # sent, delivered, read, failed
+                    "phone": f"{status.get('recipient_id')}@s.whatsapp.net",
+                    "timestamp": status.get("timestamp"),
+                    "errors": status.get("errors")
+                }
+                for status in statuses
+            ]
+            # Campos do primeiro status no topo (compatibilidade) + lista completa
+            return {"type": "status", **parsed_statuses[0], "statuses": parsed_statuses}
         
         return None
 
@@ -0,0 +1,102 @@
+"""
+Formatação de texto para WhatsApp (Markdown -> WhatsApp) em uma passada
+
+Substitui as três cópias do formatador (grafo do agente, main e a tool de envio),
+que rodavam 5-10 `re.sub` seguidos sobre o texto inteiro com padrões recompilados.
+Aqui os padrões são compilados uma vez e o texto é percorrido linha a linha:
+
+- Chamadas de tool escritas no texto (`send_whatsapp_buttons(...)`) são removidas
+- Linhas só com `{`, `}`, `[` ou `]` são removidas; linhas chave/valor dessas chamadas
+  (`"id": "1",`, `title: "x"`) só quando o texto tem esses restos de código,
+  para não apagar prosa como "Seu id: 123 confirmado"
+- `## Título` -> `*Título*`, `**negrito**` -> `*negrito*`, `` `código` `` -> `código`,
+  `[texto](url)` -> `texto (url)`
+- Espaços no fim das linhas removidos e no máximo uma linha em branco seguida
+
+Idempotente: format_for_whatsapp(format_for_whatsapp(x)) == format_for_whatsapp(x).
+Texto que já está formatado é detectado por uma única busca e devolvido sem
+reprocessar, então formatar de novo (grafo + envio) custa só essa busca.
+"""
+import re
+
+# Chamada de tool que o modelo às vezes escreve no conteúdo da mensagem
+_TOOL_CALL = re.compile(r"send_whatsapp_(?:buttons|list)\s*\(.*?\)\s*(?:\n|$)", re.DOTALL)
+
+# Linhas de código/JSON que sobram dessas chamadas (`"id": "1",`, `{"title": "x"}`, `buttons=[`)
+_CODE_LINE = re.compile(r"""^\s*[\[{]?\s*["']?(?:body_text|buttons|title|id)["']?\s*[:=]\s*["'\d\[{]""")
+_BRACKET_LINE = re.compile(r"^\s*[{}\[\]]\s*$")
+_BRACKET_LINES = re.compile(_BRACKET_LINE.pattern, re.MULTILINE)
+
+_HEADER = re.compile(r"^\s*#{2,6}\s+(.*)$")
+
+# Negrito, código e link em uma única alternância (o mais à esquerda vence)
+_INLINE = re.compile(r"\*\*(?P<bold>.*?)\*\*|`(?P<code>.*?)`|\[(?P<label>.*?)\]\((?P<url>.*?)\)")
+
+# Marcadores que o formatador alteraria (caminho rápido para texto já formatado).
+# Buscas separadas: substrings e padrões curtos são bem mais rápidos que uma alternância única.
+_MARKERS = ("**", "`", "](", "send_whatsapp_", " \n", "\t\n")
+_LINE_MARKER = re.compile(r"^\s*(?:#{2,6}\s|[{}\[\]]\s*$)", re.MULTILINE)
+_BLANK_RUN = re.compile(r"\n[ \t]*\n[ \t]*\n")
+
+
+def _inline_replace(match: re.Match) -> str:
+    if match.group("bold") is not None:
+        return f"*{match.group('bold')}*"
+    if match.group("code") is not None:
+        return match.group("code")
+    return f"{match.group('label')} ({match.group('url')})"
+
+
+def _format_inline(line: str) -> str:
+    # Repete até estabilizar (ex: `**x**` vira **x** e depois *x*); cada troca encurta a linha
+    while True:
+        formatted = _INLINE.sub(_inline_replace, line)
+        if formatted == line:
+            return line
+        line = formatted
+
+
+def is_formatted(text: str) -> bool:
+    """True se formatar o texto não mudaria nada"""
+    return (
+        text == text.strip()
+        and not any(marker in text for marker in _MARKERS)
+        and _LINE_MARKER.search(text) is None
+        and _BLANK_RUN.search(text) is None
+    )
+
+
+def format_for_whatsapp(text: str) -> str:
+    """Converte Markdown para a formatação do WhatsApp e limpa restos de tool calls"""
+    if not text or is_formatted(text):
+        return text or ""
+
+    # Linhas chave/valor só são código quando há restos de uma chamada no texto
+    leaked = "send_whatsapp_" in text or _BRACKET_LINES.search(text) is not None
+    if "send_whatsapp_" in text:
+        text = _TOOL_CALL.sub("", text)
+
+    lines = []
+    blank = False
+    for line in text.split("\n"):
+        if "*" in line or "`" in line or "[" in line:
+            line = _format_inline(line)
+
+        header = _HEADER.match(line)
+        if header:
+            title = header.group(1).strip().strip("*")
+            line = f"*{title}*" if title else ""
+
+        line = line.rstrip()
+        if _BRACKET_LINE.match(line) or (leaked and _CODE_LINE.match(line)):
+            continue
+
+        if not line:
+            blank = True
+            continue
+        if blank and lines:
+            lines.append("")
+        blank = False
+        lines.append(line)
+
+    return "\n".join(lines).strip()